@@ -2,33 +2,57 @@
 
 import sys
 import logging
+import threading
+import time
 import traceback
 
-from flask import Flask
+from flask import Flask, current_app
 from pathlib import Path
 from typing import List, Dict, Optional
 from pathlib import Path
 
 from . import models
+from .catalog import catalogVersion, readCatalog, readStatus, requestPrioritization, takePrioritizationRequests, writeCatalog, writeStatus
 from .config import config, set_data_path
 from .file import File
 from .project import Project
+from .scheduler import DownsampleScheduler
 from .shared import createEmptyJSONFile, getProcFNFromOrigFN
+from .slicecache import getRawCache, getSliceCache
 
 import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
 
 # Will hold loaded projects
 loadedProjects = []
 
-# Initiate the donwsampling pool
-downsamplePool = None
+# Will hold the downsampling scheduler
+downsampleScheduler = None
 
-def downsampleFile(filepath: str, destinationpath: str) -> bool:
+# Will hold the thread pool on which data for requests is assembled
+requestExecutor = None
+
+# Will hold the thread verifying projects in the background (see loadProjects)
+verifierThread = None
+
+# Whether projects are attached from the catalog of a coordinator process (see
+# attachProjects), the catalog version attached, and when it was last checked
+workerMode = False
+attachedCatalogVersion = None
+catalogCheckTime = 0.
+
+# Seconds between checks of a worker for a rewritten catalog
+catalogCheckInterval = 2.
+
+def downsampleFile(filepath: str, destinationpath: str, jobs: int = 1, progress=None) -> bool:
     """
-    Downsamples an original file, placing the processed file in the destination folder.
+    Downsamples an original file, placing the processed file in the destination folder. If the processed file
+    already exists, it is updated with the data added to the original file since (see File.process).
     Raises an exception in case of error.
     :param filepath: path to the original file
     :param destinationpath: path to the destination folder
+    :param jobs: number of worker processes with which to downsample the file's series concurrently
+    :param progress: optional callback, called as progress(done, total) with the number of series downsampled
     :return: None
     """
     fp = Path(filepath)
@@ -40,16 +64,122 @@ def downsampleFile(filepath: str, destinationpath: str) -> bool:
         raise Exception(f"Destination '{destinationpath}' does not exist or is not a directory.")
 
     ds_file = File(None, -1, fp, dp / getProcFNFromOrigFN(fp))
-    ds_file.process()
+    ds_file.process(jobs=jobs, progress=progress)
     ds_file.close()
     del ds_file
 
-# Sets a global downsample
-def instantiatePool(pool):
-    global downsamplePool
-    if downsamplePool is None: 
-        downsamplePool = pool
+# Sets up the global downsampling scheduler, if not already
+def instantiateScheduler():
+    global downsampleScheduler
+    if downsampleScheduler is None:
+        downsampleScheduler = DownsampleScheduler(downsampleFile, max(mp.cpu_count()//2, 1))
 
+def getDownsampleStatus(file: Optional[File] = None) -> Optional[Dict]:
+    """
+    Returns the status of downsampling (queue depth, per-file progress & ETA in seconds) as provided by
+    DownsampleScheduler.getStatus(), or the status of a single file if provided (None if the file has not been
+    scheduled for downsampling).
+    """
+    if workerMode:
+        status = readStatus()
+        if file is not None:
+            key = str(file.origFilePathObj.resolve())
+            return next((f for f in (status or {}).get('files', []) if f['file'] == key), None)
+        if status is not None:
+            return status
+    if downsampleScheduler is None:
+        return None if file is not None else {'processes': 0, 'queue_depth': 0, 'running': 0, 'done': 0, 'failed': 0, 'eta': 0., 'files': []}
+    if file is not None:
+        return downsampleScheduler.getFileStatus(file.origFilePathObj)
+    return downsampleScheduler.getStatus()
+
+def prioritizeDownsample(file: File) -> bool:
+    """
+    Moves the file to the front of the downsampling queue if it is waiting to be downsampled.
+    :return: whether the file was waiting to be downsampled (for a worker, whether the request was placed with the
+        coordinator)
+    """
+    if workerMode:
+        status = getDownsampleStatus(file)
+        if status is None or status['state'] != 'queued':
+            return False
+        requestPrioritization(file.origFilePathObj)
+        return True
+    if downsampleScheduler is None:
+        return False
+    return downsampleScheduler.prioritize(file.origFilePathObj)
+
+def attachProjects() -> Dict[int, Project]:
+    """
+    Attaches the projects of the catalog written by a coordinator process (see runCoordinator), without discovering
+    projects or files, checking the file system, or downsampling. Downsampling status & prioritization are deferred
+    to the coordinator. Projects are reattached as the coordinator rewrites the catalog. Returns the same output as
+    getProjects().
+    :return: dict mapped from project ID to project of all loaded projects
+    """
+
+    global workerMode
+
+    workerMode = True
+    refreshAttachedProjects(force=True)
+
+    return getProjects()
+
+def refreshAttachedProjects(force=False) -> None:
+    """
+    Reattaches the projects of the catalog if the coordinator has rewritten it since attached, checking at most every
+    catalogCheckInterval seconds unless forced. Projects & files already loaded are kept.
+    """
+
+    global attachedCatalogVersion, catalogCheckTime, loadedProjects
+
+    if not force and time.monotonic() - catalogCheckTime < catalogCheckInterval:
+        return
+    catalogCheckTime = time.monotonic()
+
+    version = catalogVersion()
+    if version == attachedCatalogVersion:
+        return
+
+    catalog = readCatalog()
+    if catalog is None:
+        logging.warning("No catalog found. Is the coordinator running (python -m auviewer.serve --coordinator)?")
+        return
+
+    logging.info("Attaching projects from the catalog.")
+
+    existing = {p.id: p for p in loadedProjects}
+    projects = []
+    for id, name, path, files in catalog:
+        if id in existing:
+            existing[id].loadCatalogFiles(files)
+            projects.append(existing[id])
+        else:
+            p = models.Project.query.filter_by(id=id).first()
+            if p is not None:
+                projects.append(Project(p, catalogFiles=files))
+
+    loadedProjects = projects
+    attachedCatalogVersion = version
+
+    logging.info("Finished attaching projects.")
+
+def getCacheStats() -> Dict:
+    """
+    Returns the hit & miss counters, number of blocks and size & budget in bytes of the server's caches of downsample
+    data & raw series data (see SliceCache.getStats).
+    """
+    return {'slices': getSliceCache().getStats(), 'raw': getRawCache().getStats()}
+
+def getRequestExecutor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool on which data for requests is assembled concurrently, sized by requestThreads in config,
+    instantiating it if needed.
+    """
+    global requestExecutor
+    if requestExecutor is None:
+        requestExecutor = ThreadPoolExecutor(max_workers=max(config['requestThreads'], 1), thread_name_prefix='auviewer-request')
+    return requestExecutor
 
 def getProject(id) -> Optional[Project]:
     """
@@ -57,6 +187,8 @@ def getProject(id) -> Optional[Project]:
     :return: the project instance belonging to the id, or None if not found
     """
     global loadedProjects
+    if workerMode:
+        refreshAttachedProjects()
     for p in loadedProjects:
         if p.id == id:
             return p
@@ -68,6 +200,8 @@ def getProjects() -> Dict[int, Project]:
     :return: dict mapped from project ID to project instance of all loaded projects
     """
     global loadedProjects
+    if workerMode:
+        refreshAttachedProjects()
     return {p.id: p for p in loadedProjects}
 
 def getProjectsPayload(user_id) -> List[Dict]:
@@ -79,7 +213,7 @@ def getProjectsPayload(user_id) -> List[Dict]:
     return [{
         'id': p.id,
         'name': p.name,
-        'files': len(p.files),
+        'files': len(p.fileRecords),
         'patterns': p.getTotalPatternCount(),
         'annotations': models.Annotation.query.filter_by(user_id=user_id, project_id=p.id).count(),
         'assignments_rem': models.User.query.filter_by(id=user_id).first().assignments_remaining,
@@ -137,25 +271,32 @@ def loadProject(id) -> Optional[Project]:
 
     return getProject(id)
 
-def loadProjects() -> Dict[int, Project]:
+def loadProjects(rescan=False, background=False, coordinator=False) -> Dict[int, Project]:
     """
-    Load or reload projects into memory. If new projects are found on disk, they
-    will be added to the database & loaded as well. Returns the same output as
-    getProjects().
+    Load or reload projects into memory from the database. If new projects are
+    found on disk, they will be added to the database & loaded as well. The
+    projects' files are then verified on the file system, new files discovered,
+    and files not yet processed scheduled for downsampling (see verifyProjects),
+    in a background thread if desired, so that projects may be listed & files
+    accessed meanwhile. Returns the same output as getProjects().
+    :param rescan: whether projects are being reloaded while files are being
+        downsampled, in which case partially processed files are left be
+    :param background: whether to verify the projects in a background thread
+    :param coordinator: whether running as the coordinator of a multi-worker
+        deployment, in which case the catalog of projects which worker
+        processes attach to is written (see runCoordinator)
     :return: dict mapped from project ID to project of all loaded projects
     """
 
-    global loadedProjects
+    global loadedProjects, verifierThread
 
-    # Instantiate a global downsample pool
-    pool = mp.Pool(processes=mp.cpu_count()//2)
-    instantiatePool(pool)
+    # Instantiate the global downsampling scheduler
+    instantiateScheduler()
 
     logging.info("Loading projects.")
 
     # Reset projects to empty list
-    loadedProjects = []
-    notProcessedFiles = []
+    projects = []
 
     # Load projects from the database
     projs = models.Project.query.all()
@@ -175,7 +316,7 @@ def loadProjects() -> Dict[int, Project]:
         else:
             # Instantiate project, and add to the list to be returned
             # TODO(gus): We need to have project take absolute path and project name!
-            loadedProjects.append(Project(p))
+            projects.append(Project(p, processNewFiles=False))
 
             logging.info("Finished loading project.")
 
@@ -215,33 +356,61 @@ def loadProjects() -> Dict[int, Project]:
 
             # Instantiate project
             # TODO(gus): We need to have project take absolute path and project name!
-            loadedProjects.append(Project(project))
+            projects.append(Project(project, processNewFiles=False))
 
-    # Delete all files that may have been downsampled incorrectly and adds unprocessed files to be downsampled
-    for project in loadedProjects:
-        for projFile in project.files:
-            tmp_file = Path(str(projFile.procFilePathObj)+'.tmp')
-            if tmp_file.exists():
+    loadedProjects = projects
+    if coordinator:
+        writeCatalog(loadedProjects)
+
+    logging.info("Finished loading projects.")
+
+    if background:
+        app = current_app._get_current_object()
+
+        def verify():
+            with app.app_context():
                 try:
-                    projFile.procFilePathObj.unlink(missing_ok=True)
+                    verifyProjects(projects, rescan, coordinator)
                 except Exception as e:
-                    raise RuntimeError(f"Downsample file {str(projFile.procFilePathObj)} exists and could not be deleted. The viewer will quit now. It is recommended that the processed file be deleted manually. \n{e}\n{traceback.format_exc()}")
-                else:
-                    tmp_file.unlink()
+                    logging.error(f"Unable to verify projects.\n{e}\n{traceback.format_exc()}")
 
-                logging.info(f"Partial processed file {str(projFile.procFilePathObj)} has been removed.")
-            
-            # Add all non processed files for downsampling
-            if not projFile.procFilePathObj.exists():
-                notProcessedFiles.append((str(projFile.origFilePathObj.resolve()), str(projFile.procFilePathObj.parent.resolve())))
+        verifierThread = threading.Thread(target=verify, name='auviewer-verifier', daemon=True)
+        verifierThread.start()
+    else:
+        verifyProjects(projects, rescan, coordinator)
 
-    for downsampParam in notProcessedFiles:
-        downsamplePool.apply_async(downsampleFile, downsampParam)
+    return getProjects()
 
+def runCoordinator() -> None:
+    """
+    Runs the coordinator of a multi-worker deployment until interrupted: loads projects & downsamples files, writing
+    the catalog of projects which worker processes attach to (see attachProjects), and rescans the projects every
+    coordinatorRescanInterval seconds (see config). The downsampling status is published to the workers, and their
+    prioritization requests taken, every second. Requires the data path to be set (see setDataPath).
+    """
 
-    logging.info("Finished loading projects.")
+    loadProjects(background=True, coordinator=True)
+    rescanTime = time.monotonic()
 
-    return getProjects()
+    logging.info("Coordinating.")
+
+    try:
+        while True:
+            for filepath in takePrioritizationRequests():
+                downsampleScheduler.prioritize(filepath)
+            writeStatus(downsampleScheduler.getStatus())
+
+            # Rescan, unless the projects are still being verified
+            verifying = verifierThread is not None and verifierThread.is_alive()
+            if config['coordinatorRescanInterval'] > 0 and not verifying and time.monotonic() - rescanTime >= config['coordinatorRescanInterval']:
+                loadProjects(rescan=True, coordinator=True)
+                rescanTime = time.monotonic()
+
+            time.sleep(1)
+    except KeyboardInterrupt:
+        logging.info("Coordinator interrupted.")
+    finally:
+        downsampleScheduler.close()
 
 def scaffoldProjectFolder(projDirPathObj):
     """Generate the baseline project folder contents as needed"""
@@ -285,6 +454,59 @@ def setDataPath(path, load_projects=False) -> None:
     if load_projects:
         loadProjects()
 
+def verifyProjects(projects, rescan=False, coordinator=False) -> None:
+    """
+    Verifies the files of the projects on the file system & discovers new files (see Project.verifyFiles &
+    Project.discoverFiles), removes partially processed files, schedules files not yet processed, or modified since,
+    for downsampling, and, if running as the coordinator, rewrites the catalog of projects.
+    :param projects: list of Project instances
+    :param rescan: whether files are being downsampled, in which case partially processed files are left be
+    :param coordinator: whether running as the coordinator of a multi-worker deployment (see runCoordinator)
+    """
+
+    logging.info("Verifying projects.")
+
+    notProcessedFiles = []
+
+    for project in projects:
+
+        project.verifyFiles()
+        project.discoverFiles()
+
+        # Delete all files that may have been downsampled incorrectly and adds unprocessed files to be downsampled
+        for _, origFilePathObj, procFilePathObj in project.fileRecords:
+            tmp_file = Path(str(procFilePathObj)+'.tmp')
+            if tmp_file.exists() and rescan:
+                continue
+            if tmp_file.exists():
+                try:
+                    procFilePathObj.unlink(missing_ok=True)
+                except Exception as e:
+                    raise RuntimeError(f"Downsample file {str(procFilePathObj)} exists and could not be deleted. The viewer will quit now. It is recommended that the processed file be deleted manually. \n{e}\n{traceback.format_exc()}")
+                else:
+                    tmp_file.unlink()
+
+                logging.info(f"Partial processed file {str(procFilePathObj)} has been removed.")
+
+            # Add all non processed files for downsampling, as well as files
+            # modified since they were processed (e.g. grown by live
+            # monitoring), whose downsamples will be extended. Files which
+            # failed to downsample are only retried once modified (see
+            # DownsampleScheduler.schedule).
+            try:
+                if not procFilePathObj.exists() or origFilePathObj.stat().st_mtime > procFilePathObj.stat().st_mtime:
+                    notProcessedFiles.append((str(origFilePathObj.resolve()), str(procFilePathObj.parent.resolve())))
+            except OSError as e:
+                logging.error(f"Unable to check whether {origFilePathObj} needs processing.\n{e}")
+
+    for downsampParam in notProcessedFiles:
+        downsampleScheduler.schedule(*downsampParam)
+
+    if coordinator:
+        writeCatalog(projects)
+
+    logging.info("Finished verifying projects.")
+
 def validateProjectFolder(projDirPathObj):
     """Raises an exception if the project folder is invalid"""
 
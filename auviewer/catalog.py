@@ -0,0 +1,127 @@
+"""
+Shared catalog of projects & files, through which server worker processes attach to the projects discovered by a
+coordinator process, along with the downsampling status and prioritization requests exchanged between them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path
+
+from .config import config
+
+def coordinatorDirPathObj():
+    """Returns the folder of the data directory holding the catalog, status & prioritization requests."""
+    return config['dataPathObj'] / 'coordinator'
+
+def catalogPathObj():
+    """Returns the path of the catalog, an SQLite database."""
+    return coordinatorDirPathObj() / 'catalog.sqlite'
+
+def statusPathObj():
+    """Returns the path of the downsampling status, a JSON file."""
+    return coordinatorDirPathObj() / 'downsample_status.json'
+
+def prioritizeDirPathObj():
+    """Returns the folder in which prioritization requests are placed, one file each."""
+    return coordinatorDirPathObj() / 'prioritize'
+
+def writeCatalog(projects):
+    """
+    Writes the catalog of the given projects & their files, replacing the catalog atomically, so that workers reading
+    the previous catalog are not disturbed.
+    :param projects: list of Project instances
+    """
+
+    coordinatorDirPathObj().mkdir(exist_ok=True)
+    tmpPathObj = catalogPathObj().with_name(f"{catalogPathObj().name}.{os.getpid()}.tmp")
+    tmpPathObj.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(str(tmpPathObj))
+    try:
+        conn.execute("CREATE TABLE projects (id INTEGER PRIMARY KEY, name TEXT, path TEXT)")
+        conn.execute("CREATE TABLE files (id INTEGER PRIMARY KEY, project_id INTEGER, name TEXT, orig_path TEXT, proc_path TEXT)")
+        conn.execute("CREATE INDEX files_project_id ON files (project_id)")
+        conn.executemany("INSERT INTO projects VALUES (?, ?, ?)", [(p.id, p.name, str(p.projDirPathObj)) for p in projects])
+        conn.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", [
+            (id, p.id, origFilePathObj.name, str(origFilePathObj), str(procFilePathObj)) for p in projects for id, origFilePathObj, procFilePathObj in p.fileRecords
+        ])
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmpPathObj, catalogPathObj())
+
+    logging.info(f"Wrote catalog of {len(projects)} projects to {catalogPathObj()}.")
+
+def readCatalog():
+    """
+    Reads the catalog, opened read-only.
+    :return: list of (project ID, name, path, files) tuples, where files is a list of (file ID, original file path,
+        processed file path) tuples in filename order, or None if there is no catalog
+    """
+
+    if not catalogPathObj().exists():
+        return None
+
+    conn = sqlite3.connect(f"file:{catalogPathObj()}?mode=ro", uri=True)
+    try:
+        projects = conn.execute("SELECT id, name, path FROM projects ORDER BY id").fetchall()
+        files = {}
+        for id, project_id, orig_path, proc_path in conn.execute("SELECT id, project_id, orig_path, proc_path FROM files ORDER BY name"):
+            files.setdefault(project_id, []).append((id, Path(orig_path), Path(proc_path)))
+    finally:
+        conn.close()
+
+    return [(id, name, path, files.get(id, [])) for id, name, path in projects]
+
+def catalogVersion():
+    """Returns a token which changes whenever the catalog is rewritten, or None if there is no catalog."""
+    try:
+        st = catalogPathObj().stat()
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns)
+
+def writeStatus(status):
+    """Writes the downsampling status (see DownsampleScheduler.getStatus) for workers to read, atomically."""
+    coordinatorDirPathObj().mkdir(exist_ok=True)
+    tmpPathObj = statusPathObj().with_name(f"{statusPathObj().name}.{os.getpid()}.tmp")
+    with tmpPathObj.open('w') as fp:
+        json.dump(status, fp)
+    os.replace(tmpPathObj, statusPathObj())
+
+def readStatus():
+    """Returns the downsampling status last written by the coordinator, or None if unavailable."""
+    try:
+        with statusPathObj().open() as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+def requestPrioritization(filepath):
+    """Places a request for the coordinator to prioritize downsampling of the original file."""
+    key = str(Path(filepath).resolve())
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    prioritizeDirPathObj().mkdir(parents=True, exist_ok=True)
+
+    # Write the request outside the folder and move it in, so that the
+    # coordinator never reads a partially written request.
+    tmpPathObj = coordinatorDirPathObj() / f"{name}.{os.getpid()}.tmp"
+    tmpPathObj.write_text(key)
+    os.replace(tmpPathObj, prioritizeDirPathObj() / name)
+
+def takePrioritizationRequests():
+    """Removes & returns the original file paths of the prioritization requests placed since last taken."""
+    keys = []
+    if not prioritizeDirPathObj().is_dir():
+        return keys
+    for p in prioritizeDirPathObj().iterdir():
+        try:
+            keys.append(p.read_text())
+            p.unlink()
+        except OSError:
+            continue
+    return keys
@@ -0,0 +1,223 @@
+"""Negotiated compression of responses and precompression of static assets."""
+
+import gzip
+import logging
+import os
+import zlib
+from pathlib import Path
+
+from .config import config
+
+# Brotli & Zstandard compression are available if the optional brotli &
+# zstandard packages are installed (pip install auviewer[compression]).
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Mimetypes of dynamic responses which are compressed
+compressibleMimetypes = ['application/json', 'application/octet-stream']
+
+# Suffixes of static assets which are precompressed (images & fonts other than
+# svg & ttf/eot are compressed already). HTML is left to the HTML minifier.
+compressibleSuffixes = ['.css', '.eot', '.js', '.json', '.map', '.svg', '.ttf', '.txt']
+
+# Levels at which static assets are precompressed, as this is done only once
+staticCompressionLevels = {'br': 11, 'gzip': 9, 'zstd': 19}
+
+def availableEncodings():
+    """Returns the content encodings available for compressing responses, in order of preference (see config)."""
+    return [e for e in config['compressionEncodings'] if e == 'gzip' or (e == 'br' and brotli is not None) or (e == 'zstd' and zstandard is not None)]
+
+def compress(data, encoding, level):
+    """Compresses data (bytes) with the content encoding ('gzip', 'br' or 'zstd') at the given level."""
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=level, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Unsupported content encoding {encoding}.")
+
+def iterCompress(pieces, encoding, level):
+    """
+    Compresses an iterable of pieces (bytes or str, encoded as UTF-8) with the content encoding at the given level,
+    yielding the compressed stream. The compressor is flushed after each piece, so that each piece reaches the client as
+    soon as it is produced.
+    """
+
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        process, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+    elif encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    elif encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        process, flush, finish = compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK), compressor.flush
+    else:
+        raise ValueError(f"Unsupported content encoding {encoding}.")
+
+    try:
+        for piece in pieces:
+            if isinstance(piece, str):
+                piece = piece.encode('utf-8')
+            compressed = process(piece) + flush()
+            if compressed:
+                yield compressed
+        yield finish()
+    finally:
+        if hasattr(pieces, 'close'):
+            pieces.close()
+
+def iterPrepend(head, pieces, source):
+    """Yields head followed by the rest of the iterator pieces, closing source (the iterable pieces was taken from) at the end."""
+    try:
+        yield head
+        yield from pieces
+    finally:
+        if hasattr(source, 'close'):
+            source.close()
+
+def negotiateEncoding(request, encodings):
+    """
+    Returns the content encoding among encodings (in order of preference) which the request accepts with the highest
+    quality, or None if the request accepts none of them.
+    """
+    best, bestQuality = None, 0
+    for e in encodings:
+        q = request.accept_encodings[e]
+        if q > bestQuality:
+            best, bestQuality = e, q
+    return best
+
+def precompressStaticAssets(staticFolders):
+    """
+    Precompresses the static assets in the given folders, with each encoding available, into the cache folder in the
+    data directory. Precompressed files are only rebuilt where the asset has been modified since.
+    :param staticFolders: dict mapping blueprint name to static folder path
+    :return: dict mapping (blueprint name, filename relative to its static folder) to a dict mapping each content
+        encoding to the path of the precompressed file
+    """
+
+    logging.info("Precompressing static assets.")
+
+    precompressed = {}
+    encodings = availableEncodings()
+    if len(encodings) == 0:
+        return precompressed
+
+    for name, folder in staticFolders.items():
+
+        folder = Path(folder)
+        cacheFolder = config['dataPathObj'] / 'cache' / 'static' / name
+
+        for assetPathObj in [p for p in folder.rglob('*') if p.is_file() and p.suffix in compressibleSuffixes]:
+
+            filename = assetPathObj.relative_to(folder).as_posix()
+            mtime = assetPathObj.stat().st_mtime
+            data = None
+
+            for e in encodings:
+                compressedPathObj = cacheFolder / f"{filename}.{e}"
+                try:
+                    if not compressedPathObj.exists() or compressedPathObj.stat().st_mtime < mtime:
+                        if data is None:
+                            data = assetPathObj.read_bytes()
+                        compressed = compress(data, e, staticCompressionLevels[e])
+
+                        # Only keep the precompressed file if it is smaller
+                        if len(compressed) >= len(data):
+                            continue
+
+                        # Write & move into place, as other server workers
+                        # may be precompressing the same assets.
+                        compressedPathObj.parent.mkdir(parents=True, exist_ok=True)
+                        tmpPathObj = compressedPathObj.with_name(f"{compressedPathObj.name}.{os.getpid()}.tmp")
+                        tmpPathObj.write_bytes(compressed)
+                        os.replace(tmpPathObj, compressedPathObj)
+                except OSError as err:
+                    logging.error(f"Unable to precompress static asset {assetPathObj}.\n{err}")
+                    continue
+                precompressed.setdefault((name, filename), {})[e] = compressedPathObj
+
+    logging.info("Finished precompressing static assets.")
+
+    return precompressed
+
+def compressResponse(request, response, precompressed):
+    """
+    Compresses a response with the content encoding negotiated with the request, if any. Static assets are served from
+    their precompressed files (see precompressStaticAssets), and dynamic responses of compressible mimetypes are
+    compressed if at least compressionMinSize bytes, at the level set by compressionLevels in config. Streamed
+    dynamic responses are compressed as they are streamed, once their first compressionMinSize bytes have been
+    produced (shorter streams are sent uncompressed). Responses already encoded are left as they are.
+    """
+
+    if response.status_code != 200 or 'Content-Encoding' in response.headers:
+        return response
+
+    # Static assets
+    if request.endpoint is not None and request.endpoint.endswith('.static'):
+        files = precompressed.get((request.blueprint, (request.view_args or {}).get('filename')))
+        if files is None:
+            return response
+        encoding = negotiateEncoding(request, [e for e in availableEncodings() if e in files])
+        if encoding is not None:
+            if hasattr(response.response, 'close'):
+                response.response.close()
+            response.direct_passthrough = False
+            response.set_data(files[encoding].read_bytes())
+            # The entity tag is made weak, as the encoded representation
+            # differs byte-wise, while conditional requests still match it.
+            etag, _ = response.get_etag()
+            if etag is not None:
+                response.set_etag(etag, weak=True)
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    # Dynamic responses
+    if response.mimetype not in compressibleMimetypes or response.direct_passthrough:
+        return response
+    response.vary.add('Accept-Encoding')
+
+    if response.is_streamed:
+        encoding = negotiateEncoding(request, availableEncodings())
+        if encoding is None:
+            return response
+
+        # Buffer the first pieces, up to compressionMinSize bytes. If the
+        # stream ends before then, the response is sent uncompressed.
+        pieces = iter(response.response)
+        head, size = [], 0
+        for piece in pieces:
+            if isinstance(piece, str):
+                piece = piece.encode('utf-8')
+            head.append(piece)
+            size += len(piece)
+            if size >= config['compressionMinSize']:
+                break
+        else:
+            if hasattr(response.response, 'close'):
+                response.response.close()
+            response.set_data(b''.join(head))
+            return response
+
+        response.response = iterCompress(iterPrepend(b''.join(head), pieces, response.response), encoding, config['compressionLevels'][encoding])
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    if response.content_length is None or response.content_length < config['compressionMinSize']:
+        return response
+    encoding = negotiateEncoding(request, availableEncodings())
+    if encoding is not None:
+        response.set_data(compress(response.get_data(), encoding, config['compressionLevels'][encoding]))
+        response.headers['Content-Encoding'] = encoding
+
+    return response
@@ -40,6 +40,75 @@ config = {
     # is 3K intervals, the second 6K, the third 12K, and so forth.
     'stepMultiplier': 2,
 
+    # The engine used to build the downsamples from raw data. 'cython' builds
+    # all downsamples in a single walk over the raw data (see cylib), and
+    # 'numpy' computes the finest downsample's intervals in bulk with
+    # vectorized operations and builds the rest from it (see nplib). Both yield
+    # identical downsamples.
+    'downsampleEngine': 'cython',
+
+    # If greater than 0, the number of rows of raw data to read from the
+    # original file at a time when building downsamples, bounding memory use
+    # by this rather than by the length of a series. The downsamples are then
+    # built with the streaming builder in cylib regardless of downsampleEngine,
+    # and are identical either way. If 0, each series is read in full.
+    'downsampleChunkSize': 0,
+
+    # Whether to also store the raw time & value columns of each series as
+    # contiguous float64 .npy files next to the processed file when processing
+    # a file. Raw data requests are then served by memory mapping them instead
+    # of reading the original file, leaving hot files to the OS page cache, at
+    # the cost of 16 bytes of disk per raw data point.
+    'rawColumnStore': False,
+
+    # When an original file has grown since it was downsampled, the downsamples
+    # of each series are extended with the new data only, keeping the interval
+    # sizes laid out at the last full downsampling. Once a series' data spans
+    # more than this multiple of the time it spanned then, it is downsampled
+    # again in full instead, so that the coarsest downsample stays near M
+    # intervals.
+    'downsampleMaxGrowth': 2,
+
+    # Memory budget, in megabytes, of the server's cache of downsample data
+    # read from processed files, shared by all requests (see slicecache). The
+    # least recently used data is evicted beyond it. If 0, nothing is cached.
+    'sliceCacheSizeMB': 256,
+
+    # Memory budget, in megabytes, of the cache of raw series data read for
+    # pattern detection, shared by all series (see slicecache), so that
+    # repeated detection on a series, e.g. while tuning thresholds, does not
+    # read it again. The least recently used series are evicted beyond it. If
+    # 0, nothing is cached.
+    'rawCacheSizeMB': 512,
+
+    # Number of threads on which the server assembles data for requests
+    # concurrently, e.g. the files of a batch ranged data request.
+    'requestThreads': 4,
+
+    # Content encodings with which to compress JSON & binary data responses,
+    # in order of preference, where the client accepts them. 'br' & 'zstd'
+    # require the optional brotli & zstandard packages, and are skipped if not
+    # installed. Static assets are precompressed with the same encodings. If
+    # empty, responses are not compressed.
+    'compressionEncodings': ['br', 'zstd', 'gzip'],
+
+    # Minimum size, in bytes, of a data response to compress it. Streamed
+    # responses are buffered up to this size to decide.
+    'compressionMinSize': 1024,
+
+    # Compression level of data responses, by content encoding
+    'compressionLevels': {'br': 4, 'gzip': 6, 'zstd': 3},
+
+    # Number of worker processes in which Project.detectPatterns runs pattern
+    # detection on the files of a project concurrently. If 0, the number of
+    # CPUs is used, and if 1, files are processed in the calling process.
+    'patternDetectionProcesses': 0,
+
+    # Seconds between rescans of the projects for new & modified files by the
+    # coordinator of a multi-worker deployment (python -m auviewer.serve
+    # --coordinator). If 0, projects are only scanned at startup.
+    'coordinatorRescanInterval': 60,
+
 
 
     ### Asset locations
@@ -188,6 +257,19 @@ def load_config(cp):
         'rootWebPath',
         'secret_key',
         'mail',
+
+        'downsampleEngine',
+        'downsampleChunkSize',
+        'rawColumnStore',
+        'downsampleMaxGrowth',
+        'sliceCacheSizeMB',
+        'rawCacheSizeMB',
+        'requestThreads',
+        'compressionEncodings',
+        'compressionMinSize',
+        'compressionLevels',
+        'patternDetectionProcesses',
+        'coordinatorRescanInterval',
     ]
 
     # Set/override any valid settings provided in the json config file
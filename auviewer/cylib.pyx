@@ -3,6 +3,7 @@
 #cython: wraparound=False
 #cython: cdivision=True
 
+cimport cython
 import logging
 import numpy as np
 cimport numpy as np
@@ -16,7 +17,7 @@ from libc.math cimport floor
 def buildNextDownsampleUp(np.ndarray[np.float64_t, ndim=2] intervalsOrig, double timePerIntervalOrig, int stepMultiplier):
 
     # Get the number of intervals in the original downsample.
-    cdef int numIntervalsOrig = intervalsOrig.shape[0]
+    cdef Py_ssize_t numIntervalsOrig = intervalsOrig.shape[0]
 
     # Do a sanity check
     if numIntervalsOrig < stepMultiplier:
@@ -27,7 +28,35 @@ def buildNextDownsampleUp(np.ndarray[np.float64_t, ndim=2] intervalsOrig, double
     # original downsample (for example, if each interval of the original
     # downsample were separated from the other by at least
     # timePerIntervalOrig * stepMultiplier.
-    cdef np.ndarray[np.float64_t, ndim=2] intervalsNew = np.zeros((numIntervalsOrig, 3))
+    intervalsNew = np.zeros((numIntervalsOrig, 3))
+
+    cdef const double[:, :] intervalsOrigView = intervalsOrig
+    cdef double[:, ::1] intervalsNewView = intervalsNew
+
+    # Holds the number of new intervals, and the number of times the floating
+    # point heuristic has been used.
+    cdef Py_ssize_t numIntervalsNew
+    cdef Py_ssize_t numHeuristic = 0
+
+    # Build the new downsample without holding the GIL
+    with nogil:
+        numIntervalsNew = buildNextDownsampleUpKernel(intervalsOrigView, intervalsNewView, timePerIntervalOrig, stepMultiplier, &numHeuristic)
+
+    if numHeuristic > 0:
+        logging.info(f"Used the while heuristic for {numHeuristic} intervals.")
+
+    # Slice off the unused intervals and return the new downsample intervals
+    return intervalsNew[:numIntervalsNew]
+
+# Typed-memoryview kernel of buildNextDownsampleUp, which may be run without
+# the GIL. Writes the new downsample into intervalsNew, which must be zeroed and
+# have room for as many intervals as intervalsOrig, and returns the number of
+# new intervals. The number of times the floating point heuristic was used is
+# added to numHeuristic.
+cdef Py_ssize_t buildNextDownsampleUpKernel(const double[:, :] intervalsOrig, double[:, ::1] intervalsNew, double timePerIntervalOrig, int stepMultiplier, Py_ssize_t* numHeuristic) noexcept nogil:
+
+    # Get the number of intervals in the original downsample.
+    cdef Py_ssize_t numIntervalsOrig = intervalsOrig.shape[0]
 
     # Determine the new time-per-interval
     cdef double timePerIntervalNew = timePerIntervalOrig*stepMultiplier
@@ -41,12 +70,13 @@ def buildNextDownsampleUp(np.ndarray[np.float64_t, ndim=2] intervalsOrig, double
     cdef double rightboundaryNew = leftboundaryNew + timePerIntervalNew
 
     # Holds the index of the current original interval we're working on.
-    cdef int cio = 0
+    cdef Py_ssize_t cio = 0
 
     # Holds the index of the current new interval we're working on. We start at
     # -1 because the loop will increment the index the first time it runs in
-    # order to point to the "first" interval.
-    cdef int cin = -1
+    # order to point to the "first" interval. Since every new interval takes at
+    # least one original interval, it cannot run past numIntervalsOrig.
+    cdef Py_ssize_t cin = -1
 
     # Temporary-use iterator to be used below
     cdef int i
@@ -83,7 +113,9 @@ def buildNextDownsampleUp(np.ndarray[np.float64_t, ndim=2] intervalsOrig, double
         # 270-330MM data points range.
         while intervalsOrig[cio,0] >= rightboundaryNew:
 
-            logging.info("Using the while heuristic for data point " + str(intervalsOrig[cio,0]))
+            # Count the use of the heuristic (it is logged once done, as we may
+            # not log without the GIL).
+            numHeuristic[0] = numHeuristic[0] + 1
 
             # Update left & right boundaries to the next interval
             leftboundaryNew = rightboundaryNew
@@ -92,10 +124,6 @@ def buildNextDownsampleUp(np.ndarray[np.float64_t, ndim=2] intervalsOrig, double
         # Increment the current index pointer to the next available interval.
         cin = cin + 1
 
-        # Do a sanity check and double check that we have not gone out of bounds.
-        if cin >= numIntervalsOrig:
-            raise RuntimeError("Unexpectedly require more than numIntervalsOrig during downsample building from downsample.")
-
         # Prime the min & max of the new interval to the first original interval
         intervalsNew[cin,1] = intervalsOrig[cio,1]
         intervalsNew[cin,2] = intervalsOrig[cio,2]
@@ -120,18 +148,18 @@ def buildNextDownsampleUp(np.ndarray[np.float64_t, ndim=2] intervalsOrig, double
         # average time offset of the original intervals represented.
         intervalsNew[cin,0] = intervalsNew[cin,0] / i
 
-    # Slice off the unused intervals
-    intervalsNew = intervalsNew[:cin+1]
-
-    # Return the new downsample intervals
-    return intervalsNew
+    # Return the number of new intervals
+    return cin + 1
 
 # Given a series of raw values and a time-per-interval parameter, produces and
 # returns a two-dimension NumPy array of downsample intervals
 def buildDownsampleFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarray[np.float64_t, ndim=1] rawValues, int numIntervals):
 
+    # Grab data points length so we don't have to look it up every time.
+    cdef Py_ssize_t numDataPoints = rawOffsets.shape[0]
+
     # Calculate the timespan of the entire dataset
-    cdef double timespan = rawOffsets[rawOffsets.shape[0]-1] - rawOffsets[0]
+    cdef double timespan = rawOffsets[numDataPoints-1] - rawOffsets[0]
 
     # Calculate the interval size in seconds
     cdef double timePerInterval = timespan / numIntervals
@@ -143,7 +171,43 @@ def buildDownsampleFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarr
     # Allocate the maximum number of intervals needed (excess will be sliced off
     # at the end). The two-dimensional array will have 3 columns and numIntervals
     # rows. The columns, in order, will be: Time Offset, Min, Max, # Points.
-    cdef np.ndarray[np.float64_t, ndim=2] intervals = np.zeros((numIntervals, 3))
+    intervals = np.zeros((numIntervals, 3))
+
+    cdef const double[:] rawOffsetsView = rawOffsets
+    cdef const double[:] rawValuesView = rawValues
+    cdef double[:, ::1] intervalsView = intervals
+
+    # Holds the number of intervals built, and the index of the data point at
+    # which building stopped if it ran out of intervals.
+    cdef Py_ssize_t numIntervalsBuilt
+    cdef Py_ssize_t cdpi = 0
+
+    # Build the downsample without holding the GIL
+    with nogil:
+        numIntervalsBuilt = buildDownsampleFromRawKernel(rawOffsetsView, rawValuesView, intervalsView, timePerInterval, &cdpi)
+
+    # Do a sanity check. We don't expect to ever need more than numIntervals
+    # intervals. However, double check that we have not gone out of bounds.
+    if numIntervalsBuilt < 0:
+        raise RuntimeError(f"Unexpectedly required more than numIntervals intervals during downsample building from raw. numIntervals: {numIntervals}, timePerInterval: {timePerInterval}, cdpi: {cdpi}, numDataPoints: {numDataPoints}, rawOffsets[cdpi]: {rawOffsets[cdpi]}, rawValues[cdpi]: {rawValues[cdpi]}")
+
+    # TODO(gus): TEMP
+    if numIntervalsBuilt > origNumIntervals:
+        # TODO(gus): I've made this an error because it's not relevant for users,
+        # but this should be watched when next working on downsampling.
+        logging.info(f"Exceeded numIntervals! origNumIntervals: {origNumIntervals}, numIntervals: {numIntervals}, timePerInterval: {timePerInterval}, intervals: {numIntervalsBuilt}, numDataPoints: {numDataPoints}")
+
+    # Slice off the unused intervals and return the downsampled intervals
+    return intervals[:numIntervalsBuilt]
+
+# Typed-memoryview kernel of buildDownsampleFromRaw, which may be run without
+# the GIL. Writes the downsample intervals into the intervals provided and
+# returns their number, or -1 if the intervals ran out, in which case the index
+# of the data point which required another interval is written to cdpiOut.
+cdef Py_ssize_t buildDownsampleFromRawKernel(const double[:] rawOffsets, const double[:] rawValues, double[:, ::1] intervals, double timePerInterval, Py_ssize_t* cdpiOut) noexcept nogil:
+
+    # The maximum number of intervals which may be built
+    cdef Py_ssize_t numIntervals = intervals.shape[0]
 
     # This is the base offset, or the time offset of the first data point.
     cdef double baseOffset = rawOffsets[0]
@@ -153,17 +217,15 @@ def buildDownsampleFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarr
     cdef double rightboundary = leftboundary + timePerInterval
 
     # Grab data points length so we don't have to look it up every time.
-    cdef int numDataPoints = rawOffsets.shape[0]
+    cdef Py_ssize_t numDataPoints = rawOffsets.shape[0]
 
     # Holds the index of the current data point we're working on.
-    cdef int cdpi = 0
+    cdef Py_ssize_t cdpi = 0
 
     # Holds the index of the current interval we're working on. We start at -1
     # because the loop will increment the index the first time it runs in order
     # to point to the "first" interval.
-    cdef int cii = -1
-
-    cdef double leftboundaryORIG, rightboundaryORIG, leftboundaryIF, rightboundaryIF, leftboundaryWHILE, rightboundaryWHILE
+    cdef Py_ssize_t cii = -1
 
     # For all data points
     while cdpi < numDataPoints:
@@ -198,8 +260,6 @@ def buildDownsampleFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarr
         # 270-330MM data points range.
         while rawOffsets[cdpi] >= rightboundary:
 
-            #print("Using the while heuristic for data point " + str(rawOffsets[cdpi]))
-
             # Update left & right boundaries to the next interval
             leftboundary = rightboundary
             rightboundary = leftboundary + timePerInterval
@@ -207,10 +267,10 @@ def buildDownsampleFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarr
         # Increment the current index pointer to the next available interval.
         cii = cii + 1
 
-        # Do a sanity check. We don't expect to ever need more than numIntervals
-        # intervals. However, double check that we have not gone out of bounds.
+        # If we have run out of intervals, stop and let the caller know.
         if cii >= numIntervals:
-            raise RuntimeError("Unexpectedly required more than numIntervals intervals during downsample building from raw. numIntervals: "+str(numIntervals)+", cii: "+str(cii)+", leftboundary: "+str(leftboundary)+", rightboundary: "+str(rightboundary)+", cdpi: "+str(cdpi)+", numDataPoints: "+str(numDataPoints)+", rawOffsets[cdpi]: "+str(rawOffsets[cdpi])+", rawValues[cdpi]: "+str(rawValues[cdpi]))
+            cdpiOut[0] = cdpi
+            return -1
 
         # Set the time for the interval
         intervals[cii,0] = leftboundary + (timePerInterval / 2)
@@ -232,17 +292,479 @@ def buildDownsampleFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarr
             # Increment cdpi to progress to the next data point
             cdpi = cdpi + 1
 
-    # TODO(gus): TEMP
-    if cii >= origNumIntervals:
-        # TODO(gus): I've made this an error because it's not relevant for users,
-        # but this should be watched when next working on downsampling.
-        logging.info("Exceeded numIntervals! origNumIntervals: "+str(origNumIntervals)+", numIntervals: "+str(numIntervals)+", timePerInterval: "+str(timePerInterval)+", cii: "+str(cii)+", leftboundary: "+str(leftboundary)+", rightboundary: "+str(rightboundary)+", cdpi: "+str(cdpi)+", numDataPoints: "+str(numDataPoints)+", rawOffsets[cdpi]: "+str(rawOffsets[cdpi])+", rawValues[cdpi]: "+str(rawValues[cdpi]))
+    # Return the number of intervals built
+    return cii + 1
+
+# Holds the intervals completed by a downsample builder (see DownsampleBuilder
+# and DownsampleLevelBuilder below) in a buffer which grows as needed, and
+# passes each completed interval on to the builder of the next downsample up,
+# if there is one.
+cdef class _DownsampleIntervals:
+
+    # Holds the completed intervals. The columns, in order, are: Time Offset,
+    # Min, Max. The buffer is allocated with the expected number of intervals
+    # and doubled whenever it runs out of room. The number of intervals it has
+    # room for is held in numAllocated (0 while there is no buffer).
+    cdef object buffer
+    cdef double[:, ::1] intervals
+    cdef Py_ssize_t capacity
+    cdef Py_ssize_t numAllocated
+
+    # Number of completed intervals in the buffer, and number of completed
+    # intervals already released from the builder.
+    cdef Py_ssize_t numCompleted
+    cdef Py_ssize_t numTaken
+
+    # The builder of the next downsample up, or None
+    cdef DownsampleLevelBuilder up
+
+    def __init__(self, Py_ssize_t expectedIntervals):
+        self.capacity = max(expectedIntervals, 1)
+        self.buffer = None
+        self.numAllocated = 0
+        self.numCompleted = 0
+        self.numTaken = 0
+        self.up = None
+
+    # Stores a completed interval and passes it on to the next builder up. This
+    # holds the GIL only to allocate or grow the buffer.
+    cdef int complete(self, double t, double intervalMin, double intervalMax) except -1 nogil:
+
+        # Allocate or grow the buffer if necessary
+        if self.numCompleted >= self.numAllocated:
+            with gil:
+                self.growBuffer()
+
+        self.intervals[self.numCompleted,0] = t
+        self.intervals[self.numCompleted,1] = intervalMin
+        self.intervals[self.numCompleted,2] = intervalMax
+        self.numCompleted = self.numCompleted + 1
+
+        if self.up is not None:
+            self.up.add(t, intervalMin, intervalMax)
+
+        return 0
+
+    # Allocates the buffer, or doubles it if already allocated.
+    cdef int growBuffer(self) except -1:
+
+        if self.buffer is None:
+            self.buffer = np.zeros((self.capacity, 3))
+        else:
+            self.capacity = self.capacity * 2
+            grown = np.zeros((self.capacity, 3))
+            grown[:self.numCompleted] = self.buffer[:self.numCompleted]
+            self.buffer = grown
 
-    # Slice off the unused intervals
-    intervals = intervals[:cii+1]
+        self.intervals = self.buffer
+        self.numAllocated = self.capacity
 
-    # Return the downsampled intervals
-    return intervals
+        return 0
+
+    # Returns the intervals completed since the last call, and releases them
+    # from the builder.
+    def takeIntervals(self):
+
+        if self.buffer is None:
+            return np.zeros((0, 3))
+
+        intervals = self.buffer[:self.numCompleted]
+        self.buffer = None
+        self.intervals = None
+        self.numAllocated = 0
+        self.numTaken = self.numTaken + self.numCompleted
+        self.numCompleted = 0
+
+        return intervals
+
+# Builds a downsample from an already-built downsample which is provided one
+# interval at a time, yielding the same intervals as buildNextDownsampleUp would
+# for the complete downsample. Each completed interval is passed on to the
+# builder of the next downsample up, so a chain of these builders produces every
+# coarser downsample level in a single sweep.
+@cython.final
+cdef class DownsampleLevelBuilder(_DownsampleIntervals):
+
+    # Time-per-interval of the original downsample and of the new one
+    cdef double timePerIntervalOrig
+    cdef double timePerIntervalNew
+    cdef int stepMultiplier
+
+    # The base offset and the boundaries of the current new interval
+    cdef double baseOffset
+    cdef double leftboundaryNew
+    cdef double rightboundaryNew
+
+    # Number of original intervals received so far
+    cdef Py_ssize_t numIntervalsOrig
+
+    # Number of original intervals in the current new interval (0 if no new
+    # interval is open), and the running time offset sum, min & max thereof.
+    cdef int i
+    cdef double sumTime
+    cdef double currentMin
+    cdef double currentMax
+
+    # Number of times the floating point heuristic has been used
+    cdef Py_ssize_t numHeuristic
+
+    def __init__(self, double timePerIntervalOrig, int stepMultiplier, Py_ssize_t expectedIntervals):
+        super().__init__(expectedIntervals)
+        self.timePerIntervalOrig = timePerIntervalOrig
+        self.timePerIntervalNew = timePerIntervalOrig*stepMultiplier
+        self.stepMultiplier = stepMultiplier
+        self.numIntervalsOrig = 0
+        self.i = 0
+        self.numHeuristic = 0
+
+    # Adds the next interval of the original downsample.
+    cdef int add(self, double t, double intervalMin, double intervalMax) except -1 nogil:
+
+        # The first original interval establishes the base offset (see
+        # buildNextDownsampleUp).
+        if self.numIntervalsOrig == 0:
+            self.baseOffset = t - (self.timePerIntervalOrig / 2)
+            self.leftboundaryNew = self.baseOffset
+            self.rightboundaryNew = self.leftboundaryNew + self.timePerIntervalNew
+        self.numIntervalsOrig = self.numIntervalsOrig + 1
+
+        # If this original interval belongs to the open new interval, add it to
+        # the new interval's statistics and return.
+        if self.i > 0:
+            if self.i < self.stepMultiplier and t < self.rightboundaryNew:
+                if intervalMin < self.currentMin:
+                    self.currentMin = intervalMin
+                if intervalMax > self.currentMax:
+                    self.currentMax = intervalMax
+                self.sumTime = self.sumTime + t
+                self.i = self.i + 1
+                return 0
+
+            # Otherwise, the open new interval is complete.
+            self.completeOpenInterval()
+
+        # Compute the new interval boundaries to which this original interval
+        # belongs, including the floating point heuristic, exactly as in
+        # buildNextDownsampleUp.
+        if t >= self.rightboundaryNew:
+            self.leftboundaryNew = floor( (t-self.baseOffset) / self.timePerIntervalNew) * self.timePerIntervalNew + self.baseOffset
+            self.rightboundaryNew = self.leftboundaryNew + self.timePerIntervalNew
+        while t >= self.rightboundaryNew:
+            self.numHeuristic = self.numHeuristic + 1
+            self.leftboundaryNew = self.rightboundaryNew
+            self.rightboundaryNew = self.leftboundaryNew + self.timePerIntervalNew
+
+        # Open a new interval with this original interval
+        self.currentMin = intervalMin
+        self.currentMax = intervalMax
+        self.sumTime = 0
+        self.sumTime = self.sumTime + t
+        self.i = 1
+
+        return 0
+
+    # Completes the open new interval, dividing its time offset sum by the
+    # number of original intervals represented to yield their average.
+    cdef int completeOpenInterval(self) except -1 nogil:
+        self.complete(self.sumTime / self.i, self.currentMin, self.currentMax)
+        self.i = 0
+        return 0
+
+    # Returns the state of the builder as a JSON-compatible dict, from which a
+    # builder may resume with setState (see DownsampleBuilder.getState).
+    def getState(self):
+        return {
+            'timePerIntervalOrig': self.timePerIntervalOrig,
+            'stepMultiplier': self.stepMultiplier,
+            'baseOffset': self.baseOffset,
+            'leftboundaryNew': self.leftboundaryNew,
+            'rightboundaryNew': self.rightboundaryNew,
+            'numIntervalsOrig': self.numIntervalsOrig,
+            'i': self.i,
+            'sumTime': self.sumTime,
+            'currentMin': self.currentMin,
+            'currentMax': self.currentMax,
+            'numIntervals': self.numCompleted + self.numTaken,
+        }
+
+    # Restores the state returned by getState to a newly-created builder of the
+    # same time-per-interval & step multiplier. The intervals completed before
+    # the state was taken count as already released.
+    def setState(self, state):
+
+        if state['timePerIntervalOrig'] != self.timePerIntervalOrig or state['stepMultiplier'] != self.stepMultiplier:
+            raise ValueError("Downsample level builder state does not match the builder's time-per-interval & step multiplier.")
+        if self.numCompleted + self.numTaken > 0:
+            raise RuntimeError("Downsample level builder state may only be restored to a newly-created builder.")
+
+        self.baseOffset = state['baseOffset']
+        self.leftboundaryNew = state['leftboundaryNew']
+        self.rightboundaryNew = state['rightboundaryNew']
+        self.numIntervalsOrig = state['numIntervalsOrig']
+        self.i = state['i']
+        self.sumTime = state['sumTime']
+        self.currentMin = state['currentMin']
+        self.currentMax = state['currentMax']
+        self.numTaken = state['numIntervals']
+
+    # Completes the open new interval, if any, once all original intervals have
+    # been added, and finishes the builders further up.
+    def finish(self):
+
+        # Do a sanity check (see buildNextDownsampleUp)
+        if self.numIntervalsOrig < self.stepMultiplier:
+            raise RuntimeError(f"Unable to build downsample from {self.numIntervalsOrig} intervals with a step multiplier of {self.stepMultiplier}.")
+
+        if self.i > 0:
+            self.completeOpenInterval()
+
+        if self.numHeuristic > 0:
+            logging.info(f"Used the while heuristic for {self.numHeuristic} intervals.")
+
+        if self.up is not None:
+            self.up.finish()
+
+# Builds a downsample from raw data which is provided in one or more consecutive
+# blocks, yielding the same intervals as buildDownsampleFromRaw would for the
+# complete raw data. If time-per-interval values for coarser downsamples are
+# provided, a chain of DownsampleLevelBuilder is attached so that all downsample
+# levels are produced in the same sweep over the raw data.
+cdef class DownsampleBuilder(_DownsampleIntervals):
+
+    # The base offset (time offset of the first data point) and time-per-interval
+    cdef double baseOffset
+    cdef double timePerInterval
+
+    # The requested number of intervals, and the maximum number allowed
+    cdef Py_ssize_t origNumIntervals
+    cdef Py_ssize_t numIntervals
+
+    # The boundaries of the current interval
+    cdef double leftboundary
+    cdef double rightboundary
+
+    # Whether an interval is open, and its time offset, min & max
+    cdef bint open
+    cdef double currentTime
+    cdef double currentMin
+    cdef double currentMax
+
+    # Number of raw data points received so far
+    cdef Py_ssize_t numDataPoints
+
+    # Builders of all downsamples, finest first
+    cdef list levels
+
+    # If blockIntervals is provided, the intervals are expected to be taken
+    # after every block of raw data added, so no buffer starts out larger than
+    # that rather than at the number of intervals expected in total.
+    def __init__(self, double baseOffset, double timePerInterval, Py_ssize_t numIntervals, timePerIntervalsUp=(), int stepMultiplier=1, Py_ssize_t blockIntervals=0):
+
+        cdef _DownsampleIntervals below
+        cdef DownsampleLevelBuilder level
+        cdef Py_ssize_t expectedIntervals = numIntervals
+
+        # Allocate one interval more, as rounding of interval boundaries may add one
+        super().__init__(numIntervals + 1 if blockIntervals < 1 else min(numIntervals + 1, blockIntervals))
+        self.origNumIntervals = numIntervals
+        self.numIntervals = numIntervals + 1
+
+        self.baseOffset = baseOffset
+        self.timePerInterval = timePerInterval
+        self.leftboundary = baseOffset
+        self.rightboundary = self.leftboundary + timePerInterval
+        self.open = False
+        self.numDataPoints = 0
+
+        # Chain the builders of the coarser downsamples
+        self.levels = [self]
+        below = self
+        for timePerIntervalOrig in timePerIntervalsUp:
+            expectedIntervals = expectedIntervals // stepMultiplier + 1
+            level = DownsampleLevelBuilder(timePerIntervalOrig, stepMultiplier, expectedIntervals if blockIntervals < 1 else min(expectedIntervals, blockIntervals))
+            below.up = level
+            below = level
+            self.levels.append(level)
+
+    # Adds the next block of raw data, without holding the GIL other than to
+    # grow the interval buffers.
+    def addRaw(self, const double[:] rawOffsets, const double[:] rawValues):
+
+        with nogil:
+            self.addRawKernel(rawOffsets, rawValues)
+
+    # Typed-memoryview kernel of addRaw.
+    cdef int addRawKernel(self, const double[:] rawOffsets, const double[:] rawValues) except -1 nogil:
+
+        cdef Py_ssize_t numBlockPoints = rawOffsets.shape[0]
+
+        # Holds the index of the current data point we're working on.
+        cdef Py_ssize_t cdpi = 0
+
+        for cdpi in range(numBlockPoints):
+
+            # If the data point belongs to the open interval, update the
+            # interval's min & max and move on to the next data point.
+            if self.open:
+                if rawOffsets[cdpi] < self.rightboundary:
+                    if self.currentMin > rawValues[cdpi]:
+                        self.currentMin = rawValues[cdpi]
+                    if self.currentMax < rawValues[cdpi]:
+                        self.currentMax = rawValues[cdpi]
+                    continue
+
+                # Otherwise, the open interval is complete.
+                self.complete(self.currentTime, self.currentMin, self.currentMax)
+                self.open = False
+
+            # Compute the interval boundaries to which the data point belongs,
+            # including the floating point heuristic, exactly as in
+            # buildDownsampleFromRaw.
+            if rawOffsets[cdpi] >= self.rightboundary:
+                self.leftboundary = floor( (rawOffsets[cdpi]-self.baseOffset) / self.timePerInterval) * self.timePerInterval + self.baseOffset
+                self.rightboundary = self.leftboundary + self.timePerInterval
+            while rawOffsets[cdpi] >= self.rightboundary:
+                self.leftboundary = self.rightboundary
+                self.rightboundary = self.leftboundary + self.timePerInterval
+
+            # Do a sanity check. We don't expect to ever need more than
+            # numIntervals intervals.
+            if self.numCompleted + self.numTaken >= self.numIntervals:
+                with gil:
+                    raise RuntimeError(f"Unexpectedly required more than numIntervals intervals during downsample building from raw. numIntervals: {self.numIntervals}, leftboundary: {self.leftboundary}, rightboundary: {self.rightboundary}, data point: {self.numDataPoints + cdpi}, rawOffsets[cdpi]: {rawOffsets[cdpi]}, rawValues[cdpi]: {rawValues[cdpi]}")
+
+            # Open a new interval with this data point
+            self.open = True
+            self.currentTime = self.leftboundary + (self.timePerInterval / 2)
+            self.currentMin = rawValues[cdpi]
+            self.currentMax = rawValues[cdpi]
+
+        self.numDataPoints = self.numDataPoints + numBlockPoints
+
+    # Returns the state of the builder and of the builders of all coarser
+    # downsamples as a JSON-compatible dict, including the number of intervals
+    # each has completed. If taken before finish(), a builder restored with the
+    # state by setState may be given further raw data, yielding the same
+    # intervals as if all raw data had been added to this builder: each
+    # downsample's intervals up to the number recorded in the state, followed
+    # by those of the restored builder.
+    def getState(self):
+        return {
+            'baseOffset': self.baseOffset,
+            'timePerInterval': self.timePerInterval,
+            'leftboundary': self.leftboundary,
+            'rightboundary': self.rightboundary,
+            'open': bool(self.open),
+            'currentTime': self.currentTime,
+            'currentMin': self.currentMin,
+            'currentMax': self.currentMax,
+            'numDataPoints': self.numDataPoints,
+            'numIntervals': self.numCompleted + self.numTaken,
+            'levels': [level.getState() for level in self.levels[1:]],
+        }
+
+    # Restores the state returned by getState to a newly-created builder of the
+    # same base offset, time-per-interval, and coarser downsamples.
+    def setState(self, state):
+
+        cdef DownsampleLevelBuilder level
+
+        if state['baseOffset'] != self.baseOffset or state['timePerInterval'] != self.timePerInterval or len(state['levels']) != len(self.levels) - 1:
+            raise ValueError("Downsample builder state does not match the builder's base offset, time-per-interval & downsamples.")
+        if self.numCompleted + self.numTaken > 0 or self.numDataPoints > 0:
+            raise RuntimeError("Downsample builder state may only be restored to a newly-created builder.")
+
+        self.leftboundary = state['leftboundary']
+        self.rightboundary = state['rightboundary']
+        self.open = state['open']
+        self.currentTime = state['currentTime']
+        self.currentMin = state['currentMin']
+        self.currentMax = state['currentMax']
+        self.numDataPoints = state['numDataPoints']
+        self.numTaken = state['numIntervals']
+
+        for level, levelState in zip(self.levels[1:], state['levels']):
+            level.setState(levelState)
+
+    # Completes the open intervals once all raw data has been added, and
+    # returns the list of all downsamples built (finest first).
+    def finish(self):
+
+        if self.open:
+            self.complete(self.currentTime, self.currentMin, self.currentMax)
+            self.open = False
+
+        if self.numCompleted + self.numTaken > self.origNumIntervals:
+            logging.info(f"Exceeded numIntervals! origNumIntervals: {self.origNumIntervals}, numIntervals: {self.numIntervals}, timePerInterval: {self.timePerInterval}, intervals: {self.numCompleted + self.numTaken}, numDataPoints: {self.numDataPoints}")
+
+        if self.up is not None:
+            self.up.finish()
+
+        return self.takeDownsamples()
+
+    # Returns the list of intervals completed since the last call for every
+    # downsample (finest first), and releases them from the builders.
+    def takeDownsamples(self):
+        return [level.takeIntervals() for level in self.levels]
+
+# Given a series of raw values, the number of intervals for the finest
+# downsample, and the time-per-interval of each downsample from which a coarser
+# downsample is to be built, builds and returns all downsamples in a single
+# sweep over the raw data (finest first). This is equivalent to calling
+# buildDownsampleFromRaw followed by buildNextDownsampleUp for each coarser
+# downsample, without holding any full-size intermediate buffers.
+# If returnState is set, a tuple is returned with the downsamples and the state
+# of the builder once all raw data was added (see DownsampleBuilder.getState).
+def buildDownsamplesFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarray[np.float64_t, ndim=1] rawValues, int numIntervals, timePerIntervalsUp, int stepMultiplier, bint returnState=False):
+
+    # Calculate the interval size in seconds
+    cdef double timePerInterval = (rawOffsets[rawOffsets.shape[0]-1] - rawOffsets[0]) / numIntervals
+
+    builder = DownsampleBuilder(rawOffsets[0], timePerInterval, numIntervals, timePerIntervalsUp, stepMultiplier)
+    builder.addRaw(rawOffsets, rawValues)
+
+    if returnState:
+        state = builder.getState()
+        return builder.finish(), state
+
+    return builder.finish()
+
+# Given an already-built downsample and the time-per-interval of each downsample
+# from which a coarser downsample is to be built (starting with the one
+# provided), builds and returns all coarser downsamples in a single sweep
+# (finest first). This is equivalent to calling buildNextDownsampleUp
+# repeatedly.
+def buildDownsamplesUp(np.ndarray[np.float64_t, ndim=2] intervalsOrig, timePerIntervalsUp, int stepMultiplier):
+
+    cdef Py_ssize_t numIntervalsOrig = intervalsOrig.shape[0]
+    cdef Py_ssize_t expectedIntervals = numIntervalsOrig
+    cdef Py_ssize_t cio
+    cdef const double[:, :] intervalsOrigView = intervalsOrig
+    cdef DownsampleLevelBuilder level
+    cdef DownsampleLevelBuilder below = None
+
+    # Chain the builders
+    levels = []
+    for timePerIntervalOrig in timePerIntervalsUp:
+        expectedIntervals = expectedIntervals // stepMultiplier + 1
+        level = DownsampleLevelBuilder(timePerIntervalOrig, stepMultiplier, expectedIntervals)
+        if below is not None:
+            below.up = level
+        below = level
+        levels.append(level)
+
+    if len(levels) == 0:
+        return []
+
+    # Feed the original intervals to the first builder, without holding the GIL
+    # other than to grow the interval buffers.
+    level = levels[0]
+    with nogil:
+        for cio in range(numIntervalsOrig):
+            level.add(intervalsOrigView[cio,0], intervalsOrigView[cio,1], intervalsOrigView[cio,2])
+    level.finish()
+
+    return [level.takeIntervals() for level in levels]
 
 # Generates a two-dimensional Nx2 alerts array, with N alerts in the first
 # dimension and each alert having a start time in the first array element and a
@@ -257,30 +779,191 @@ def buildDownsampleFromRaw(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarr
 # the duration timespan.
 def generateThresholdAlerts(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarray[np.float64_t, ndim=1] rawValues, double thresholdlow, double thresholdhigh, int mode, double duration, double persistence, double maxgap, int min_sample_count):
 
-    # Holds the indices of all raw values which surpass the threshold(s)
-    cdef np.ndarray[long, ndim=1] pastThresholdIndices
+    return consolidateAlerts(generateUnconsolidatedThresholdAlerts(rawOffsets, rawValues, thresholdlow, thresholdhigh, mode, duration, persistence, min_sample_count), maxgap)
+
+# Returns the indices of the raw values which are past the threshold(s) for the
+# mode (see generateThresholdAlerts), or None if the mode is invalid.
+def getPastThresholdIndices(np.ndarray[np.float64_t, ndim=1] rawValues, double thresholdlow, double thresholdhigh, int mode):
 
     # Pull the indices of all data points that exceed the threshold.
     # TODO(gus): Is there a more efficient way to do this?
     if mode == 0:
-        pastThresholdIndices = np.nonzero((rawValues < thresholdlow))[0]
+        return np.nonzero((rawValues < thresholdlow))[0]
     elif mode == 1:
-        pastThresholdIndices = np.nonzero((rawValues > thresholdhigh))[0]
+        return np.nonzero((rawValues > thresholdhigh))[0]
     elif mode == 2:
-        pastThresholdIndices = np.nonzero((rawValues < thresholdlow) | (rawValues > thresholdhigh))[0]
+        return np.nonzero((rawValues < thresholdlow) | (rawValues > thresholdhigh))[0]
     else:
         logging.error("Invalid mode parameter provided to generateThresholdAlerts.")
-        return np.array([])
+        return None
+
+# Generates the alerts of generateThresholdAlerts prior to consolidation, i.e.
+# one alert for each threshold-exceeding data point whose sample qualifies, in
+# order of their start times. The indices of the threshold-exceeding data points
+# may be provided if already known (see getPastThresholdIndices), e.g. to
+# generate alerts for several durations with the same threshold(s).
+def generateUnconsolidatedThresholdAlerts(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndarray[np.float64_t, ndim=1] rawValues, double thresholdlow, double thresholdhigh, int mode, double duration, double persistence, int min_sample_count, pastThresholdIndices=None):
+
+    if pastThresholdIndices is None:
+        pastThresholdIndices = getPastThresholdIndices(rawValues, thresholdlow, thresholdhigh, mode)
+    if pastThresholdIndices is None:
+        return np.zeros((0, 2))
 
     # Holds generated alerts (start & stop time offsets). We assume there can be
     # a max of len(pastThresholdIndices) alerts and slice it shorter at the end.
-    cdef np.ndarray[np.float64_t, ndim=2] alerts = np.zeros((pastThresholdIndices.shape[0], 2))
+    alerts = np.zeros((pastThresholdIndices.shape[0], 2))
+
+    cdef const double[:] rawOffsetsView = rawOffsets
+    cdef const double[:] rawValuesView = rawValues
+    cdef const long[:] pastThresholdIndicesView = pastThresholdIndices
+    cdef double[:, ::1] alertsView = alerts
+
+    # Holds the number of alerts generated
+    cdef Py_ssize_t numAlerts
+
+    # Generate the alerts without holding the GIL
+    with nogil:
+        numAlerts = generateThresholdAlertsKernel(rawOffsetsView, rawValuesView, pastThresholdIndicesView, alertsView, thresholdlow, thresholdhigh, mode, duration, persistence, min_sample_count)
+
+    # Slice off unused alerts
+    return alerts[0:numAlerts]
+
+# Consolidates the alerts provided (an Nx2 array, as generated by
+# generateUnconsolidatedThresholdAlerts) that are no more than maxgap apart, and
+# returns the final alerts.
+def consolidateAlerts(np.ndarray[np.float64_t, ndim=2] alerts, double maxgap):
+
+    # Holds the number of final alerts
+    cdef Py_ssize_t numFinalAlerts
+
+    # Handle the special case that there is only zero or one alert
+    if alerts.shape[0] <= 1:
+        return alerts
+
+    alerts = np.ascontiguousarray(alerts)
+    cdef double[:, ::1] alertsView = alerts
+
+    # Holds the final, consolidated alerts to be returned
+    finalalerts = np.zeros((alerts.shape[0], 2))
+
+    cdef double[:, ::1] finalalertsView = finalalerts
+
+    # Consolidate the alerts without holding the GIL
+    with nogil:
+        numFinalAlerts = consolidateAlertsKernel(alertsView, finalalertsView, maxgap)
+
+    # Slice off the unused final alerts array elements
+    return finalalerts[0:numFinalAlerts]
+
+# Returns whether a value is past the threshold(s) for the mode (see
+# generateThresholdAlerts).
+cdef inline bint isPastThreshold(double value, double thresholdlow, double thresholdhigh, int mode) noexcept nogil:
+    return (mode == 0 and value < thresholdlow) or \
+        (mode == 1 and value > thresholdhigh) or \
+        (mode == 2 and (value < thresholdlow or value > thresholdhigh))
+
+# Typed-memoryview kernel of generateThresholdAlerts which generates the alerts
+# prior to consolidation, and may be run without the GIL. Writes the alerts into
+# the alerts provided, which must have room for one alert per threshold-exceeding
+# data point, and returns their number.
+#
+# The sample of each alert spans the data points from a threshold-exceeding data
+# point up to the duration after it (or the end of the raw data). As the raw time
+# offsets are in order, both ends of the sample only move forward from one alert
+# to the next, so the sample is slid along the raw data rather than scanned anew
+# for each alert, keeping count of the data points leaving & entering it. This
+# makes for a single pass over the raw data regardless of the duration. If the
+# raw time offsets are out of order (or nan), each sample is scanned anew as the
+# sliding sample would not be identical.
+cdef Py_ssize_t generateThresholdAlertsKernel(const double[:] rawOffsets, const double[:] rawValues, const long[:] pastThresholdIndices, double[:, ::1] alerts, double thresholdlow, double thresholdhigh, int mode, double duration, double persistence, int min_sample_count) noexcept nogil:
+
+    cdef Py_ssize_t numDataPoints = rawOffsets.shape[0]
+
+    # Holds the index of the data point at which the current alert sample begins
+    cdef long alertSampleBeginIndex
+
+    # Holds the indices of the first data point in the current alert sample and
+    # of the data point after it
+    cdef Py_ssize_t lo = 0
+    cdef Py_ssize_t hi = 0
+
+    # Holds the index of the next available unwritten alert
+    cdef Py_ssize_t nuai = 0
+
+    # Tracks the left & right boundaries of the current alert sample
+    cdef double leftboundary, rightboundary
+
+    # Tracks the number of points that exceed the threshold and the total number
+    # of sample points for calculation of the sample persistence.
+    cdef long numexceed = 0
+    cdef long numtotal
+
+    # Holds the sample persistence once calculated
+    cdef double sampleduty
+
+    cdef Py_ssize_t i, k
+
+    # Check that the raw time offsets are in order
+    for i in range(1, numDataPoints):
+        if not rawOffsets[i] >= rawOffsets[i-1]:
+            return generateThresholdAlertsScanKernel(rawOffsets, rawValues, pastThresholdIndices, alerts, thresholdlow, thresholdhigh, mode, duration, persistence, min_sample_count)
+
+    for k in range(pastThresholdIndices.shape[0]):
+
+        alertSampleBeginIndex = pastThresholdIndices[k]
+
+        leftboundary = rawOffsets[alertSampleBeginIndex]
+        rightboundary = leftboundary + duration
+
+        # Move the beginning of the sample up to the alert's data point,
+        # dropping the data points it passes from the sample (or start a new
+        # sample if it passes the end of the current one).
+        if hi <= alertSampleBeginIndex:
+            lo = alertSampleBeginIndex
+            hi = alertSampleBeginIndex
+            numexceed = 0
+        else:
+            while lo < alertSampleBeginIndex:
+                if isPastThreshold(rawValues[lo], thresholdlow, thresholdhigh, mode):
+                    numexceed = numexceed - 1
+                lo = lo + 1
+
+        # Extend the end of the sample until we hit the raw data bound or hit
+        # the right time boundary for this current alert.
+        while hi < numDataPoints and rawOffsets[hi] < rightboundary:
+            if isPastThreshold(rawValues[hi], thresholdlow, thresholdhigh, mode):
+                numexceed = numexceed + 1
+            hi = hi + 1
+
+        numtotal = hi - lo
+
+        # Calculate the sample persistence
+        sampleduty = <double>numexceed / <double>numtotal
+
+        # If the persistence of the sample exceeds the minimum to qualify for an
+        # alert, add this to our alerts.
+        if sampleduty >= persistence and numtotal >= min_sample_count:
+
+            alerts[nuai,0] = leftboundary
+            alerts[nuai,1] = rightboundary
+
+            # Increment to the next available unwritten alert
+            nuai = nuai + 1
+
+    return nuai
+
+# Kernel of generateThresholdAlerts as generateThresholdAlertsKernel, which scans
+# the sample of each alert anew, for raw time offsets which are out of order.
+cdef Py_ssize_t generateThresholdAlertsScanKernel(const double[:] rawOffsets, const double[:] rawValues, const long[:] pastThresholdIndices, double[:, ::1] alerts, double thresholdlow, double thresholdhigh, int mode, double duration, double persistence, int min_sample_count) noexcept nogil:
+
+    # Holds the index of the data point at which the current alert sample begins
+    cdef long alertSampleBeginIndex
 
     # Holds the index of the current data point we're working on
     cdef long cdpi = 0
 
     # Holds the index of the next available unwritten alert
-    cdef long nuai = 0
+    cdef Py_ssize_t nuai = 0
 
     # Tracks the left & right boundaries of the current alert sample
     cdef double leftboundary, rightboundary
@@ -292,7 +975,10 @@ def generateThresholdAlerts(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndar
     # Holds the sample persistence once calculated
     cdef double sampleduty
 
-    for alertSampleBeginIndex in pastThresholdIndices:
+    cdef Py_ssize_t k
+    for k in range(pastThresholdIndices.shape[0]):
+
+        alertSampleBeginIndex = pastThresholdIndices[k]
 
         cdpi = alertSampleBeginIndex
         leftboundary = rawOffsets[cdpi]
@@ -311,9 +997,7 @@ def generateThresholdAlerts(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndar
 
             # If this data point exceeds the threshold, increment the number of
             # threshold-exceed data points.
-            if (mode == 0 and rawValues[cdpi] < thresholdlow) or \
-                (mode == 1 and rawValues[cdpi] > thresholdhigh) or \
-                (mode == 2 and (rawValues[cdpi] < thresholdlow or rawValues[cdpi] > thresholdhigh)):
+            if isPastThreshold(rawValues[cdpi], thresholdlow, thresholdhigh, mode):
                 numexceed = numexceed + 1
 
             # Increment to the next data point
@@ -332,39 +1016,37 @@ def generateThresholdAlerts(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndar
             # Increment to the next available unwritten alert
             nuai = nuai + 1
 
-    # Slice off unused alerts
-    alerts = alerts[0:nuai]
+    return nuai
 
-    # Holds the final, consolidated alerts to be returned
-    cdef np.ndarray[np.float64_t, ndim=2] finalalerts = np.zeros((alerts.shape[0], 2))
+# Typed-memoryview kernel of generateThresholdAlerts which consolidates the
+# alerts (at least one) that are no more than maxgap apart, and may be run
+# without the GIL. Writes the final alerts into the finalalerts provided, which
+# must have room for as many alerts as provided, and returns their number.
+cdef Py_ssize_t consolidateAlertsKernel(const double[:, ::1] alerts, double[:, ::1] finalalerts, double maxgap) noexcept nogil:
 
     # Holds the index of the current raw alert
-    cdef long crai = 0
+    cdef Py_ssize_t crai = 0
 
     # Holds the index of the current final alert
-    cdef long cfai = 0
+    cdef Py_ssize_t cfai = 0
 
     # Holds start & stop times for a candidate final alert
     cdef double candalertbegin, candalertend
 
-    # Handle the special case that there is only zero or one alert
-    if len(alerts) <= 1:
-        return alerts
-
     # Prime the while loop with the first alert as candidate alert
     candalertbegin = alerts[crai,0]
     candalertend = alerts[crai,1]
     crai = crai + 1
 
-    while crai < len(alerts):
+    while crai < alerts.shape[0]:
 
         # For each iteration, we either extend the candidate time and move on,
         # or write out the final alert and start a new candidate.
 
         # If the next alert is less than maxgap from the previous alert, extend
         # the alert window and move on
-        if alerts[crai][0] <= candalertend + maxgap:
-            candalertend = alerts[crai][1]
+        if alerts[crai,0] <= candalertend + maxgap:
+            candalertend = alerts[crai,1]
 
         # Otherwise, add the current candidate as a final alert and start a
         # new candidate.
@@ -387,10 +1069,7 @@ def generateThresholdAlerts(np.ndarray[np.float64_t, ndim=1] rawOffsets, np.ndar
     finalalerts[cfai,1] = candalertend
     cfai = cfai + 1
 
-    # Slice off the unused final alerts array elements
-    finalalerts = finalalerts[0:cfai]
-
-    return finalalerts
+    return cfai
 
 # Returns the index where a provided target value should be inserted in a
 # downsample or raw data series. The side parameter indicates whether to
@@ -434,6 +1113,30 @@ def getSliceParam(ds, timecol, unsigned short side, double target):
 
     return low
 
+# Returns the index where a provided target value should be inserted in a
+# downsample or raw data series, as getSliceParam does, given a sparse time index
+# holding the time offset of every stride-th row of the series (rows 0, stride,
+# 2*stride, and so on). The index narrows the search down to the stride rows
+# between two of its entries in memory, so only those rows of the time column are
+# read from the file (a single storage chunk if stride is the chunk size).
+def getSliceParamIndexed(ds, timecol, unsigned short side, double target, np.ndarray[np.float64_t, ndim=1] timeIndex, Py_ssize_t stride):
+
+    cdef Py_ssize_t numDataPoints = ds.nrow
+
+    # Find the entry after the block of rows where the target belongs. The
+    # entry before it is to the left of the target (or equal, for the right
+    # slice param), so the target belongs after the block's first row.
+    cdef Py_ssize_t j = np.searchsorted(timeIndex, target, side='left' if side == 0 else 'right')
+    if j == 0:
+        return 0
+
+    cdef Py_ssize_t start = (j - 1) * stride
+    cdef Py_ssize_t stop = min(j * stride, numDataPoints)
+
+    times = ds.hdf.fields(timecol)[start:stop].astype(np.float64)
+
+    return start + np.searchsorted(times, target, side='left' if side == 0 else 'right')
+
 # This function calculates the number of downsample levels to build based on the
 # value of M and stepMultiplier (see the config file for details on those). It
 # calculates this by finding the smallest timespan of any consecutive 2M points
@@ -447,7 +1150,7 @@ def getSliceParam(ds, timecol, unsigned short side, double target):
 def numDownsamplesToBuild(np.ndarray[np.float64_t, ndim=1] rawOffsets, int M, int stepMultiplier):
 
     # Grab the rawOffsets length
-    cdef int numDataPoints = rawOffsets.shape[0]
+    cdef Py_ssize_t numDataPoints = rawOffsets.shape[0]
 
     # Calculate the timespan of the entire dataset
     cdef double timespan = rawOffsets[rawOffsets.shape[0]-1] - rawOffsets[0]
@@ -457,28 +1160,55 @@ def numDownsamplesToBuild(np.ndarray[np.float64_t, ndim=1] rawOffsets, int M, in
     if numDataPoints <= 2*M:
         return 0
 
-    # The first & last variables track the sliding window of 2M data points.
-    cdef int first = 0
-    cdef int last = 2*M-1
-
-    # The currentTimeWindow variable will track the time window of the current
-    # sliding window of 2M data points. The smallestTimeWindow will, after
-    # the while loop completes, hold the smallest time window of any consecutive
-    # 2M data points in the data set, and it is primed with the first window.
-    cdef double currentTimeWindow
-    cdef double smallestTimeWindow = rawOffsets[last] - rawOffsets[first]
+    # The time window of the first 2M data points
+    cdef double firstTimeWindow = rawOffsets[2*M-1] - rawOffsets[0]
 
     # If all values are at the same point in time and, having passed the if statement above, there are > 2*M data points,
     # we cannot downsample the file.
-    if smallestTimeWindow == 0:
+    if firstTimeWindow == 0:
         raise Exception('All values are at the same point in time. Cannot downsample.')
-    elif smallestTimeWindow < 0:
+    elif firstTimeWindow < 0:
+        raise Exception('Series violates assumption of monotonically increasing time values (i.e. series should be ordered in time).')
+
+    cdef const double[:] rawOffsetsView = rawOffsets
+
+    # Determine the smallest time window of 2M data points without holding the
+    # GIL
+    cdef double smallestTimeWindow
+    with nogil:
+        smallestTimeWindow = smallestTimeWindowKernel(rawOffsetsView, 2*M)
+
+    if smallestTimeWindow < 0:
         raise Exception('Series violates assumption of monotonically increasing time values (i.e. series should be ordered in time).')
 
-    # Determine the smallest time window of 2M data points
+    # Return the downsample levels to build.
+    return numDownsamplesForTimeWindow(timespan, smallestTimeWindow, M, stepMultiplier)
+
+# Typed-memoryview kernel of numDownsamplesToBuild, which may be run without the
+# GIL. Returns the smallest positive time window of any windowSize consecutive
+# data points (there must be at least windowSize data points, and the first
+# window must be positive), or -1 if any time window is negative.
+cdef double smallestTimeWindowKernel(const double[:] rawOffsets, Py_ssize_t windowSize) noexcept nogil:
+
+    # Grab the rawOffsets length
+    cdef Py_ssize_t numDataPoints = rawOffsets.shape[0]
+
+    # The first & last variables track the sliding window of data points.
+    cdef Py_ssize_t first = 0
+    cdef Py_ssize_t last = windowSize-1
+
+    # The currentTimeWindow variable will track the time window of the current
+    # sliding window of data points. The smallestTimeWindow will, after the
+    # while loop completes, hold the smallest time window of any consecutive
+    # windowSize data points in the data set, and it is primed with the first
+    # window.
+    cdef double currentTimeWindow
+    cdef double smallestTimeWindow = rawOffsets[last] - rawOffsets[first]
+
+    # Determine the smallest time window
     while last < numDataPoints:
 
-        # Calculate the time window of the current window of 2M data points
+        # Calculate the time window of the current window of data points
         currentTimeWindow = rawOffsets[last] - rawOffsets[first]
 
         # Update smallest time window if applicable
@@ -486,12 +1216,19 @@ def numDownsamplesToBuild(np.ndarray[np.float64_t, ndim=1] rawOffsets, int M, in
             smallestTimeWindow = currentTimeWindow
 
         if currentTimeWindow < 0:
-            raise Exception('Series violates assumption of monotonically increasing time values (i.e. series should be ordered in time).')
+            return -1
 
         # Increment first & last pointers
         first = first + 1
         last = last + 1
 
+    return smallestTimeWindow
+
+# Given the timespan of a series and the smallest time window of any consecutive
+# 2M data points in the series, returns the number of downsample levels that
+# should be built for it (see numDownsamplesToBuild).
+def numDownsamplesForTimeWindow(double timespan, double smallestTimeWindow, int M, int stepMultiplier):
+
     # Calculate the time-per-interval for a downsample to represeent the
     # smallest time window in the data set. This will represent the floor
     # time-per-interval that the downsample reach (by floor is meant it should
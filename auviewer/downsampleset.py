@@ -1,9 +1,26 @@
+import h5py
 import logging
+import numpy as np
+import pandas as pd
 import psutil
+import simplejson
 import time
 
+from . import nplib
 from .config import config
-from .cylib import buildDownsampleFromRaw, buildNextDownsampleUp, getSliceParam, numDownsamplesToBuild
+from .cylib import DownsampleBuilder, buildDownsamplesFromRaw, numDownsamplesForTimeWindow, numDownsamplesToBuild
+from .slicecache import getSliceCache
+
+# Row type of the downsample datasets in the processed file: interval time,
+# min & max (as stored by audata from an Nx3 array of intervals)
+downsampleDtype = np.dtype([('0', '<f8'), ('1', '<f8'), ('2', '<f8')])
+
+# Functions available for building all downsamples from raw data, indexed by
+# the engine name used in the downsampleEngine config parameter.
+downsampleEngines = {
+    'cython': buildDownsamplesFromRaw,
+    'numpy': nplib.buildDownsamplesFromRaw,
+}
 
 # Represents a set of downsamples for a series of data.
 class DownsampleSet:
@@ -16,6 +33,13 @@ class DownsampleSet:
         # Holds the number of downsamples available for the series
         self._numDownsamples = None
 
+        # Holds the timespan of the series when its downsamples were laid out
+        self._timespan = None
+
+        # Holds the time index of each downsample once loaded, by downsample
+        # index (see getTimeIndex)
+        self._timeIndices = {}
+
     @property
     def numDownsamples(self):
         if self._numDownsamples is None:
@@ -41,6 +65,23 @@ class DownsampleSet:
 
         return self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/' + '0'][:]
 
+    # Returns the timespan of the series which the time-per-interval of the
+    # downsamples is based on. This is the timespan of the raw data, unless the
+    # downsamples were extended since the raw data grew, in which case it is
+    # the timespan recorded when they were last built in full.
+    @property
+    def timespan(self):
+        if self._timespan is None:
+
+            # If no downsamples are available, use the raw data timespan but
+            # do not set self._timespan
+            if self.numDownsamples < 1:
+                return self.seriesparent.rd.timespan
+
+            self._timespan = self.getStoredState().get('timespan', self.seriesparent.rd.timespan)
+
+        return self._timespan
+
     # Returns the number of downsamples available for this series in the
     # processed data file.
     def getNumDownsamplesFromFile(self):
@@ -102,12 +143,98 @@ class DownsampleSet:
         # Get reference to the downsample dataset in the processed file
         ds = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/' + str(dsi)]
 
-        # Find the start & stop indices based on the start & stop times.
-        startIndex = getSliceParam(ds, '0', 0, starttime)
-        stopIndex = getSliceParam(ds, '0', 1, stoptime)
+        # Find the blocks of rows (storage chunks) containing the start & stop
+        # times with the time index, and get them and all blocks in between.
+        timeIndex = self.getTimeIndex(dsi)
+        startBlock = max(np.searchsorted(timeIndex, starttime, side='left') - 1, 0)
+        stopBlock = np.searchsorted(timeIndex, stoptime, side='right')
+        blocks = self.getBlocks(dsi, ds, startBlock, stopBlock)
+
+        # Find the start & stop indices within the blocks based on the start &
+        # stop times.
+        times = blocks['0']
+        startIndex = np.searchsorted(times, starttime, side='left')
+        stopIndex = np.searchsorted(times, stoptime, side='right')
 
         # Return the downsample slice
-        return ds[startIndex:stopIndex]
+        return pd.DataFrame(blocks[startIndex:stopIndex])
+
+    # Returns the rows of blocks startBlock through stopBlock-1 of the
+    # downsample dataset ds at index dsi, as a structured NumPy array. Blocks
+    # are served from the global slice cache where available, and the rest are
+    # read in contiguous runs and cached.
+    def getBlocks(self, dsi, ds, startBlock, stopBlock):
+
+        cache = getSliceCache()
+        stride = ds.hdf.chunks[0]
+        nrow = ds.nrow
+        # Blocks are keyed by the identity of the processed file as well, as an
+        # update may rewrite the last block of a downsample (see File.process)
+        keyPrefix = (str(self.seriesparent.fileparent.procFilePathObj), self.seriesparent.id, dsi, nrow, self.seriesparent.fileparent.procFileIdentity)
+
+        blocks = [cache.get(keyPrefix + (b,)) for b in range(startBlock, stopBlock)]
+
+        # Read each run of consecutive blocks missing from the cache
+        b = 0
+        while b < len(blocks):
+            if blocks[b] is not None:
+                b += 1
+                continue
+            runStart = b
+            while b < len(blocks) and blocks[b] is None:
+                b += 1
+            rows = ds.hdf[(startBlock + runStart) * stride:min((startBlock + b) * stride, nrow)]
+            for k in range(runStart, b):
+                blocks[k] = rows[(k - runStart) * stride:(k - runStart + 1) * stride].copy()
+                cache.put(keyPrefix + (startBlock + k,), blocks[k])
+
+        if len(blocks) == 0:
+            return ds.hdf[0:0]
+
+        return np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+    # Returns the time index of the downsample at index i, holding the time
+    # offset of the first interval in each storage chunk of its dataset, with
+    # which getRangedOutput finds the chunks to read for a time range. The
+    # index is read from the processed file if stored there (see
+    # storeTimeIndices), and otherwise built from the downsample.
+    def getTimeIndex(self, i):
+
+        if i not in self._timeIndices:
+
+            ds = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/' + str(i)]
+            stride = ds.hdf.chunks[0]
+
+            # Use the stored index if it has an entry for every chunk
+            tids = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/timeindices/' + str(i)]
+            timeIndex = tids.hdf.fields('0')[:] if tids is not None else None
+            if timeIndex is None or timeIndex.shape[0] != -(-ds.nrow // stride):
+                timeIndex = ds.hdf.fields('0')[::stride]
+
+            self._timeIndices[i] = timeIndex
+
+        return self._timeIndices[i]
+
+    # Returns a tuple with the intervals (an Nx3 array of interval times, mins &
+    # maxes) of the coarsest downsample whose time-per-interval is no more than
+    # the timespan provided, or of the finest downsample if none is, and its
+    # time-per-interval, or None if no downsample is available. The intervals
+    # serve to screen the raw data for regions of interest without reading it
+    # (see Series.getThresholdAlertCandidates).
+    def getScreeningDownsample(self, timespan):
+
+        if self.numDownsamples < 1:
+            return None
+
+        dsi = 0
+        while dsi < self.numDownsamples - 1 and self.getTimePerIntervalByIndex(dsi) > timespan:
+            dsi = dsi + 1
+
+        ds = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/' + str(dsi)]
+        rows = ds.hdf[:]
+        intervals = np.stack([rows[c].astype(np.float64) for c in ('0', '1', '2')], axis=1)
+
+        return intervals, self.getTimePerIntervalByIndex(dsi)
 
     # Returns the time-per-interval for the downsample at index i.
     def getTimePerIntervalByIndex(self, i, nds=-1):
@@ -119,22 +246,33 @@ class DownsampleSet:
         if i < 0:
             i = nds + i
 
-        return self.seriesparent.rd.timespan / self.getNumIntervalsByIndex(i, nds)
+        return self.timespan / self.getNumIntervalsByIndex(i, nds)
 
     # Build all necessary downsamples, and store in the processed file.
     def processAndStore(self):
 
+        # We assume there exists a file for storing processed data.
+        if not hasattr(self.seriesparent.fileparent, 'pf'):
+            return
+
+        self.storeDownsamples(*self.buildDownsamples())
+
+    # Builds all necessary downsamples from the raw data pulled into memory, and
+    # returns a tuple with a list of interval arrays (finest first) and the
+    # state from which they may be extended (see storeState), or None if the
+    # downsamples may not be extended. The list is empty if no downsamples need
+    # to be built.
+    def buildDownsamples(self):
+
         p = psutil.Process()
 
         # We assume:
         #   - Datagroup has two non-empty datasets, "datetime" and "value";
-        #   - The two datasets are of equal length;
-        #   - There exists a file for storing processed data.
+        #   - The two datasets are of equal length.
         if \
                 (len(self.seriesparent.rawTimes) < 1 or len(self.seriesparent.rawValues) < 1) or \
-                len(self.seriesparent.rawTimes) != len(self.seriesparent.rawValues) or \
-                not hasattr(self.seriesparent.fileparent, 'pf'):
-            return
+                len(self.seriesparent.rawTimes) != len(self.seriesparent.rawValues):
+            return [], None
 
         # Get an array of the downsamples to build (each element of the array
         # is a number of intervals to divide the data set into).
@@ -142,33 +280,49 @@ class DownsampleSet:
 
         # If we do not need to build any downsamples, return now.
         if ndtb < 1:
-            return
-
-        # Begin by building the last downsample from the raw data first. Then
-        # proceed by building the next downsample up from the previously-built
-        # downsample until all downsamples have been created.
+            return [], None
+
+        # Get the engine to build the downsamples with
+        if config['downsampleEngine'] not in downsampleEngines:
+            raise ValueError(f"Unknown downsample engine '{config['downsampleEngine']}'. Available engines: {', '.join(downsampleEngines)}.")
+        buildDownsamples = downsampleEngines[config['downsampleEngine']]
+
+        # Build all downsamples in a single sweep over the raw data. The last
+        # (finest) downsample is built from the raw data, and each interval it
+        # completes is fed into building the next downsample up, and so forth.
+        # The time-per-interval of each downsample a coarser one is built from
+        # is provided, starting with the finest.
+        logging.info(f"Creating {ndtb} downsamples ({self.getNumIntervalsByIndex(-1, ndtb)} intervals possible in the finest), using the {config['downsampleEngine']} engine.")
+        start = time.time()
         logging.info(f"MEM PRE-DSBLD: {p.memory_full_info().uss / 1024 / 1024} MB")
-        for i in range(-1, -ndtb - 1, -1):
 
-            logging.info(f"Creating downsample ({self.getNumIntervalsByIndex(i, ndtb)} intervals possible).")
-            start = time.time()
+        downsamples, builderState = buildDownsamples(
+            self.seriesparent.rawTimes,
+            self.seriesparent.rawValues,
+            self.getNumIntervalsByIndex(-1, ndtb),
+            [self.getTimePerIntervalByIndex(i + 1, ndtb) for i in range(-2, -ndtb - 1, -1)],
+            config['stepMultiplier'],
+            returnState=True,
+        )
 
-            # Build the downsample
-            if i == -1:
-                logging.info("This pass from raw.")
-                downsample = buildDownsampleFromRaw(self.seriesparent.rawTimes, self.seriesparent.rawValues, self.getNumIntervalsByIndex(i, ndtb))
-            else:
-                downsample = buildNextDownsampleUp(previousDownsample, self.getTimePerIntervalByIndex(i + 1, ndtb), config['stepMultiplier'])
+        logging.info(f"MEM AFT-DSBLD: {p.memory_full_info().uss / 1024 / 1024} MB")
+        end = time.time()
+        logging.info(f"Done creating downsamples. Yielded {', '.join(str(d.shape[0]) for d in downsamples)} actual intervals. Took {round(end - start, 5)}s.")
 
-            logging.info(f"MEM AFT-DSBLD: {p.memory_full_info().uss / 1024 / 1024} MB")
+        return downsamples, self.buildState(builderState, self.seriesparent.rawTimes[-1])
 
-            # Save the just-computed downsample for use on the next loop iteration
-            previousDownsample = downsample
+    # Stores the downsamples provided (a list of interval arrays, finest first,
+    # as returned by buildDownsamples) in the processed file, releasing each
+    # from the list once stored, along with the state from which they may be
+    # extended, if provided, and the time index of the raw data (which is built
+    # if not provided, see RawData.storeTimeIndex).
+    def storeDownsamples(self, downsamples, state=None, timeIndex=None):
 
-            logging.info(f"MEM AFT-REPLP: {p.memory_full_info().uss / 1024 / 1024} MB")
+        p = psutil.Process()
 
-            end = time.time()
-            logging.info(f"Done creating downsample. Yielded {downsample.shape[0]} actual intervals. Took {round(end - start, 5)}s.")
+        ndtb = len(downsamples)
+
+        for i in range(-1, -ndtb - 1, -1):
 
             logging.info("Storing the downsample to the processed file.")
             start = time.time()
@@ -177,7 +331,8 @@ class DownsampleSet:
 
                 # Store the downsample
                 dds_name = '{}/{}'.format('/'.join(self.seriesparent.h5pathDownsample), i % ndtb)
-                self.seriesparent.fileparent.pf[dds_name] = downsample
+                self.seriesparent.fileparent.pf[dds_name] = downsamples[-1 - i]
+                downsamples[-1 - i] = None
                 logging.info(f"MEM AFT-STRFL: {p.memory_full_info().uss / 1024 / 1024} MB")
 
             except:
@@ -188,9 +343,383 @@ class DownsampleSet:
             end = time.time()
             logging.info(f"Done storing to file. Took {round(end - start, 5)}s.")
 
+        if ndtb > 0:
+            self.seriesparent.rd.storeTimeIndex(timeIndex)
+            self.storeTimeIndices()
+            if state is not None:
+                self.storeState(state)
+
+        # Clear self._numDownsamples so that it updates the next time it's accessed
+        self._numDownsamples = None
+
+    # Build all necessary downsamples from the raw data read in blocks of at
+    # most chunkSize rows, and store them in the processed file. This yields the
+    # same downsamples as processAndStore, but the raw data is never held in
+    # memory in full, so memory use is bounded by the chunk size rather than the
+    # length of the series.
+    def processAndStoreChunked(self, chunkSize):
+
+        p = psutil.Process()
+
+        logging.info(f"MEM PRE-DSBLD: {p.memory_full_info().uss / 1024 / 1024} MB")
+        start = time.time()
+
+        # Append the intervals completed in each block to the processed file,
+        # holding back each block's until the next is available so that the
+        # last is known.
+        state = {}
+        downsamples = None
+        for nextDownsamples in self.iterDownsampleBlocks(chunkSize, state):
+            if downsamples is not None:
+                self.appendDownsamples(downsamples)
+            downsamples = nextDownsamples
+        if downsamples is not None:
+            self.appendDownsamples(downsamples, final=True)
+            self.storeState(state)
+            self.seriesparent.rd.storeTimeIndex()
+            self.storeTimeIndices()
+
+        logging.info(f"MEM AFT-DSBLD: {p.memory_full_info().uss / 1024 / 1024} MB")
+        end = time.time()
+        logging.info(f"Done creating & storing downsamples. Took {round(end - start, 5)}s.")
+
         # Clear self._numDownsamples so that it updates the next time it's accessed
         self._numDownsamples = None
 
+    # Builds all necessary downsamples from the raw data read in blocks of at
+    # most chunkSize rows, and returns them along with the state from which they
+    # may be extended, as buildDownsamples does for raw data pulled into memory.
+    # Only the downsamples are held in memory in full.
+    def buildDownsamplesChunked(self, chunkSize):
+
+        state = {}
+        downsamples = [np.concatenate(intervals) for intervals in zip(*self.iterDownsampleBlocks(chunkSize, state))]
+
+        return downsamples, state if len(downsamples) > 0 else None
+
+    # Reads the raw data in blocks of at most chunkSize rows and, after each
+    # block, yields the intervals of each downsample (finest first) completed
+    # since the previous block. The last yield holds the intervals completed
+    # once all raw data has been read. Nothing is yielded if no downsamples need
+    # to be built. The raw data is read twice: once to determine the number of
+    # downsamples to build, and once to build them. If a state dict is provided,
+    # it is filled with the state from which the downsamples may be extended
+    # (see storeState) before the last yield.
+    def iterDownsampleBlocks(self, chunkSize, state=None):
+
+        # Determine the number of downsamples to build and the time offsets of
+        # the first & last data points.
+        logging.info(f"Scanning raw data in blocks of {chunkSize} rows.")
+        start = time.time()
+        ndtb, firstTime, lastTime = self.scanRawData(chunkSize)
+        end = time.time()
+        logging.info(f"Done scanning raw data. Took {round(end - start, 5)}s.")
+
+        # If we do not need to build any downsamples, return now.
+        if ndtb < 1:
+            return
+
+        numIntervals = self.getNumIntervalsByIndex(-1, ndtb)
+
+        # Build all downsamples in a single sweep over the raw data, carrying
+        # the open intervals of each downsample over from one block to the next
+        # (see buildDownsamples).
+        logging.info(f"Creating {ndtb} downsamples ({numIntervals} intervals possible in the finest) from blocks of {chunkSize} rows.")
+
+        builder = DownsampleBuilder(
+            firstTime,
+            (lastTime - firstTime) / numIntervals,
+            numIntervals,
+            [self.getTimePerIntervalByIndex(i + 1, ndtb) for i in range(-2, -ndtb - 1, -1)],
+            config['stepMultiplier'],
+            chunkSize,
+        )
+
+        for rawTimes, rawValues in self.seriesparent.iterRawDataBlocks(chunkSize):
+            builder.addRaw(rawTimes, rawValues)
+            yield builder.takeDownsamples()
+
+        if state is not None:
+            state.update(self.buildState(builder.getState(), lastTime))
+
+        yield builder.finish()
+
+    # Appends the intervals of each downsample (finest first) to its dataset in
+    # the processed file, creating the dataset when it first receives intervals
+    # (see createDownsampleDataset). If final is set, datasets which have yet to
+    # receive any intervals are created empty.
+    def appendDownsamples(self, downsamples, final=False):
+
+        ndtb = len(downsamples)
+
+        for k, intervals in enumerate(downsamples):
+
+            dsi = (-1 - k) % ndtb
+            dds_name = '{}/{}'.format('/'.join(self.seriesparent.h5pathDownsample), dsi)
+
+            try:
+
+                dds = self.seriesparent.fileparent.pf[dds_name]
+                if dds is None and (intervals.shape[0] > 0 or final):
+                    dds = self.createDownsampleDataset(dds_name, self.getNumIntervalsByIndex(dsi, ndtb))
+                if dds is not None and intervals.shape[0] > 0:
+                    dds.append(np.rec.fromarrays(intervals.T, dtype=dds.hdf.dtype), direct=True)
+
+            except:
+
+                logging.info(f"There was an exception while appending to the dataset in the processed data file at the path: {dds_name}.")
+                raise
+
+    # Creates an empty, extendable downsample dataset in the processed file,
+    # laid out as storing the downsample in full would lay it out (see
+    # storeDownsamples), with its storage chunks sized for the number of
+    # intervals expected rather than for the first intervals appended. Returns
+    # the dataset.
+    def createDownsampleDataset(self, dds_name, numIntervals):
+
+        pf = self.seriesparent.fileparent.pf
+        pf.hdf.create_dataset(
+            dds_name,
+            shape=(0,),
+            maxshape=(None,),
+            chunks=h5py.filters.guess_chunk((max(numIntervals, 1),), (None,), downsampleDtype.itemsize),
+            dtype=downsampleDtype,
+            compression='gzip',
+            shuffle=True,
+            fletcher32=True,
+        )
+        pf.hdf[dds_name].attrs['.meta'] = simplejson.dumps({'columns': {c: {'type': 'real'} for c in downsampleDtype.names}})
+
+        return pf[dds_name]
+
+    # Extends the downsamples stored in the processed file with the raw data
+    # added to the series since they were built, reading only the new rows in
+    # blocks of at most chunkSize rows (or all at once if chunkSize is 0). The
+    # downsample builder resumes from the state stored with the downsamples
+    # (see storeState), so each downsample is extended from its last interval
+    # completed before the builder was finished, and the result is the same as
+    # building with the stored interval sizes from all raw data at once.
+    # Returns whether the downsamples are up to date, or False if they must be
+    # built in full instead (no state stored, the raw data shrank, the tuning
+    # parameters changed, or the series has outgrown the stored interval sizes
+    # by more than the downsampleMaxGrowth config parameter).
+    def extendAndStore(self, chunkSize=0):
+
+        state = self.getStoredState()
+        if state.get('builder') is None:
+            return False
+
+        # If the tuning parameters have changed, we must build in full
+        if state['M'] != config['M'] or state['stepMultiplier'] != config['stepMultiplier']:
+            return False
+
+        dataset = self.seriesparent.fileparent.f['/'.join(self.seriesparent.h5path)]
+        nrow = dataset.nrow
+
+        if nrow == state['rawRows']:
+            logging.info(f"Downsamples are up to date ({nrow} rows).")
+            return True
+        elif nrow < state['rawRows']:
+            return False
+
+        builderState = state['builder']
+        levelStates = [builderState] + builderState['levels']
+
+        # Confirm that the stored downsamples hold the intervals the state
+        # accounts for.
+        ndtb = len(levelStates)
+        if self.numDownsamples != ndtb:
+            return False
+        datasets = [self.seriesparent.fileparent.pf['{}/{}'.format('/'.join(self.seriesparent.h5pathDownsample), (-1 - k) % ndtb)] for k in range(ndtb)]
+        if any(dds.nrow < levelState['numIntervals'] for dds, levelState in zip(datasets, levelStates)):
+            return False
+
+        # If the series has grown too much beyond the timespan the interval
+        # sizes are based on, we must build in full.
+        lastRowTime = float(dataset[[nrow - 1]][self.seriesparent.timecol].values.astype(np.float64)[0])
+        if lastRowTime - builderState['baseOffset'] > config['downsampleMaxGrowth'] * state['timespan']:
+            logging.info(f"Series has outgrown its downsamples ({lastRowTime - builderState['baseOffset']}s vs. {state['timespan']}s).")
+            return False
+
+        if chunkSize < 1:
+            chunkSize = nrow - state['rawRows']
+
+        logging.info(f"Extending {ndtb} downsamples with {nrow - state['rawRows']} new rows in blocks of {chunkSize} rows.")
+        start = time.time()
+
+        # Resume the builder, allowing for as many intervals as the new raw data
+        # may need.
+        builder = DownsampleBuilder(
+            builderState['baseOffset'],
+            builderState['timePerInterval'],
+            int((lastRowTime - builderState['baseOffset']) / builderState['timePerInterval']) + 1,
+            [levelState['timePerIntervalOrig'] for levelState in builderState['levels']],
+            config['stepMultiplier'],
+            chunkSize,
+        )
+        builder.setState(builderState)
+
+        # Drop the intervals which were completed only by finishing the builder
+        for dds, levelState in zip(datasets, levelStates):
+            dds.hdf.resize((levelState['numIntervals'],))
+
+        lastTime = state['lastTime']
+        for rawTimes, rawValues in self.seriesparent.iterRawDataBlocks(chunkSize, state['rawRows']):
+
+            if rawTimes.shape[0] < 1:
+                continue
+
+            # Do a sanity check, as in scanRawData
+            if rawTimes[0] < lastTime or bool((rawTimes[1:] < rawTimes[:-1]).any()):
+                raise Exception('Series violates assumption of monotonically increasing time values (i.e. series should be ordered in time).')
+            lastTime = rawTimes[-1]
+
+            builder.addRaw(rawTimes, rawValues)
+            self.appendDownsamples(builder.takeDownsamples())
+
+        state = self.buildState(builder.getState(), lastTime, state['timespan'])
+        self.appendDownsamples(builder.finish())
+        self.storeState(state)
+        self.seriesparent.rd.storeTimeIndex()
+        self.storeTimeIndices()
+
+        end = time.time()
+        logging.info(f"Done extending downsamples. Took {round(end - start, 5)}s.")
+
+        # Clear self._numDownsamples so that it updates the next time it's accessed
+        self._numDownsamples = None
+
+        return True
+
+    # Returns the state from which the downsamples may be extended, given the
+    # state of the downsample builder before it was finished (see
+    # DownsampleBuilder.getState) and the time offset of the last data point
+    # built from. Along with it, the state holds the number of raw data rows
+    # built from, the timespan of the series the time-per-interval of the
+    # downsamples is based on, and the tuning parameters. Returns None if no
+    # builder state is provided.
+    def buildState(self, builderState, lastTime, timespan=None):
+
+        if builderState is None:
+            return None
+
+        return {
+            'rawRows': self.seriesparent.rawRows,
+            'lastTime': float(lastTime),
+            'timespan': float(self.seriesparent.rd.timespan if timespan is None else timespan),
+            'M': config['M'],
+            'stepMultiplier': config['stepMultiplier'],
+            'builder': builderState,
+        }
+
+    # Returns the state stored with the downsamples in the processed file (see
+    # buildState), or an empty dict if there is none.
+    def getStoredState(self):
+
+        grp = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample)]
+
+        if grp is None:
+            return {}
+
+        return grp.meta
+
+    # Stores the state from which the downsamples may be extended (see
+    # buildState) with the downsamples in the processed file.
+    def storeState(self, state):
+
+        self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample)].meta = state
+
+        # Clear self._timespan so that it updates the next time it's accessed
+        self._timespan = None
+
+    # Stores the time index of each downsample (see getTimeIndex) in the
+    # processed file, replacing any stored before.
+    def storeTimeIndices(self):
+
+        path = '/'.join(self.seriesparent.h5pathDownsample)
+        ndtb = self.getNumDownsamplesFromFile()
+
+        if self.seriesparent.fileparent.pf[path + '/timeindices'] is not None:
+            del self.seriesparent.fileparent.pf.hdf[path + '/timeindices']
+
+        for i in range(ndtb):
+            ds = self.seriesparent.fileparent.pf[path + '/' + str(i)]
+            self.seriesparent.fileparent.pf[path + '/timeindices/' + str(i)] = ds.hdf.fields('0')[::ds.hdf.chunks[0]][:, np.newaxis]
+
+        self._timeIndices = {}
+        getSliceCache().invalidate(str(self.seriesparent.fileparent.procFilePathObj), self.seriesparent.id)
+
+    # Removes all downsamples for the series from the processed file.
+    def removeDownsamples(self):
+
+        path = '/'.join(self.seriesparent.h5pathDownsample)
+
+        if self.seriesparent.fileparent.pf[path] is not None:
+            del self.seriesparent.fileparent.pf.hdf[path]
+
+        # Clear self._numDownsamples, self._timespan & self._timeIndices so that
+        # they update the next time they're accessed
+        self._numDownsamples = None
+        self._timespan = None
+        self._timeIndices = {}
+        getSliceCache().invalidate(str(self.seriesparent.fileparent.procFilePathObj), self.seriesparent.id)
+
+    # Reads through the raw data in blocks of at most chunkSize rows and returns
+    # the number of downsamples to build along with the time offsets of the
+    # first & last (non-nan) data points. The number of downsamples is the same
+    # as numDownsamplesToBuild yields for the raw data in full, with the sliding
+    # window of 2M data points carried over from one block to the next.
+    def scanRawData(self, chunkSize):
+
+        M = config['M']
+
+        # Holds the number of data points, the time offsets of the first & last,
+        # the time window of the first 2M data points, and the smallest positive
+        # time window of any 2M consecutive data points.
+        numDataPoints = 0
+        firstTime = lastTime = None
+        firstTimeWindow = smallestTimeWindow = None
+        decreasing = False
+
+        # Holds the time offsets of the last 2M-1 data points seen
+        tail = np.zeros(0)
+
+        for rawTimes, _ in self.seriesparent.iterRawDataBlocks(chunkSize):
+
+            if rawTimes.shape[0] < 1:
+                continue
+
+            if firstTime is None:
+                firstTime = rawTimes[0]
+            lastTime = rawTimes[-1]
+            numDataPoints = numDataPoints + rawTimes.shape[0]
+
+            # Compute the time windows of all 2M data points ending in this block
+            times = np.concatenate((tail, rawTimes))
+            if times.shape[0] >= 2*M:
+                timeWindows = times[2*M-1:] - times[:-(2*M-1)]
+                if firstTimeWindow is None:
+                    firstTimeWindow = smallestTimeWindow = timeWindows[0]
+                positiveTimeWindows = timeWindows[timeWindows > 0]
+                if positiveTimeWindows.shape[0] > 0:
+                    smallestTimeWindow = min(smallestTimeWindow, positiveTimeWindows.min())
+                decreasing = decreasing or bool((timeWindows < 0).any())
+            tail = times[-(2*M-1):]
+
+        # If we have fewer than or equal to 2M data points, no downsamples need
+        # to be built.
+        if numDataPoints <= 2*M:
+            return 0, firstTime, lastTime
+
+        # Having passed the check above, do the same sanity checks as
+        # numDownsamplesToBuild.
+        if firstTimeWindow == 0:
+            raise Exception('All values are at the same point in time. Cannot downsample.')
+        elif firstTimeWindow < 0 or decreasing:
+            raise Exception('Series violates assumption of monotonically increasing time values (i.e. series should be ordered in time).')
+
+        return numDownsamplesForTimeWindow(lastTime - firstTime, smallestTimeWindow, M, config['stepMultiplier']), firstTime, lastTime
+
     # Returns the index of the appropriate downsample which should be used for
     # the given timespan, or -1 if raw data should be used instead.
     def whichDownsampleIndexForTimespan(self, timespan):
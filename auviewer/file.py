@@ -1,16 +1,32 @@
 from pathlib import Path
 from sqlalchemy import distinct, or_, select
+import gzip
+import itertools
 import logging
+import os
+import multiprocessing as mp
+import shutil
 import time
 import traceback
 import pandas as pd
 
 import audata
+import simplejson
 
 from . import models
+from .config import config
 from .cylib import generateThresholdAlerts
+from .jsonstream import iterEncodePayload
 from .series import Series, simpleSeriesName
 from .shared import annotationOrPatternOutput
+from .slicecache import getSliceCache
+
+# Name of the attribute of the processed file holding the series catalog (see
+# File.storeSeriesCatalog)
+seriesCatalogAttr = '.series_catalog'
+
+# Datasets of the original file from which events are read (see File.getEvents)
+eventDatasets = ['ehr/medications', 'low_rate']
 
 class File:
     """
@@ -31,31 +47,74 @@ class File:
         self.origFilePathObj = origFilePathObj
         self.procFilePathObj = procFilePathObj
 
+        # Path of the cache of the serialized file payload (see
+        # getInitialPayloadJSON), next to the processed file
+        self.payloadCacheFilePathObj = None if procFilePathObj is None else Path(procFilePathObj).with_suffix('.payload.json.gz')
+
+        # Path of the folder holding the raw columns of the series, if stored
+        # (see RawData.storeColumns), next to the processed file
+        self.rawColumnsDirPathObj = None if procFilePathObj is None else Path(procFilePathObj).with_suffix('.raw')
+
         # Store file if already read
         self._file = None
         self._processed_file = None
 
+        # Identity of the processed file when opened for reading (see
+        # getProcFileIdentity), by which it is reopened once replaced by an
+        # update (see process)
+        self.procFileIdentity = None
+
         # Filename
         self.name = Path(self.origFilePathObj).name
 
-        # Will hold the data series from the file
-        self.series = []
+        # Will hold the data series from the file once loaded (see series), and
+        # the series catalog stored in the processed file if they were loaded
+        # from it (see loadSeriesCatalog)
+        self._series = None
+        self.seriesCatalog = None
 
     @property
     def f(self):       
         if self._file is None:
             # Open the original file only if the donwsampled version exists
-            # TODO(vedant) : does this behavior need to be changed? since current multiprocessing does not support prioritization,
-            # users may have to wait for a while to view their files
             self._file = audata.File.open(str(self.origFilePathObj), return_datetimes=False)
 
-            # Load series data into memory
-            self.load()
+            # Load series data into memory, unless already loaded
+            if self._series is None:
+                self.load()
 
         return self._file
 
+    @property
+    def series(self):
+        """
+        The data series of the file, set up from the series catalog stored in the processed file if available & up to
+        date with the original file (see loadSeriesCatalog), and otherwise loaded from the original file.
+        """
+        # Set the series up afresh if the processed file has been updated since
+        # opened (see pf)
+        if self._processed_file is not None:
+            _ = self.pf
+        if self._series is None and not self.loadSeriesCatalog():
+            _ = self.f
+        return self._series
+
     @property
     def pf(self):
+
+        # Reopen the processed file if it has been replaced by an update since
+        # opened (see process), setting up the series afresh
+        if self._processed_file is not None and self.procFileIdentity is not None:
+            try:
+                identity = self.getProcFileIdentity()
+            except OSError:
+                identity = None
+            if identity != self.procFileIdentity:
+                logging.info(f"Processed file {self.procFilePathObj} has been updated. Reopening.")
+                self.close()
+                self._series = None
+                self.seriesCatalog = None
+
         if self._processed_file is None:
             if not self.procFilePathObj.exists():
                 # TODO(vedant/gus) : inform the front end instead of backend about the file being downsampled
@@ -68,6 +127,7 @@ class File:
                     raise RuntimeError("Temp file for corresponding processed file does not exist. This indicates that the file is currently in the process of being downsampled, or the downsampled file is corrupted")
 
                 # Loads the processed file if no issues are detected
+                self.procFileIdentity = self.getProcFileIdentity()
                 self._processed_file = audata.File.open(str(self.procFilePathObj), return_datetimes=False)
 
         return self._processed_file
@@ -89,7 +149,13 @@ class File:
         except:
             pass
 
-        self._file, self._processed_file = None, None
+        self._file, self._processed_file, self.procFileIdentity = None, None, None
+
+        # Drop the file's cached downsample data
+        try:
+            getSliceCache().invalidate(str(self.procFilePathObj))
+        except:
+            pass
 
     def __del__(self):
         self.close()
@@ -212,7 +278,13 @@ class File:
             drop_values_below=None,
             drop_values_above=None,
             drop_values_between=None,
+            screen=False,
         ):
+        """
+        Runs pattern detection on the series provided, and returns the patterns detected as a list of [start, stop]
+        pairs. If screen is set, raw data is only read where patterns may start, as screened with the downsamples of
+        each series (see Series.generateThresholdAlerts).
+        """
 
         # Ensure that the file is open
         _ = self.f
@@ -221,28 +293,23 @@ class File:
         
         assert type == 'patterndetection', "detectPatterns() currently only supports type='patterndetection'"
 
-        assert thresholdlow is not None or thresholdhigh is not None, "We need at least one of thresholdlow or thresholdhigh in order to perform pattern detection."
-
-        assert duration is not None, "We need a duration in order to perform pattern detection."
-
-        assert persistence is not None, "We need a persistence in order to perform pattern detection."
-
-        assert maxgap is not None, "We need a maxgap in order to perform pattern detection."
+        params = getThresholdAlertParams(
+            thresholdlow,
+            thresholdhigh,
+            duration,
+            persistence,
+            maxgap,
+            expected_frequency=expected_frequency,
+            min_density=min_density,
+            drop_values_below=drop_values_below,
+            drop_values_above=drop_values_above,
+            drop_values_between=drop_values_between,
+        )
 
         # If series is a string, make it a list
         if isinstance(series, str):
             series = [series]
 
-        # Determine the mode (see generateThresholdAlerts function description for details on this parameter).
-        if thresholdhigh is None:
-            mode = 0
-            thresholdhigh = 0
-        elif thresholdlow is None:
-            mode = 1
-            thresholdlow = 0
-        else:
-            mode = 2
-            
         if type == 'patterndetection':
 
             # Find the series & run pattern detection
@@ -250,18 +317,7 @@ class File:
             for ts in series:
                 for s in self.series:
                     if s.id == ts:
-                        patterns += s.generateThresholdAlerts(
-                            thresholdlow, 
-                            thresholdhigh, 
-                            mode, duration, 
-                            persistence, 
-                            maxgap, 
-                            expected_frequency=expected_frequency, 
-                            min_density=min_density,
-                            drop_values_below=drop_values_below,
-                            drop_values_above=drop_values_above,
-                            drop_values_between=drop_values_between,
-                        ).tolist()
+                        patterns += s.generateThresholdAlerts(**params, screen=screen).tolist()
                         continue
 
             return patterns
@@ -329,6 +385,43 @@ class File:
         # Having reached this point, we were unable to generate the alerts.
         return []
 
+    def sweepPatterns(self, type, series, paramsets):
+        """
+        Runs pattern detection on the series provided for each of many parameter sets, reading the raw data of each
+        series once (see Series.sweepThresholdAlerts), and returns a dict mapping each parameter set ID to the patterns
+        detected with it, as detectPatterns would return them.
+        :param paramsets: dict mapping parameter set ID to a dict of the detectPatterns keyword arguments thresholdlow,
+            thresholdhigh, duration, persistence, maxgap and optionally expected_frequency, min_density,
+            drop_values_below, drop_values_above & drop_values_between
+        """
+
+        # Ensure that the file is open
+        _ = self.f
+
+        assert isinstance(series, str) or isinstance(series, list), "series must be a string or list"
+
+        assert type == 'patterndetection', "sweepPatterns() currently only supports type='patterndetection'"
+
+        params = {id: getThresholdAlertParams(**p) for id, p in paramsets.items()}
+
+        # If series is a string, make it a list
+        if isinstance(series, str):
+            series = [series]
+
+        # Find the series & run pattern detection
+        patterns = {id: [] for id in params}
+        for ts in series:
+            for s in self.series:
+                if s.id == ts:
+                    for id, alerts in s.sweepThresholdAlerts(params).items():
+                        patterns[id] += alerts.tolist()
+
+        return patterns
+
+    def getCachedFilePayloadJSON(self):
+        """Returns the JSON-encoded output of getFilePayload, served from the payload cache file where valid."""
+        return ''.join(self.iterCachedFilePayloadJSON())
+
     def getEvents(self):
         """Returns all event series"""
 
@@ -341,6 +434,12 @@ class File:
         if self.mode() == 'realtime':
             return events
 
+        # Event datasets absent from the series catalog, if loaded, are skipped
+        # without accessing the original file
+        _ = self.series
+        def present(path):
+            return self.seriesCatalog is None or path in self.seriesCatalog['events']
+
         def catcols(row, idcol=None):
             idx = row[idcol]
             return (idx, '\n'.join(
@@ -350,8 +449,9 @@ class File:
         try:
 
             # Prepare references to HDF5 data
-            meds = self.f['ehr/medications'][:]
-            events['meds'] = meds.apply(catcols, 1, idcol='time').tolist()
+            if present('ehr/medications'):
+                meds = self.f['ehr/medications'][:]
+                events['meds'] = meds.apply(catcols, 1, idcol='time').tolist()
 
         except Exception:
             print("Error retrieving meds.")
@@ -360,8 +460,9 @@ class File:
         try:
 
             # Prepare references to HDF5 data
-            ce = self.f['low_rate'][:]
-            events['ce'] = ce.apply(catcols, 1, idcol='date').tolist()
+            if present('low_rate'):
+                ce = self.f['low_rate'][:]
+                events['ce'] = ce.apply(catcols, 1, idcol='date').tolist()
 
         except Exception:
             print("Error retrieving ce.")
@@ -405,59 +506,19 @@ class File:
             break
     
 
-    def getInitialPayload(self, user_id):
-        """Produces JSON output for all series in the file at the maximum time range."""
+    def getFilePayload(self, columnar=False):
+        """
+        Produces the part of the initial payload which is the same for all users: the file name, events, metadata and
+        output for all series in the file at the maximum time range. If columnar is set, the data of each series is
+        provided as a list of columns rather than rows (see Series.getFullOutput).
+        """
 
         logging.info(f"Assembling all series full output for file {self.origFilePathObj}.")
         start = time.time()
 
-        if self.mode() == 'file':
-            try:
-                _ = self.pf
-            except:
-                return {}
-
         # Assemble the output object.
         outputObject = {
             'filename': self.origFilePathObj.name,
-            'annotationsets': [{
-                'id': 'general',
-                'name': 'General',
-                'description': None,
-                'annotations': [annotationOrPatternOutput(a) for a in models.Annotation.query.filter_by(user_id=user_id, project_id=self.projparent.id, file_id=self.id, pattern_set_id=None).all()],
-                'show': True,
-            }] + [
-                {
-                    'id': patternset.id,
-                    'name': patternset.name,
-                    'description': patternset.description,
-                    'annotations': [annotationOrPatternOutput(a) for a in models.Annotation.query.filter_by(user_id=user_id, project_id=self.projparent.id, file_id=self.id, pattern_set_id=patternset.id).all()],
-                    'show': patternset.show_by_default,
-                } for patternset in models.PatternSet.query.filter(models.PatternSet.project_id==self.projparent.id, or_(
-                    models.PatternSet.id.notin_(
-                        select(distinct(models.patternSetAssignments.c.pattern_set_id))
-                    ),
-                    models.PatternSet.id.in_(
-                        select(models.patternSetAssignments.c.pattern_set_id).where(models.patternSetAssignments.c.user_id==user_id)
-                    )
-                )).all()
-            ],
-            'patternsets': [
-                {
-                    'id': patternset.id,
-                    'name': patternset.name,
-                    'description': patternset.description,
-                    'patterns': [annotationOrPatternOutput(pattern) for pattern in models.Pattern.query.filter_by(pattern_set_id=patternset.id, file_id=self.id).all()],
-                    'show': patternset.show_by_default,
-                } for patternset in models.PatternSet.query.filter(models.PatternSet.project_id==self.projparent.id, or_(
-                    models.PatternSet.id.notin_(
-                        select(distinct(models.patternSetAssignments.c.pattern_set_id))
-                    ),
-                    models.PatternSet.id.in_(
-                        select(models.patternSetAssignments.c.pattern_set_id).where(models.patternSetAssignments.c.user_id==user_id)
-                    )
-                )).all()
-            ],
             'baseTime': 0, # ATW: Not sure if this is still necessary.
             'events': self.getEvents(),
             'metadata': self.getMetadata(),
@@ -465,7 +526,7 @@ class File:
         }
 
         for s in self.series:
-            outputObject['series'][s.id] = s.getFullOutput()
+            outputObject['series'][s.id] = s.getFullOutput(columnar)
 
         end = time.time()
         logging.info(f"Completed assembly of all series full output for file {self.origFilePathObj}. Took {str(round(end - start, 5))}s.")
@@ -473,13 +534,43 @@ class File:
         # Return the output object
         return outputObject
 
+    def getInitialPayload(self, user_id, columnar=False):
+        """
+        Produces JSON output for all series in the file at the maximum time range, along with the user's annotations
+        and the file's patterns. If columnar is set, the data of each series is provided as a list of columns rather
+        than rows (see Series.getFullOutput).
+        """
+
+        if self.mode() == 'file':
+            try:
+                _ = self.pf
+            except:
+                return {}
+
+        return {**self.getUserPayload(user_id), **self.getFilePayload(columnar)}
+
+    def getInitialPayloadJSON(self, user_id):
+        """Produces the output of getInitialPayload encoded as JSON (see iterInitialPayloadJSON)."""
+        return ''.join(self.iterInitialPayloadJSON(user_id))
+
     def getMetadata(self):
         """Returns a dict of file metadata."""
+        _ = self.series
+        if self.seriesCatalog is not None:
+            return self.seriesCatalog['metadata']
         try:
             return self.f.file_meta
         except:
             return {}
 
+    def getProcFileIdentity(self):
+        """
+        Returns the identity of the processed file on the file system, as (inode, modification time), which changes
+        when the processed file is replaced by an update (see process).
+        """
+        stat = self.procFilePathObj.stat()
+        return stat.st_ino, stat.st_mtime_ns
+
     def getSeries(self, seriesid):
         """
         Returns the series instance corresponding to the provided series ID, or None if the series cannot be found.
@@ -514,8 +605,11 @@ class File:
 
         return series
 
-    def getSeriesRangedOutput(self, seriesids, start, stop):
-        """Produces JSON output for a given list of series in the file at a specified time range."""
+    def getSeriesRangedOutput(self, seriesids, start, stop, columnar=False):
+        """
+        Produces JSON output for a given list of series in the file at a specified time range. If columnar is set,
+        the data of each series is provided as a list of columns rather than rows (see Series.getRangedOutput).
+        """
 
         logging.info(f"Assembling series ranged output for file {self.origFilePathObj}, series [{', '.join(seriesids)}].")
         st = time.time()
@@ -526,7 +620,7 @@ class File:
 
         for s in self.series:
             if s.id in seriesids:
-                outputObject['series'][s.id] = s.getRangedOutput(start, stop)
+                outputObject['series'][s.id] = s.getRangedOutput(start, stop, columnar)
 
         et = time.time()
         logging.info(f"Completed assembly of series ranged output for file {self.origFilePathObj}, series [{', '.join(seriesids)}]. Took {str(round(et - st, 5))}s.")
@@ -534,6 +628,140 @@ class File:
         # Return the output object
         return outputObject
 
+    def getUserPayload(self, user_id):
+        """Produces the part of the initial payload which is particular to a user: annotation sets & pattern sets."""
+
+        # Pattern sets available to the user
+        patternsets = models.PatternSet.query.filter(models.PatternSet.project_id==self.projparent.id, or_(
+            models.PatternSet.id.notin_(
+                select(distinct(models.patternSetAssignments.c.pattern_set_id))
+            ),
+            models.PatternSet.id.in_(
+                select(models.patternSetAssignments.c.pattern_set_id).where(models.patternSetAssignments.c.user_id==user_id)
+            )
+        )).all()
+
+        return {
+            'annotationsets': [{
+                'id': 'general',
+                'name': 'General',
+                'description': None,
+                'annotations': [annotationOrPatternOutput(a) for a in models.Annotation.query.filter_by(user_id=user_id, project_id=self.projparent.id, file_id=self.id, pattern_set_id=None).all()],
+                'show': True,
+            }] + [
+                {
+                    'id': patternset.id,
+                    'name': patternset.name,
+                    'description': patternset.description,
+                    'annotations': [annotationOrPatternOutput(a) for a in models.Annotation.query.filter_by(user_id=user_id, project_id=self.projparent.id, file_id=self.id, pattern_set_id=patternset.id).all()],
+                    'show': patternset.show_by_default,
+                } for patternset in patternsets
+            ],
+            'patternsets': [
+                {
+                    'id': patternset.id,
+                    'name': patternset.name,
+                    'description': patternset.description,
+                    'patterns': [annotationOrPatternOutput(pattern) for pattern in models.Pattern.query.filter_by(pattern_set_id=patternset.id, file_id=self.id).all()],
+                    'show': patternset.show_by_default,
+                } for patternset in patternsets
+            ],
+        }
+
+    def iterCachedFilePayloadJSON(self):
+        """
+        Yields the JSON encoding of the output of getFilePayload in pieces, from the payload cache file if it was made
+        from the current processed file, and otherwise as it is encoded (see iterFilePayloadJSON) while storing it in
+        the cache file. The cache file holds the modification time of the processed file it was made from on its first
+        line, followed by the JSON. The first piece yielded is always the opening brace.
+        """
+
+        procFileMTime = str(os.stat(self.procFilePathObj).st_mtime_ns)
+
+        try:
+            fp = gzip.open(self.payloadCacheFilePathObj, 'rt', encoding='utf-8')
+        except OSError:
+            fp = None
+        if fp is not None:
+            with fp:
+                try:
+                    valid = fp.readline().rstrip('\n') == procFileMTime
+                except (OSError, EOFError):
+                    valid = False
+                if valid:
+                    logging.info(f"Serving cached file payload for file {self.origFilePathObj}.")
+                    yield fp.read(1)
+                    while True:
+                        piece = fp.read(1024 * 1024)
+                        if not piece:
+                            return
+                        yield piece
+
+        # Write the cache file under a temporary name as the payload is encoded,
+        # and move it into place once complete, so that a partially written
+        # cache file is never read.
+        tmpPathObj = self.payloadCacheFilePathObj.with_name(f"{self.payloadCacheFilePathObj.name}.{os.getpid()}.tmp")
+        try:
+            cacheFile = gzip.open(tmpPathObj, 'wt', encoding='utf-8', compresslevel=6)
+            cacheFile.write(procFileMTime + '\n')
+        except OSError as e:
+            logging.error(f"Unable to store the file payload cache {self.payloadCacheFilePathObj}.\n{e}\n{traceback.format_exc()}")
+            yield from self.iterFilePayloadJSON()
+            return
+
+        complete = False
+        try:
+            for piece in self.iterFilePayloadJSON():
+                cacheFile.write(piece)
+                yield piece
+            complete = True
+        finally:
+            cacheFile.close()
+            if complete:
+                os.replace(tmpPathObj, self.payloadCacheFilePathObj)
+            else:
+                tmpPathObj.unlink(missing_ok=True)
+
+    def iterFilePayloadJSON(self):
+        """
+        Yields the JSON encoding of the output of getFilePayload in pieces, encoding the series one at a time, so that
+        the full output is never held in memory (see jsonstream.iterEncodePayload).
+        """
+        return iterEncodePayload({
+            'filename': self.origFilePathObj.name,
+            'baseTime': 0, # ATW: Not sure if this is still necessary.
+            'events': self.getEvents(),
+            'metadata': self.getMetadata(),
+        }, ((s.id, s.getFullOutput(columnar=True)) for s in self.series))
+
+    def iterInitialPayloadJSON(self, user_id):
+        """
+        Returns an iterator over the JSON encoding of the output of getInitialPayload, in pieces. In file-mode, the
+        part of the payload which is the same for all users (see getFilePayload) is served from a gzip-compressed cache
+        file next to the processed file, which is rebuilt when the processed file has been modified since (see
+        iterCachedFilePayloadJSON). The user's part is assembled immediately, and the rest as the iterator is consumed.
+        """
+
+        if self.mode() != 'file':
+            return iter([simplejson.dumps(self.getInitialPayload(user_id), ignore_nan=True)])
+
+        try:
+            _ = self.pf
+        except:
+            return iter(['{}'])
+
+        userPayloadJSON = simplejson.dumps(self.getUserPayload(user_id), ignore_nan=True)
+
+        # Merge the two JSON objects, skipping the opening brace of the second
+        return itertools.chain([userPayloadJSON[:-1] + ', '], itertools.islice(self.iterCachedFilePayloadJSON(), 1, None))
+
+    def iterSeriesRangedOutputJSON(self, seriesids, start, stop):
+        """
+        Yields the JSON encoding of the output of getSeriesRangedOutput in pieces, assembling & encoding the series one
+        at a time, so that the full output is never held in memory (see jsonstream.iterEncodePayload).
+        """
+        return iterEncodePayload({}, ((s.id, s.getRangedOutput(start, stop, columnar=True)) for s in self.series if s.id in seriesids))
+
     def load(self):
         """
         Loads the necessary data into memory for an already-processed data file
@@ -543,12 +771,46 @@ class File:
 
         logging.info('Loading series from file.')
 
+        # Reset the series, which are loaded from the original file
+        self._series = []
+        self.seriesCatalog = None
+
         # Iterate through all datasets in the partial file
         for (ds, _) in self.f.recurse():
             self.loadSeriesFromDataset(ds)
 
         logging.info('Completed loading series from file.')
 
+    def loadSeriesCatalog(self):
+        """
+        Sets up the series from the series catalog stored in the processed file (see storeSeriesCatalog), without
+        accessing the original file. The catalog is only used if the original file has not been modified since it was
+        stored.
+        :return: whether the series were set up from the catalog
+        """
+
+        try:
+            attr = self.pf.hdf.attrs.get(seriesCatalogAttr)
+        except Exception:
+            # We assume the processed file does not exist (or is being processed)
+            return False
+
+        if attr is None:
+            return False
+
+        catalog = simplejson.loads(attr)
+        st = self.origFilePathObj.stat()
+        if catalog['original'] != {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}:
+            logging.info(f"The series catalog of {self.procFilePathObj} is out of date with the original file.")
+            return False
+
+        logging.info('Loading series from the series catalog.')
+
+        self._series = [Series(None, e['timecol'], e['valcol'], self, catalogEntry=e) for e in catalog['series']]
+        self.seriesCatalog = catalog
+
+        return True
+
     def loadSeriesFromDataset(self, ds):
         """Load all available series from a dataset"""
 
@@ -584,16 +846,50 @@ class File:
             else:
                 logging.warning(f'  - Skipping unsupported {coltype} series: {valcol}')
 
+    def processSeriesInParallel(self, series, jobs, progress=None):
+        """
+        Build the downsamples of the series provided in a pool of worker processes, each of which reads its series
+        from the original file, and store them in the processed file as they are received. This process is the only
+        writer of the processed file. If provided, progress is called as progress(done, total) with the number of
+        series stored so far and in total.
+        """
+
+        logging.info(f"Downsampling {len(series)} series with {jobs} worker processes.")
+
+        # Pass along the tuning parameters, as workers do not necessarily
+        # inherit the configuration (e.g. with the spawn start method).
+        tuning = {k: config[k] for k in ('M', 'stepMultiplier', 'downsampleEngine', 'downsampleChunkSize')}
+
+        seriesByID = {s.id: s for s in series}
+        with mp.Pool(processes=min(jobs, len(series))) as pool:
+            for i, (seriesID, downsamples, state, timeIndex) in enumerate(pool.imap_unordered(buildSeriesDownsamples, [(str(self.origFilePathObj), s.getCatalogEntry(), tuning) for s in series])):
+                seriesByID[seriesID].storeDownsamples(downsamples, state, timeIndex)
+                if progress is not None:
+                    progress(i + 1, len(series))
+
     # TODO(gus): When reviving realtime functionality, revise this
     def mode(self):
         """Returns the mode in which File is operating, either "file" or "realtime"."""
         return 'file'
 
-    def process(self):
-        """Process and store all downsamples for all series for the file."""
+    def process(self, jobs=1, progress=None):
+        """
+        Process and store all downsamples for all series for the file. If jobs is greater than 1, the series are
+        downsampled concurrently in a pool of that many worker processes, with this process storing the results. If
+        provided, progress is called as progress(done, total) with the number of series stored so far and in total.
+
+        If the processed file already exists, it is updated instead: the downsamples of each series which has grown
+        since are extended with its new rows only, and only series whose downsamples cannot be extended (see
+        DownsampleSet.extendAndStore) are downsampled in full again. As the processed file may be open for reading
+        elsewhere (e.g. by the server), the update is written to a copy, which replaces it once complete (see pf). If
+        the update fails, the existing processed file is kept.
+        """
 
-        # Create a path name for temporary file
+        # Create a path name for temporary file, and for the copy of the
+        # processed file to update
         tmp_file = self.procFilePathObj.with_suffix(self.procFilePathObj.suffix + '.tmp')
+        update_file = self.procFilePathObj.with_suffix(self.procFilePathObj.suffix + '.update')
+        updating = False
         try:
 
             logging.info(f"Processing & storing all series for file {self.origFilePathObj}.")
@@ -602,26 +898,74 @@ class File:
             # Print user message
             print(f"Downsampling file {self.name}...")
 
-            # Create the file for storing processed data.
-            self._processed_file = audata.File.new(str(self.procFilePathObj), overwrite=False, time_reference=self.f.time_reference, return_datetimes=False)
-            
-            # Create a tmp file to indicate a file that has in the process of getting donwsampled
-            # These tmp files will be deleted either after successful downsampling or after restarting
-            # the viewer. 
-            #
-            # Tmp files are always presereved in the event where the file could not be successfully downsampled
-            # and the processed file could not be deleted.
-            with open(str(tmp_file), 'w') as fp:
-                pass
+            # Load the series from the original file
+            self.load()
+
+            # Open a copy of the processed file for updating if it exists,
+            # otherwise create the file for storing processed data.
+            updating = self.procFilePathObj.exists()
+            if updating:
+                if self._processed_file is not None:
+                    self._processed_file.close()
+                    self._processed_file, self.procFileIdentity = None, None
+                shutil.copyfile(self.procFilePathObj, update_file)
+                self._processed_file = audata.File.open(str(update_file), readonly=False, return_datetimes=False)
+            else:
+                self._processed_file = audata.File.new(str(self.procFilePathObj), overwrite=False, time_reference=self.f.time_reference, return_datetimes=False)
+
+                # Create a tmp file to indicate a file that has in the process of getting donwsampled
+                # These tmp files will be deleted either after successful downsampling or after restarting
+                # the viewer.
+                #
+                # Tmp files are always presereved in the event where the file could not be successfully downsampled
+                # and the processed file could not be deleted.
+                with open(str(tmp_file), 'w') as fp:
+                    pass
+
+            if progress is not None:
+                progress(0, len(self.series))
+
+            # If updating, extend the downsamples of each series where possible,
+            # and remove the downsamples of the rest to process them in full.
+            series = self.series
+            if updating:
+                series = []
+                for i, s in enumerate(self.series):
+                    if not s.extendAndStore():
+                        s.dss.removeDownsamples()
+                        series.append(s)
+                    elif progress is not None:
+                        progress(i + 1 - len(series), len(self.series))
 
             # Process & store numeric series
-            for s in self.series:
-                s.processAndStore()
+            numExtended = len(self.series) - len(series)
+            if jobs > 1 and len(series) > 1:
+                self.processSeriesInParallel(series, jobs, None if progress is None else lambda done, _: progress(numExtended + done, len(self.series)))
+            else:
+                for i, s in enumerate(series):
+                    s.processAndStore()
+                    if progress is not None:
+                        progress(numExtended + i + 1, len(self.series))
+
+            # Reload series data in memory since we have new downsamples, and
+            # store the series catalog for the file to be viewed without
+            # accessing the original file
+            origStat = self.origFilePathObj.stat()
+            self.load()
+            self.storeSeriesCatalog(origStat)
+
+            # Store the raw columns of the series if configured
+            if config['rawColumnStore']:
+                for s in self.series:
+                    s.rd.storeColumns()
 
             self._processed_file.flush()
 
-            # Reload series data in memory since we have new downsamples
-            self.load()
+            # Replace the processed file with the updated copy
+            if updating:
+                self._processed_file.close()
+                self._processed_file = None
+                os.replace(update_file, self.procFilePathObj)
 
             # Print user message
             print("Done.")
@@ -632,7 +976,6 @@ class File:
         except (KeyboardInterrupt, SystemExit):
 
             logging.warning("Interrupt detected. Aborting as requested.")
-            logging.warning(f"Deleting partially completed processed file {self.procFilePathObj}.")
 
             # Close the file
             try:
@@ -640,44 +983,70 @@ class File:
             except Exception as e:
                 logging.error(f"Unable to close the processed file.\n{e}\n{traceback.format_exc()}")
 
-            # Delete the processed data file
-            try:
-                self.procFilePathObj.unlink()
-            except Exception as e:
-                logging.error(f"Unable to delete file successfully. \n{e}\n{traceback.format_exc()}")
+            # Delete the partially updated copy, keeping the processed file, or
+            # the partially completed processed file
+            if updating:
+                logging.warning(f"Deleting partially updated copy {update_file} of processed file {self.procFilePathObj}.")
+                update_file.unlink(missing_ok=True)
             else:
-                tmp_file.unlink()
-    
+                logging.warning(f"Deleting partially completed processed file {self.procFilePathObj}.")
+                try:
+                    self.procFilePathObj.unlink()
+                except Exception as e:
+                    logging.error(f"Unable to delete file successfully. \n{e}\n{traceback.format_exc()}")
+                else:
+                    tmp_file.unlink(missing_ok=True)
 
             # Quit the program
             quit()
 
         except Exception as e:
 
-            logging.error(f"There was an exception while processing & storing data for {self.origFilePathObj}.\n{e}\n{traceback.format_exc()}\nDeleting partially completed processed file {self.procFilePathObj}.")
-
             # Close the file
             try:
                 self._processed_file.close()
             except Exception as e:
                 logging.error(f"Unable to close the processed file.\n{e}\n{traceback.format_exc()}")
 
-            # Delete the processed data file
-            try:
-                self.procFilePathObj.unlink(missing_ok=True)
-            except Exception as e:
-                logging.error(f"Unable to delete file successfully. \n{e}\n{traceback.format_exc()}")
+            # Delete the partially updated copy, keeping the processed file as
+            # it was, or the partially completed processed file
+            if updating:
+                logging.error(f"There was an exception while updating processed data for {self.origFilePathObj}.\n{e}\n{traceback.format_exc()}\nKeeping the existing processed file {self.procFilePathObj}.")
+                try:
+                    update_file.unlink(missing_ok=True)
+                except Exception as e:
+                    logging.error(f"Unable to delete file successfully. \n{e}\n{traceback.format_exc()}")
             else:
-                tmp_file.unlink()
+                logging.error(f"There was an exception while processing & storing data for {self.origFilePathObj}.\n{e}\n{traceback.format_exc()}\nDeleting partially completed processed file {self.procFilePathObj}.")
+                try:
+                    self.procFilePathObj.unlink(missing_ok=True)
+                except Exception as e:
+                    logging.error(f"Unable to delete file successfully. \n{e}\n{traceback.format_exc()}")
+                else:
+                    tmp_file.unlink(missing_ok=True)
 
-            logging.info("File has been removed.")
+                logging.info("File has been removed.")
 
             # Re-raise the exception
             raise
 
         else:
             # Deletes temporary files if files are downsampled successfully
-            tmp_file.unlink()
+            tmp_file.unlink(missing_ok=True)
+
+    def storeSeriesCatalog(self, origStat):
+        """
+        Stores the series catalog in the processed file: the file metadata, the event datasets present, and the
+        catalog entry of each series (see Series.getCatalogEntry), along with the size & modification time of the
+        original file (as provided by stat, before the series were loaded) which it describes.
+        """
+
+        self._processed_file.hdf.attrs[seriesCatalogAttr] = simplejson.dumps({
+            'original': {'size': origStat.st_size, 'mtime_ns': origStat.st_mtime_ns},
+            'metadata': self.f.file_meta,
+            'events': [path for path in eventDatasets if self.f[path] is not None],
+            'series': [s.getCatalogEntry() for s in self.series],
+        }, ignore_nan=True)
 
     def updateAnnotation(self, user_id, id, left=None, right=None, top=None, bottom=None, seriesID='', label=''):
         """Update an annotation with new values"""
@@ -703,3 +1072,88 @@ class File:
 
         # Return true to indicate success
         return True
+
+def buildSeriesDownsamples(params):
+    """
+    Builds all downsamples for a single series of an original file, for use in a worker process of
+    File.processSeriesInParallel. Takes a tuple with the original file path, the catalog entry of the series (see
+    Series.getCatalogEntry), and the tuning parameters to apply to the config. Only the series itself is set up, from
+    its catalog entry, rather than all series of the file. Returns a tuple with the series ID, the downsamples built,
+    the state from which they may be extended, and the time index of the raw data (None if no downsamples were built).
+    """
+
+    origFilePath, catalogEntry, tuning = params
+    config.update(tuning)
+
+    f = File(None, -1, Path(origFilePath), None)
+    try:
+        s = Series(None, catalogEntry['timecol'], catalogEntry['valcol'], f, catalogEntry=catalogEntry)
+        f._series = [s]
+        downsamples, state = s.buildDownsamples()
+        return s.id, downsamples, state, s.rd.buildTimeIndex() if len(downsamples) > 0 else None
+    finally:
+        f.close()
+
+def getThresholdAlertParams(
+        thresholdlow=None,
+        thresholdhigh=None,
+        duration=None,
+        persistence=None,
+        maxgap=None,
+        expected_frequency=0,
+        min_density=0,
+        drop_values_below=None,
+        drop_values_above=None,
+        drop_values_between=None,
+    ):
+    """
+    Validates the pattern detection parameters of File.detectPatterns and returns them as the keyword arguments of
+    Series.generateThresholdAlerts, with the mode determined by which of the thresholds are provided.
+    """
+
+    assert thresholdlow is not None or thresholdhigh is not None, "We need at least one of thresholdlow or thresholdhigh in order to perform pattern detection."
+
+    assert duration is not None, "We need a duration in order to perform pattern detection."
+
+    assert persistence is not None, "We need a persistence in order to perform pattern detection."
+
+    assert maxgap is not None, "We need a maxgap in order to perform pattern detection."
+
+    # Determine the mode (see generateThresholdAlerts function description for details on this parameter).
+    if thresholdhigh is None:
+        mode = 0
+        thresholdhigh = 0
+    elif thresholdlow is None:
+        mode = 1
+        thresholdlow = 0
+    else:
+        mode = 2
+
+    return {
+        'thresholdlow': thresholdlow,
+        'thresholdhigh': thresholdhigh,
+        'mode': mode,
+        'duration': duration,
+        'persistence': persistence,
+        'maxgap': maxgap,
+        'expected_frequency': expected_frequency,
+        'min_density': min_density,
+        'drop_values_below': drop_values_below,
+        'drop_values_above': drop_values_above,
+        'drop_values_between': drop_values_between,
+    }
+
+def callFileMethod(params):
+    """
+    Calls a method of a single file, for use in a worker process of Project.mapFiles, which opens the file with its own
+    handles. Takes a tuple with the file ID, the original & processed file paths, the method name, and the positional &
+    keyword arguments of the method. Returns a tuple with the file ID and the method's return value.
+    """
+
+    id, origFilePath, procFilePath, method, args, kwargs = params
+
+    f = File(None, id, Path(origFilePath), None if procFilePath is None else Path(procFilePath))
+    try:
+        return id, getattr(f, method)(*args, **kwargs)
+    finally:
+        f.close()
@@ -0,0 +1,67 @@
+"""Streaming JSON encoding of series data payloads."""
+
+import simplejson
+
+# Number of rows of series data to encode at a time
+chunkRows = 10000
+
+def iterEncodeSeriesOutput(output):
+    """
+    Encodes a series output with columnar data (as produced by Series.getFullOutput or Series.getRangedOutput with
+    columnar set) as JSON, yielding the encoding in pieces of up to chunkRows rows of data. The data is encoded as the
+    list of rows the non-columnar output provides, so the encoding is the same as that of the non-columnar output.
+    """
+
+    columns = output['data']
+    length = max([len(c) for c in columns if c is not None], default=0)
+
+    # Encode the items before & after the data, in order, around it
+    keys = list(output.keys())
+    head = simplejson.dumps({k: output[k] for k in keys[:keys.index('data')]}, ignore_nan=True)
+    tail = simplejson.dumps({k: output[k] for k in keys[keys.index('data') + 1:]}, ignore_nan=True)
+    yield head[:-1] + (', "data": [' if len(head) > 2 else '"data": [')
+
+    for start in range(0, length, chunkRows):
+        n = min(chunkRows, length - start)
+        rows = [list(r) for r in zip(*[[None] * n if c is None else c[start:start + n].tolist() for c in columns])]
+        yield (', ' if start > 0 else '') + simplejson.dumps(rows, ignore_nan=True)[1:-1]
+
+    yield ']' + (', ' + tail[1:] if len(tail) > 2 else '}')
+
+def iterEncodePayload(payload, series):
+    """
+    Encodes a payload as a JSON object, yielding the encoding in pieces. The payload's series are provided separately
+    as an iterable of (series ID, series output with columnar data) pairs, which are encoded under the "series" key
+    one at a time, so that only one is held in memory at a time (see iterEncodeSeriesOutput). The first piece yielded
+    is always the opening brace.
+    """
+
+    yield '{'
+
+    head = simplejson.dumps(payload, ignore_nan=True)
+    if len(head) > 2:
+        yield head[1:-1] + ', '
+
+    yield '"series": {'
+    for i, (seriesID, output) in enumerate(series):
+        yield (', ' if i > 0 else '') + simplejson.dumps(seriesID) + ': '
+        yield from iterEncodeSeriesOutput(output)
+    yield '}}'
+
+def iterEncodeBatchPayload(files):
+    """
+    Encodes a batch payload, {"files": [...]}, as a JSON object, yielding the encoding in pieces. The files are provided
+    as an iterable of file outputs (as produced by Project.iterBatchSeriesRangedOutput with columnar set), which are
+    encoded one at a time, with the series of each encoded as by iterEncodePayload. The first piece yielded is always
+    the opening brace.
+    """
+
+    yield '{"files": ['
+    for i, output in enumerate(files):
+        if i > 0:
+            yield ', '
+        if 'series' in output:
+            yield from iterEncodePayload({k: v for k, v in output.items() if k != 'series'}, output['series'].items())
+        else:
+            yield simplejson.dumps(output, ignore_nan=True)
+    yield ']}'
@@ -0,0 +1,147 @@
+"""
+Vectorized NumPy counterparts of the kernels in cylib. Each function here
+produces the same output as the cylib function of the same name, but works on
+whole arrays at once instead of walking one data point at a time.
+"""
+
+import logging
+import numpy as np
+
+from .cylib import buildDownsamplesUp
+
+# Given a series of raw values and a time-per-interval parameter, produces and
+# returns a two-dimension NumPy array of downsample intervals. The output is
+# bit-identical to cylib.buildDownsampleFromRaw.
+#
+# Rather than walking the raw data point by point, this computes the interval
+# boundaries of every data point in bulk by floor-division of its offset, finds
+# the data points which open a new interval, and reduces each interval's min &
+# max with np.minimum.reduceat & np.maximum.reduceat. It trades memory for
+# speed, holding a few temporary arrays the size of the raw data.
+def buildDownsampleFromRaw(rawOffsets, rawValues, numIntervals):
+
+    # Grab data points length so we don't have to look it up every time.
+    numDataPoints = rawOffsets.shape[0]
+
+    # Calculate the timespan of the entire dataset
+    timespan = rawOffsets[numDataPoints-1] - rawOffsets[0]
+
+    # Calculate the interval size in seconds
+    timePerInterval = timespan / numIntervals
+
+    # This is the base offset, or the time offset of the first data point.
+    baseOffset = rawOffsets[0]
+
+    # Compute the left & right boundaries of the interval each data point would
+    # be placed in, were it to open a new interval. This is the same
+    # computation the scalar engine performs, in the same order of floating
+    # point operations, so that the boundaries come out bit-identical.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        leftboundaries = np.floor((rawOffsets - baseOffset) / timePerInterval) * timePerInterval + baseOffset
+    rightboundaries = leftboundaries + timePerInterval
+
+    # Apply the same floating point rounding heuristic as the scalar engine
+    # (see the while loop in cylib.buildDownsampleFromRaw) to the few data
+    # points which the floor computation placed one interval too early.
+    heuristic = np.flatnonzero(rawOffsets >= rightboundaries)
+    while heuristic.shape[0] > 0:
+        leftboundaries[heuristic] = rightboundaries[heuristic]
+        rightboundaries[heuristic] = leftboundaries[heuristic] + timePerInterval
+        heuristic = heuristic[rawOffsets[heuristic] >= rightboundaries[heuristic]]
+
+    # Find the indices of the data points which open each interval
+    starts = _intervalStartIndices(rawOffsets, rightboundaries)
+
+    # Do a sanity check. We don't expect to ever need more than numIntervals+1
+    # intervals (see the corresponding check in the scalar engine).
+    if starts.shape[0] > numIntervals + 1:
+        raise RuntimeError(f"Unexpectedly required more than numIntervals intervals during downsample building from raw. numIntervals: {numIntervals+1}, intervals: {starts.shape[0]}, numDataPoints: {numDataPoints}")
+    if starts.shape[0] > numIntervals:
+        logging.info(f"Exceeded numIntervals! origNumIntervals: {numIntervals}, intervals: {starts.shape[0]}, timePerInterval: {timePerInterval}, numDataPoints: {numDataPoints}")
+
+    # Assemble the intervals. The columns, in order, are: Time Offset, Min, Max.
+    intervals = np.empty((starts.shape[0], 3))
+    intervals[:,0] = leftboundaries[starts] + (timePerInterval / 2)
+    intervals[:,1] = np.minimum.reduceat(rawValues, starts)
+    intervals[:,2] = np.maximum.reduceat(rawValues, starts)
+
+    # Return the downsampled intervals
+    return intervals
+
+# Builds and returns all downsamples in a single sweep over the raw data (finest
+# first), with the same parameters & output as cylib.buildDownsamplesFromRaw.
+# The finest downsample is built with the vectorized buildDownsampleFromRaw, and
+# the coarser downsamples from it with cylib.buildDownsamplesUp. No builder is
+# involved, so if returnState is set, the state returned alongside the
+# downsamples is None (i.e. the downsamples may not be resumed).
+def buildDownsamplesFromRaw(rawOffsets, rawValues, numIntervals, timePerIntervalsUp, stepMultiplier, returnState=False):
+
+    intervals = buildDownsampleFromRaw(rawOffsets, rawValues, numIntervals)
+    downsamples = [intervals] + buildDownsamplesUp(intervals, timePerIntervalsUp, stepMultiplier)
+
+    if returnState:
+        return downsamples, None
+
+    return downsamples
+
+# Returns the indices of the data points which open a new interval, given the
+# raw offsets and the right boundary each data point would be assigned if it
+# were to open an interval. A data point opens a new interval if its offset
+# reaches the right boundary of the interval that the previous opening data
+# point established.
+def _intervalStartIndices(rawOffsets, rightboundaries):
+
+    numDataPoints = rawOffsets.shape[0]
+
+    # Our candidates are the data points whose right boundary differs from that
+    # of the previous data point. Every data point between two consecutive
+    # candidates shares the first candidate's right boundary (and lies before
+    # it), so the candidates are exactly the interval openings as long as each
+    # candidate reaches the right boundary of the candidate before it.
+    candidates = np.concatenate(([0], np.flatnonzero(rightboundaries[1:] != rightboundaries[:-1]) + 1))
+    invalid = np.flatnonzero(rawOffsets[candidates[1:]] < rightboundaries[candidates[:-1]])
+    if invalid.shape[0] == 0:
+        return candidates
+
+    # Having reached this point, floating point rounding placed a candidate
+    # before the right boundary of the interval preceding it. This is rare, so
+    # we walk the openings one by one only around such candidates.
+    starts = []
+    ci = 0
+    while True:
+
+        # Take all consecutive valid candidates up to the next invalid one
+        k = np.searchsorted(invalid, ci)
+        cj = invalid[k] if k < invalid.shape[0] else candidates.shape[0] - 1
+        starts.append(candidates[ci:cj+1])
+
+        # Walk to the next opening which is again a candidate
+        s = candidates[cj]
+        while True:
+            s = _nextStartIndex(rawOffsets, rightboundaries[s], s)
+            if s >= numDataPoints:
+                return np.concatenate(starts)
+            ci = np.searchsorted(candidates, s)
+            if ci < candidates.shape[0] and candidates[ci] == s:
+                break
+            starts.append([s])
+
+# Returns the index of the first data point after index s whose offset reaches
+# the right boundary provided, or the number of data points if there is none.
+def _nextStartIndex(rawOffsets, rightboundary, s):
+
+    numDataPoints = rawOffsets.shape[0]
+
+    # Search forward in growing windows, as the next opening is almost always
+    # close by.
+    lo = s + 1
+    width = 64
+    while lo < numDataPoints:
+        hi = min(numDataPoints, lo + width)
+        hits = np.flatnonzero(rawOffsets[lo:hi] >= rightboundary)
+        if hits.shape[0] > 0:
+            return lo + hits[0]
+        lo = hi
+        width = width * 2
+
+    return numDataPoints
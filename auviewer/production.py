@@ -0,0 +1,91 @@
+"""Production serving of the web application, with gunicorn or an ASGI server such as uvicorn."""
+
+import logging
+import os
+
+from .config import config, set_data_path
+
+# Environment variable holding the data path for the app factories, which WSGI
+# & ASGI servers call without arguments.
+DATA_PATH_ENV_VAR = 'AUVIEWER_DATA_PATH'
+
+# Environment variable holding the role of the app (see serve.createApp),
+# 'standalone' by default
+ROLE_ENV_VAR = 'AUVIEWER_ROLE'
+
+def createWSGIApp(datapath=None, role=None):
+    """
+    Factory for the WSGI app to be served by a production WSGI server, e.g.:
+
+        AUVIEWER_DATA_PATH=/path/to/data gunicorn -k gthread --threads 16 -b 0.0.0.0:8001 'auviewer.production:createWSGIApp()'
+
+    Each request is handled on its own thread of the worker, so that a slow HDF5 read only holds up the request
+    making it. A standalone app owns the downsampling scheduler, so only one worker should be run. To run many
+    workers, run the coordinator, which loads projects & downsamples files, and the workers in the worker role, which
+    attach to the catalog of projects it writes to the data directory (see catalog), e.g.:
+
+        python -m auviewer.serve /path/to/data --coordinator
+        AUVIEWER_DATA_PATH=/path/to/data AUVIEWER_ROLE=worker gunicorn -w 8 -k gthread --threads 16 -b 0.0.0.0:8001 'auviewer.production:createWSGIApp()'
+
+    :param datapath: path to the data directory, by default taken from the AUVIEWER_DATA_PATH environment variable
+    :param role: 'standalone' or 'worker', by default taken from the AUVIEWER_ROLE environment variable
+    :return: the Flask app
+    """
+
+    # Imported here, as serve imports the full web application
+    from .serve import createApp
+
+    datapath = datapath or os.environ.get(DATA_PATH_ENV_VAR)
+    if datapath is None:
+        raise Exception(f"A data path must be provided, or set in the {DATA_PATH_ENV_VAR} environment variable.")
+    set_data_path(datapath)
+
+    role = role or os.environ.get(ROLE_ENV_VAR, 'standalone')
+    if role not in ('standalone', 'worker'):
+        raise Exception(f"Unknown role '{role}', which must be 'standalone' or 'worker'.")
+
+    return createApp(interactive=False, role=role)
+
+def createASGIApp(datapath=None, app=None):
+    """
+    Factory for an ASGI app to be served by an ASGI server, e.g.:
+
+        AUVIEWER_DATA_PATH=/path/to/data uvicorn --factory --host 0.0.0.0 --port 8001 auviewer.production:createASGIApp
+
+    The ASGI app wraps the WSGI app (see createWSGIApp), running each request, and with it the HDF5 I/O of the data
+    endpoints, in an executor of requestThreads threads (see config), so that the event loop is never blocked by a
+    read. Requires a2wsgi or uvicorn.
+    :param datapath: path to the data directory, by default taken from the AUVIEWER_DATA_PATH environment variable
+    :param app: the Flask app to wrap, if already created
+    :return: the ASGI app
+    """
+
+    try:
+        from a2wsgi import WSGIMiddleware
+    except ImportError:
+        try:
+            from uvicorn.middleware.wsgi import WSGIMiddleware
+        except ImportError:
+            raise ImportError("Serving an ASGI app requires a2wsgi or uvicorn (pip install auviewer[production]).")
+
+    if app is None:
+        app = createWSGIApp(datapath)
+
+    return WSGIMiddleware(app, workers=max(config['requestThreads'], 1))
+
+def serveProduction(app):
+    """
+    Serves a created Flask app on the configured host & port with uvicorn if installed, as an ASGI app (see
+    createASGIApp), and otherwise with the threaded Werkzeug server without the debugger.
+    """
+
+    try:
+        import uvicorn
+    except ImportError:
+        uvicorn = None
+
+    if uvicorn is not None:
+        uvicorn.run(createASGIApp(app=app), host=config['host'], port=config['port'], log_level='info')
+    else:
+        logging.warning("uvicorn is not installed (pip install auviewer[production]), serving with the threaded Werkzeug server.")
+        app.run(host=config['host'], port=config['port'], debug=False, threaded=True, use_reloader=False)
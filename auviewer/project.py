@@ -6,11 +6,13 @@ import datetime as dt
 from io import BytesIO
 import logging
 import math
+import multiprocessing as mp
 import os
 import pandas as pd
 import pickle
 import traceback
 import random
+import threading
 from collections import Counter
 
 from pathlib import Path
@@ -21,7 +23,8 @@ from typing import AnyStr, List, Dict, Optional, Union
 from . import models
 from .patternset import PatternSet
 from .config import config
-from .file import File
+from .file import File, callFileMethod
+from .jsonstream import iterEncodeBatchPayload
 from .shared import annotationDataFrame, annotationOrPatternOutput, getProcFNFromOrigFN, patternDataFrame
 
 
@@ -39,8 +42,13 @@ def _file_identity(path):
 class Project:
     """Represents an auviewer project."""
 
-    def __init__(self, projectModel, processNewFiles=True):
-        """The project name should also be the directory name in the projects directory."""
+    def __init__(self, projectModel, processNewFiles=True, catalogFiles=None):
+        """
+        The project name should also be the directory name in the projects directory. If catalogFiles is provided
+        (see catalog.readCatalog), the project's files are taken from it, rather than loaded from the database &
+        discovered on the file system. If processNewFiles is False, the project's files are loaded from the database
+        only, leaving them to be verified & new files discovered later (see verifyFiles & discoverFiles).
+        """
         
         # Set id & name
         self.id = projectModel.id
@@ -70,8 +78,14 @@ class Project:
             with p.open() as f:
                 self.projectTemplate = f.read()
 
-        # Holds references to the files that belong to the project
-        self.files = []
+        # Holds the (ID, original file path, processed file path) of the files
+        # that belong to the project, in filename order, and their indices by
+        # file ID. File instances are only created when first accessed (see
+        # getFile), and held in loadedFiles, indexed by file ID.
+        self.fileRecords = []
+        self.fileRecordIndices = {}
+        self.loadedFiles = {}
+        self.filesLock = threading.Lock()
 
         # Holds references to the pattern sets that belong to the project,
         # indexed by pattern set ID.
@@ -81,7 +95,12 @@ class Project:
         self.loadPatternSets()
 
         # Load project files
-        self.loadProjectFiles(processNewFiles)
+        if catalogFiles is not None:
+            self.loadCatalogFiles(catalogFiles)
+        elif processNewFiles:
+            self.loadProjectFiles()
+        else:
+            self.loadFileRecords()
 
         print(f"Complete")
 
@@ -117,29 +136,239 @@ class Project:
             drop_values_below=None,
             drop_values_above=None,
             drop_values_between=None,
+            screen=False,
+            processes=None,
+            progress=None,
+            cancel=None,
         ):
         """
         Run pattern detection on all files, and return a DataFrame of results.
         This DataFrame, or a subset thereof, can be passed into PatternSet.addPatterns() if desired.
+
+        Files are processed concurrently in a pool of worker processes (see mapFiles for the processes, progress &
+        cancel parameters), and if cancelled, the results of the files completed by then are returned.
+
+        If screen is set, raw data is only read where patterns may start, as screened with the downsamples of each
+        series (see Series.generateThresholdAlerts), which gives the same results.
         """
-        patterns = [[f.id, f.name, series, pattern[0], pattern[1], None, None] for f in self.files for pattern in f.detectPatterns(
-            type, 
-            series, 
-            thresholdlow, 
-            thresholdhigh, 
-            duration, 
-            persistence, 
-            maxgap, 
-            expected_frequency=expected_frequency, 
-            min_density=min_density, 
-            drop_values_below=drop_values_below, 
-            drop_values_above=drop_values_above, 
-            drop_values_between=drop_values_between
-        )]
+
+        args = (type, series, thresholdlow, thresholdhigh, duration, persistence, maxgap)
+        kwargs = {
+            'expected_frequency': expected_frequency,
+            'min_density': min_density,
+            'drop_values_below': drop_values_below,
+            'drop_values_above': drop_values_above,
+            'drop_values_between': drop_values_between,
+            'screen': screen,
+        }
+
+        fileRecords = list(self.fileRecords)
+        patternsByFileID = self.mapFiles('detectPatterns', args, kwargs, processes=processes, progress=progress, cancel=cancel)
+
+        # Assemble the results in file order
+        fileNames = {id: origFilePathObj.name for id, origFilePathObj, _ in fileRecords}
+        patterns = [[id, fileNames[id], series, pattern[0], pattern[1], None, None] for id, _, _ in fileRecords if id in patternsByFileID for pattern in patternsByFileID[id]]
         pdf = pd.DataFrame(patterns, columns=['file_id', 'filename', 'series', 'left', 'right', 'top', 'bottom'])
         pdf['label'] = ''
         return pdf
 
+    def sweepPatterns(self, type, series, paramsets, processes=None, progress=None, cancel=None):
+        """
+        Run pattern detection on all files for each of many parameter sets, and return a DataFrame of results, as
+        detectPatterns would for each parameter set, with the ID of the parameter set in the param_set column. The raw
+        data of each series is read once for all parameter sets (see File.sweepPatterns), rather than once per
+        detectPatterns call. Files are processed as with detectPatterns, with the same processes, progress & cancel.
+        :param paramsets: list of parameter sets, whose IDs are their indices, or dict mapping parameter set ID to
+            parameter set, each a dict of the detectPatterns keyword arguments thresholdlow, thresholdhigh, duration,
+            persistence, maxgap and optionally expected_frequency, min_density, drop_values_below, drop_values_above &
+            drop_values_between
+        """
+
+        if isinstance(paramsets, list):
+            paramsets = dict(enumerate(paramsets))
+
+        fileRecords = list(self.fileRecords)
+        patternsByFileID = self.mapFiles('sweepPatterns', (type, series, paramsets), {}, processes=processes, progress=progress, cancel=cancel)
+
+        # Assemble the results by parameter set, in file order
+        fileNames = {id: origFilePathObj.name for id, origFilePathObj, _ in fileRecords}
+        patterns = [[psid, id, fileNames[id], series, pattern[0], pattern[1], None, None] for psid in paramsets for id, _, _ in fileRecords if id in patternsByFileID for pattern in patternsByFileID[id][psid]]
+        pdf = pd.DataFrame(patterns, columns=['param_set', 'file_id', 'filename', 'series', 'left', 'right', 'top', 'bottom'])
+        pdf['label'] = ''
+        return pdf
+
+    def mapFiles(self, method, args, kwargs, processes=None, progress=None, cancel=None):
+        """
+        Calls a method of each of the project's files with the arguments provided, and returns a dict mapping the ID of
+        each file to the method's return value, collected as files complete.
+
+        Files are processed concurrently in a pool of worker processes, each opening the files it is handed with its
+        own handles (see file.callFileMethod). The number of processes defaults to patternDetectionProcesses in config
+        (the number of CPUs if 0), and with one process, files are processed in this process instead. If provided,
+        progress is called as progress(done, total) with the number of files completed so far and in total. If cancel
+        is provided (e.g. a threading.Event), processing stops once it is set, and only the results of the files
+        completed by then are returned.
+        """
+
+        fileRecords = list(self.fileRecords)
+        if processes is None:
+            processes = config['patternDetectionProcesses']
+        if processes < 1:
+            processes = mp.cpu_count()
+        processes = min(processes, len(fileRecords))
+
+        # Return values, by file ID, as files complete
+        results = {}
+
+        def cancelled():
+            return cancel is not None and cancel.is_set()
+
+        if processes <= 1:
+            for id, _, _ in fileRecords:
+                if cancelled():
+                    break
+                results[id] = getattr(self.getFile(id), method)(*args, **kwargs)
+                if progress is not None:
+                    progress(len(results), len(fileRecords))
+        else:
+            with mp.Pool(processes=processes) as pool:
+                it = pool.imap_unordered(callFileMethod, [(id, str(origFilePathObj), str(procFilePathObj), method, args, kwargs) for id, origFilePathObj, procFilePathObj in fileRecords])
+                while len(results) < len(fileRecords) and not cancelled():
+
+                    # Wait for the next file in short intervals, so that a
+                    # cancellation is noticed while files are in progress.
+                    try:
+                        id, result = it.next(timeout=0.5)
+                    except mp.TimeoutError:
+                        continue
+
+                    results[id] = result
+                    if progress is not None:
+                        progress(len(results), len(fileRecords))
+
+        if cancelled():
+            logging.info(f"Processing of files with {method} cancelled after {len(results)} of {len(fileRecords)} files.")
+
+        return results
+
+    def discoverFiles(self) -> int:
+        """
+        Discovers new files in the project's originals folder which are not yet in the database, adding them to the
+        database & the project's files.
+        :return: number of new files
+        """
+
+        # Track both stored paths and physical file identities. Paths remain
+        # project-local, while identities allow old resolved-path rows and
+        # symlinks to be recognized without an O(files^2) samefile() scan.
+        existingFilePathStrings = {str(origFilePathObj) for _, origFilePathObj, _ in self.fileRecords}
+        existingFileIdentities = None
+        newFileRecords = []
+
+        # For each new project file which does not exist in the database...
+        for discoveredFilePathObj in self.originalsDirPathObj.iterdir():
+
+            # Keep the absolute project-local path as the database identity.
+            # resolve() must not be used here: it dereferences symlinks and
+            # makes links in different projects collide on one target path.
+            newOrigFilePathObj = _absolute_path(discoveredFilePathObj)
+
+            try:
+
+                # Check that the file exists (can happen in the case of a dead symlink)
+                if not newOrigFilePathObj.exists():
+                    continue
+
+                # Skip if not file or not .h5
+                if not newOrigFilePathObj.is_file() or newOrigFilePathObj.suffix != '.h5':
+                    continue
+
+                # Skip an already-loaded path or physical file. The latter
+                # recognizes legacy rows that stored a resolved symlink
+                # target and duplicate links within the same project. The
+                # identities of loaded files are only established if a path
+                # is not found among them.
+                if str(newOrigFilePathObj) in existingFilePathStrings:
+                    continue
+                if existingFileIdentities is None:
+                    existingFileIdentities = {_file_identity(origFilePathObj) for _, origFilePathObj, _ in self.fileRecords if origFilePathObj.exists()}
+                newFileIdentity = _file_identity(newOrigFilePathObj)
+                if newFileIdentity in existingFileIdentities:
+                    continue
+
+                # Establish the path of the new processed file
+                newProcFilePathObj = self.processedDirPathObj / getProcFNFromOrigFN(newOrigFilePathObj)
+
+                # Now that the processing has completed (if not, an exception
+                # would have been raised), add the file to the database and
+                # update the file class instance ID.
+                newFileDBEntry = models.File(project_id=self.id, path=str(newOrigFilePathObj))
+                models.db.session.add(newFileDBEntry)
+                models.db.session.commit()
+
+                # Keep discovery idempotent within this scan.
+                existingFilePathStrings.add(str(newOrigFilePathObj))
+                existingFileIdentities.add(newFileIdentity)
+
+                # Add the new file to the project's files
+                newFileRecords.append((newFileDBEntry.id, newOrigFilePathObj, newProcFilePathObj))
+
+            # Handle Ctrl-C
+            except KeyboardInterrupt:
+                models.db.session.rollback()
+                raise
+
+            # Roll back failed transactions, but make this unexpected
+            # condition extremely visible and retain the full stack trace.
+            except Exception:
+                errorTraceback = traceback.format_exc()
+                models.db.session.rollback()
+
+                try:
+                    conflictingRows = models.File.query.filter_by(
+                        path=str(newOrigFilePathObj)
+                    ).all()
+                    conflictingRowsDescription = [
+                        {
+                            'file_id': row.id,
+                            'project_id': row.project_id,
+                            'path': row.path,
+                        }
+                        for row in conflictingRows
+                    ]
+                except Exception:
+                    conflictingRowsDescription = (
+                        "Unable to query conflicting rows:\n"
+                        f"{traceback.format_exc()}"
+                    )
+
+                logging.critical(
+                    "\n%s\n"
+                    "UNEXPECTED ERROR WHILE REGISTERING A PROJECT FILE\n"
+                    "project_id=%s project_name=%r\n"
+                    "project-local path=%s\n"
+                    "resolved target=%s\n"
+                    "database rows with the project-local path=%r\n"
+                    "The database transaction was rolled back. The file was "
+                    "not loaded during this scan.\n\n"
+                    "Stack trace:\n%s"
+                    "%s",
+                    "!" * 80,
+                    self.id,
+                    self.name,
+                    newOrigFilePathObj,
+                    newOrigFilePathObj.resolve(),
+                    conflictingRowsDescription,
+                    errorTraceback,
+                    "!" * 80,
+                )
+    
+
+        if len(newFileRecords) > 0:
+            self.setFileRecords(self.fileRecords + newFileRecords)
+
+        return len(newFileRecords)
+
     def getAnnotations(
             self,
             annotation_id: Union[int, List[int], None] = None,
@@ -190,20 +419,75 @@ class Project:
         """Returns a list of user's annotations for all files in the project"""
         return [[a.id, a.file_id, Path(a.file.path).name, a.series, a.left, a.right, a.top, a.bottom, a.label, a.pattern_id] for a in models.Annotation.query.filter_by(user_id=user_id, project_id=self.id).all()]
 
+    def getBatchSeriesRangedOutput(self, requests, executor=None, columnar=False):
+        """
+        Produces ranged output for series of many files in the project at once.
+        :param requests: list of dicts, each with the keys file_id, series (list of series IDs), start & stop
+        :param executor: optional concurrent.futures executor on which to assemble the outputs of the files
+            concurrently (otherwise they are assembled one after another)
+        :param columnar: whether to provide the data of each series as a list of columns (see Series.getRangedOutput)
+        :return: list of dicts in request order, each with the file_id and either the series output under series (see
+            File.getSeriesRangedOutput) or an error message under error
+        """
+        return list(self.iterBatchSeriesRangedOutput(requests, executor, columnar))
+
+    def iterBatchSeriesRangedOutput(self, requests, executor=None, columnar=False):
+        """
+        Yields the outputs of getBatchSeriesRangedOutput one at a time, in request order. Without an executor, each file
+        is only assembled when its output is consumed.
+        """
+
+        def getOutput(r):
+            f = self.getFile(r.get('file_id'))
+            if f is None:
+                return {'file_id': r.get('file_id'), 'error': 'File not found.'}
+            try:
+                return {'file_id': f.id, **f.getSeriesRangedOutput(r['series'], float(r['start']), float(r['stop']), columnar)}
+            except Exception as e:
+                logging.error(f"Unable to assemble ranged output for file {f.origFilePathObj}.\n{e}\n{traceback.format_exc()}")
+                return {'file_id': f.id, 'error': str(e)}
+
+        if executor is None:
+            return (getOutput(r) for r in requests)
+
+        return executor.map(getOutput, requests)
+
+    def iterBatchSeriesRangedOutputJSON(self, requests, executor=None):
+        """
+        Yields the JSON encoding of {'files': <output of getBatchSeriesRangedOutput>} in pieces, encoding the files one
+        at a time, so that the full output is never held in memory as a string (see jsonstream.iterEncodeBatchPayload).
+        """
+        return iterEncodeBatchPayload(self.iterBatchSeriesRangedOutput(requests, executor, columnar=True))
+
+    @property
+    def files(self) -> List[File]:
+        """The project's files, in filename order. This instantiates every file not yet accessed."""
+        return [self.getFile(id) for id, _, _ in self.fileRecords]
+
     def getFile(self, id):
-        """Returns the file with matching ID or None."""
-        for f in self.files:
-            if f.id == id:
-                return f
-        return None
+        """Returns the file with matching ID or None, instantiating it if first accessed."""
+        i = self.fileRecordIndices.get(id)
+        if i is None:
+            return None
+        with self.filesLock:
+            f = self.loadedFiles.get(id)
+            if f is None:
+                _, origFilePathObj, procFilePathObj = self.fileRecords[i]
+                f = self.loadedFiles[id] = File(self, id, origFilePathObj, procFilePathObj)
+        return f
 
     def getFileByName(self, name):
         """Returns the file with matching ID or None."""
-        for f in self.files:
-            if f.name == name:
-                return f
+        for id, origFilePathObj, _ in self.fileRecords:
+            if origFilePathObj.name == name:
+                return self.getFile(id)
         return None
 
+    def getLoadedFiles(self) -> List[File]:
+        """Returns the files which have been accessed (see getFile)."""
+        with self.filesLock:
+            return list(self.loadedFiles.values())
+
     def makeFilesPayload(self, files):
         # for f in files:
         #     f.initfile()
@@ -247,7 +531,7 @@ class Project:
                     annotationOrPatternOutput(p, p.annotations[0] if len(p.annotations) > 0 else None) for p in models.db.session.query(models.Pattern).filter_by(pattern_set_id=ps.id).outerjoin(models.Annotation, and_(models.Annotation.pattern_id == models.Pattern.id, models.Annotation.user_id == user_id)).options(contains_eager(models.Pattern.annotations)).all()
                 ]
             } for ps in models.PatternSet.query.filter(models.PatternSet.users.any(id=user_id), models.PatternSet.project_id==self.id).all()],
-            'project_files': [[f.id, f.origFilePathObj.name] for f in self.files],
+            'project_files': [[id, origFilePathObj.name] for id, origFilePathObj, _ in self.fileRecords],
 
             # Template data
             'builtin_default_interface_templates': config['builtinDefaultInterfaceTemplates'],
@@ -325,7 +609,7 @@ class Project:
         Returns list of files for the project (ID, filename, file path, downsample path).
         :return: list of lists
         """
-        return [[f.id, f.name, str(f.origFilePathObj), str(f.procFilePathObj)] for f in self.files]
+        return [[id, origFilePathObj.name, str(origFilePathObj), str(procFilePathObj)] for id, origFilePathObj, procFilePathObj in self.fileRecords]
 
     def listPatternSets(self) -> List[List[str]]:
         """
@@ -334,6 +618,20 @@ class Project:
         """
         return [[ps.id, ps.name] for ps in self.patternsets.values()]
 
+    def loadCatalogFiles(self, catalogFiles) -> None:
+        """
+        Load or reload the project's files from the catalog (see catalog.readCatalog), without checking the file
+        system. Files already loaded are kept, along with their open files & loaded data.
+        """
+        self.setFileRecords(catalogFiles)
+
+    def loadFileRecords(self) -> None:
+        """Load or reload the project's files from the database, without checking the file system."""
+        self.setFileRecords([
+            (id, _absolute_path(path), self.processedDirPathObj / getProcFNFromOrigFN(path))
+            for id, path in models.db.session.query(models.File.id, models.File.path).filter_by(project_id=self.id).all()
+        ])
+
     def loadPatternSets(self) -> None:
         """Load or reload the project's pattern sets."""
 
@@ -347,144 +645,56 @@ class Project:
     def loadProjectFiles(self, processNewFiles=True):
         """Load or reload files belonging to the project, and process new files if desired."""
 
-        # Reset files list
-        self.files = []
-
-        # Track both stored paths and physical file identities. Paths remain
-        # project-local, while identities allow old resolved-path rows and
-        # symlinks to be recognized without an O(files^2) samefile() scan.
-        existingFilePathStrings = set()
-        existingFileIdentities = set()
-
-        # Get all of the project's files listed in the database
-        fileDBModels = models.File.query.filter_by(project_id=self.id).all()
-
-        # For each project file in the database...
-        for fileDBModel in fileDBModels:
-
-            # Verify the original file exists on the file system
-            origFilePathObj = _absolute_path(fileDBModel.path)
-            if origFilePathObj.exists():
-                existingFilePathStrings.add(str(origFilePathObj))
-                existingFileIdentities.add(_file_identity(origFilePathObj))
-            else:
-                logging.error(f"File ID {fileDBModel.id} in the database is missing the original file on the file system at {fileDBModel.path}")
-                continue
-                # TODO(gus): Do something else with this? Like set error state in the database entry and display in GUI?
-
-            # Verify the processed file exists on the file system
-            procFilePathObj = self.processedDirPathObj / getProcFNFromOrigFN(origFilePathObj)
-            if not procFilePathObj.exists():
-                logging.error(f"File ID {fileDBModel.id} in the database is missing the processed file on the file system at {procFilePathObj}")
-                #continue
-                # TODO(gus): Do something else with this? Like set error state in the database entry and display in GUI?
-
-            # Instantiate the file class, and attach to this project instance
-            self.files.append(File(self, fileDBModel.id, origFilePathObj, procFilePathObj))
+        self.loadFileRecords()
+        self.verifyFiles()
 
         # If processNewFiles is true, then go through and process new files
         if processNewFiles:
-                
-            # For each new project file which does not exist in the database...
-            for discoveredFilePathObj in self.originalsDirPathObj.iterdir():
-
-                # Keep the absolute project-local path as the database identity.
-                # resolve() must not be used here: it dereferences symlinks and
-                # makes links in different projects collide on one target path.
-                newOrigFilePathObj = _absolute_path(discoveredFilePathObj)
-
-                try:
+            self.discoverFiles()
 
-                    # Check that the file exists (can happen in the case of a dead symlink)
-                    if not newOrigFilePathObj.exists():
-                        continue
+    def setFileRecords(self, fileRecords) -> None:
+        """
+        Sets the project's files, as a list of (ID, original file path, processed file path) tuples. Files already
+        accessed are kept, along with their open files & loaded data, unless their paths have changed.
+        """
 
-                    # Skip if not file or not .h5
-                    if not newOrigFilePathObj.is_file() or newOrigFilePathObj.suffix != '.h5':
-                        continue
+        fileRecords = sorted(fileRecords, key=lambda r: r[1].name)
 
-                    # Skip an already-loaded path or physical file. The latter
-                    # recognizes legacy rows that stored a resolved symlink
-                    # target and duplicate links within the same project.
-                    newFileIdentity = _file_identity(newOrigFilePathObj)
-                    if (
-                        str(newOrigFilePathObj) in existingFilePathStrings
-                        or newFileIdentity in existingFileIdentities
-                    ):
-                        continue
+        with self.filesLock:
+            self.loadedFiles = {r[0]: self.loadedFiles[r[0]] for r in fileRecords if r[0] in self.loadedFiles and (self.loadedFiles[r[0]].origFilePathObj, self.loadedFiles[r[0]].procFilePathObj) == (r[1], r[2])}
+            self.fileRecords = fileRecords
+            self.fileRecordIndices = {r[0]: i for i, r in enumerate(fileRecords)}
 
-                    # Establish the path of the new processed file
-                    newProcFilePathObj = self.processedDirPathObj / getProcFNFromOrigFN(newOrigFilePathObj)
+    def setName(self, name):
+        """Rename the project."""
+        self.model.name = name
+        models.db.session.commit()
+        self.name = name
 
-                    # Now that the processing has completed (if not, an exception
-                    # would have been raised), add the file to the database and
-                    # update the file class instance ID.
-                    newFileDBEntry = models.File(project_id=self.id, path=str(newOrigFilePathObj))
-                    models.db.session.add(newFileDBEntry)
-                    models.db.session.commit()
+    def verifyFiles(self) -> int:
+        """
+        Verifies the project's files on the file system, removing those whose original file is missing. Files whose
+        processed file is missing are kept, to be downsampled.
+        :return: number of files removed
+        """
 
-                    # Keep discovery idempotent within this scan.
-                    existingFilePathStrings.add(str(newOrigFilePathObj))
-                    existingFileIdentities.add(newFileIdentity)
+        missing = set()
 
-                    # Add a File class instance for this new file to the files list for this project
-                    self.files.append(File(self, newFileDBEntry.id, newOrigFilePathObj, newProcFilePathObj))
+        for id, origFilePathObj, procFilePathObj in self.fileRecords:
 
-                # Handle Ctrl-C
-                except KeyboardInterrupt:
-                    models.db.session.rollback()
-                    raise
+            # Verify the original file exists on the file system
+            if not origFilePathObj.exists():
+                logging.error(f"File ID {id} in the database is missing the original file on the file system at {origFilePathObj}")
+                missing.add(id)
+                continue
+                # TODO(gus): Do something else with this? Like set error state in the database entry and display in GUI?
 
-                # Roll back failed transactions, but make this unexpected
-                # condition extremely visible and retain the full stack trace.
-                except Exception:
-                    errorTraceback = traceback.format_exc()
-                    models.db.session.rollback()
+            # Verify the processed file exists on the file system
+            if not procFilePathObj.exists():
+                logging.error(f"File ID {id} in the database is missing the processed file on the file system at {procFilePathObj}")
+                # TODO(gus): Do something else with this? Like set error state in the database entry and display in GUI?
 
-                    try:
-                        conflictingRows = models.File.query.filter_by(
-                            path=str(newOrigFilePathObj)
-                        ).all()
-                        conflictingRowsDescription = [
-                            {
-                                'file_id': row.id,
-                                'project_id': row.project_id,
-                                'path': row.path,
-                            }
-                            for row in conflictingRows
-                        ]
-                    except Exception:
-                        conflictingRowsDescription = (
-                            "Unable to query conflicting rows:\n"
-                            f"{traceback.format_exc()}"
-                        )
-
-                    logging.critical(
-                        "\n%s\n"
-                        "UNEXPECTED ERROR WHILE REGISTERING A PROJECT FILE\n"
-                        "project_id=%s project_name=%r\n"
-                        "project-local path=%s\n"
-                        "resolved target=%s\n"
-                        "database rows with the project-local path=%r\n"
-                        "The database transaction was rolled back. The file was "
-                        "not loaded during this scan.\n\n"
-                        "Stack trace:\n%s"
-                        "%s",
-                        "!" * 80,
-                        self.id,
-                        self.name,
-                        newOrigFilePathObj,
-                        newOrigFilePathObj.resolve(),
-                        conflictingRowsDescription,
-                        errorTraceback,
-                        "!" * 80,
-                    )
-        
-        # Sort files by filename
-        self.files.sort(key=lambda f: f.origFilePathObj.name)
+        if len(missing) > 0:
+            self.setFileRecords([r for r in self.fileRecords if r[0] not in missing])
 
-    def setName(self, name):
-        """Rename the project."""
-        self.model.name = name
-        models.db.session.commit()
-        self.name = name
+        return len(missing)
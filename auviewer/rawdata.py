@@ -1,23 +1,52 @@
+import hashlib
+import logging
 import numpy as np
 import datetime as dt
+import os
+import time
 
-from .cylib import getSliceParam
+from .cylib import getSliceParamIndexed
+
+# Number of rows between the entries of the time index of raw data which is not
+# stored in chunks (for chunked raw data, the entries are a chunk apart).
+defaultTimeIndexStride = 4096
+
+# Number of rows of raw data to copy from the original file at a time when
+# storing the raw columns (see RawData.storeColumns)
+columnStoreBlockRows = 1 << 20
 
 # Represents raw data for a single time series
 class RawData:
 
     # RawData may operate in file-mode or data-mode. If seriesparent.h5path`
-    def __init__(self, seriesparent):
+    # If a catalog entry of the series is provided (see Series.getCatalogEntry),
+    # the number of data points, time index stride & timespan are taken from it
+    # rather than the dataset.
+    def __init__(self, seriesparent, catalogEntry=None):
 
         # Set the series parent
         self.seriesparent = seriesparent
 
+        # The time index & raw columns are loaded when first accessed (see
+        # timeIndex & columns)
+        self._timeIndex = None
+        self._columns = None
+
+        if catalogEntry is not None:
+            self.len = catalogEntry['rows']
+            self.timeIndexStride = catalogEntry['timeIndexStride']
+            self.timespan = catalogEntry['timespan']
+            return
+
         # Grab a reference to the dataset
         dataset = self.getDatasetReference()
 
         # Holds the number of data points in the raw data series
         self.len = dataset.nrow
 
+        # Holds the number of rows between the entries of the time index
+        self.timeIndexStride = dataset.hdf.chunks[0] if dataset.hdf.chunks is not None else defaultTimeIndexStride
+
         # Holds the timespan of the time series
         if self.len < 2:
             self.timespan = 0
@@ -28,37 +57,216 @@ class RawData:
             self.timespan = self.timespan.values.astype(np.float64)
             self.timespan = np.abs(np.diff(self.timespan)[0])
 
-    # Returns a slice of the appropriate downsample for the given time range, or
-    # nothing if there is no appropriate downsample available (in this case, raw
-    # data should be used). Expects starttime & stoptime to be time offsets
-    # floats in seconds.
-    def getRangedOutput(self, starttime, stoptime):
+    # Returns the raw data points for the given time range as a list of rows,
+    # each [time, None, None, value]. If columnar is set, the data points are
+    # instead returned as a list of the same columns, i.e. [times, None, None,
+    # values], with times & values as NumPy arrays. Expects starttime &
+    # stoptime to be time offsets floats in seconds.
+    # If the raw columns are stored (see columns), they are sliced in place
+    # instead of reading from the original file.
+    def getRangedOutput(self, starttime, stoptime, columnar=False):
 
-        # Grab a reference to the dataset
-        ds = self.getDatasetReference()
+        if self.columns is not None:
 
-        # Find the start & stop indices based on the start & stop times.
-        # startIndex = np.searchsorted(self.rawTimeOffsets, starttime)
-        # stopIndex = np.searchsorted(self.rawTimeOffsets, stoptime, side='right')
-        startIndex = getSliceParam(ds, self.seriesparent.timecol, 0, starttime)
-        stopIndex = getSliceParam(ds, self.seriesparent.timecol, 1, stoptime)
+            # Find the start & stop indices in the memory-mapped time column,
+            # and take the times & values between them without copying
+            times, values = self.columns
+            startIndex = np.searchsorted(times, starttime, side='left')
+            stopIndex = np.searchsorted(times, stoptime, side='right')
+            rawTimes = times[startIndex:stopIndex]
+            rawValues = values[startIndex:stopIndex]
 
-        # Slice the output data the output data
-        ds_slice = ds[startIndex:stopIndex]
+        else:
+
+            # Grab a reference to the dataset
+            ds = self.getDatasetReference()
+
+            # Find the start & stop indices based on the start & stop times.
+            # startIndex = np.searchsorted(self.rawTimeOffsets, starttime)
+            # stopIndex = np.searchsorted(self.rawTimeOffsets, stoptime, side='right')
+            startIndex = getSliceParamIndexed(ds, self.seriesparent.timecol, 0, starttime, self.timeIndex, self.timeIndexStride)
+            stopIndex = getSliceParamIndexed(ds, self.seriesparent.timecol, 1, stoptime, self.timeIndex, self.timeIndexStride)
+
+            # Slice the output data the output data
+            ds_slice = ds[startIndex:stopIndex]
 
-        # Pull the raw times & values
-        rawTimes = ds_slice[self.seriesparent.timecol].values.astype(np.float64)
-        rawValues = ds_slice[self.seriesparent.valcol].values.astype(np.float64)
+            # Pull the raw times & values
+            rawTimes = ds_slice[self.seriesparent.timecol].values.astype(np.float64)
+            rawValues = ds_slice[self.seriesparent.valcol].values.astype(np.float64)
 
         # Drop nan values
         mask = ~np.isnan(rawValues)
         rawTimes = rawTimes[mask]
         rawValues = rawValues[mask]
 
+        if columnar:
+            return [rawTimes, None, None, rawValues]
+
         nones = [None] * len(rawTimes)
 
         return [list(i) for i in zip(rawTimes, nones, nones, rawValues)]
 
+    # Returns the start & stop row indices (as arrays) of the blocks of rows
+    # between the entries of the time index (see timeIndex) which hold the raw
+    # data points for each of the time ranges provided by the arrays of start &
+    # stop times, so that the rows of a range may be read without searching
+    # the raw data (see getRows).
+    def getRowRanges(self, starttimes, stoptimes):
+
+        startBlocks = np.maximum(np.searchsorted(self.timeIndex, starttimes, side='left') - 1, 0)
+        stopBlocks = np.searchsorted(self.timeIndex, stoptimes, side='right')
+
+        return startBlocks * self.timeIndexStride, np.minimum(stopBlocks * self.timeIndexStride, self.len)
+
+    # Returns the times & values of raw data rows startIndex through
+    # stopIndex-1 as float64 arrays, with nan values dropped. The rows are
+    # sliced from the raw columns if stored (see columns), and otherwise read
+    # from the original file.
+    def getRows(self, startIndex, stopIndex):
+
+        if self.columns is not None:
+            times, values = self.columns
+            rawTimes = np.array(times[startIndex:stopIndex])
+            rawValues = np.array(values[startIndex:stopIndex])
+        else:
+            rows = self.getDatasetReference().hdf.fields([self.seriesparent.timecol, self.seriesparent.valcol])[startIndex:stopIndex]
+            rawTimes = rows[self.seriesparent.timecol].astype(np.float64)
+            rawValues = rows[self.seriesparent.valcol].astype(np.float64)
+
+        # Drop nan values
+        mask = ~np.isnan(rawValues)
+
+        return rawTimes[mask], rawValues[mask]
+
+    # The sparse time index of the raw data, holding the time offset of every
+    # timeIndexStride-th row, with which getRangedOutput finds the rows of a
+    # time range reading only one block of rows on either side. The index is
+    # read from the processed file if stored there (see storeTimeIndex), and
+    # otherwise built from the raw data the first time it's accessed.
+    @property
+    def timeIndex(self):
+        if self._timeIndex is None:
+
+            self._timeIndex = self.getStoredTimeIndex()
+
+            if self._timeIndex is None:
+                logging.info(f"Building time index for {self.seriesparent.id}.")
+                start = time.time()
+                self._timeIndex = self.buildTimeIndex()
+                end = time.time()
+                logging.info(f"Done building time index ({self._timeIndex.shape[0]} entries). Took {round(end - start, 5)}s.")
+
+        return self._timeIndex
+
+    # Reads and returns the time index entries (see timeIndex) from the given
+    # index entry onwards, as a float64 array.
+    def buildTimeIndex(self, start=0):
+
+        ds = self.getDatasetReference()
+
+        return ds.hdf.fields(self.seriesparent.timecol)[start * self.timeIndexStride::self.timeIndexStride].astype(np.float64)
+
+    # Returns the time index stored in the processed file, or None if there is
+    # none or it does not cover the raw data (e.g. if the raw data has grown
+    # since it was stored).
+    def getStoredTimeIndex(self):
+
+        try:
+            ds = self.seriesparent.fileparent.pf['/'.join(self.seriesparent.h5pathDownsample) + '/timeindex']
+        except:
+            # We assume the processed file does not exist
+            return None
+
+        if ds is None:
+            return None
+
+        timeIndex = ds.hdf.fields('0')[:]
+
+        # We expect an entry for every timeIndexStride-th row
+        if timeIndex.shape[0] != -(-self.len // self.timeIndexStride):
+            return None
+
+        return timeIndex
+
+    # Stores the time index in the processed file, alongside the downsamples of
+    # the series. If the time index provided is None, it is built, extending the
+    # one already stored if possible.
+    def storeTimeIndex(self, timeIndex=None):
+
+        path = '/'.join(self.seriesparent.h5pathDownsample) + '/timeindex'
+        ds = self.seriesparent.fileparent.pf[path]
+
+        if timeIndex is None:
+            if ds is not None:
+                timeIndex = ds.hdf.fields('0')[:]
+                timeIndex = np.concatenate((timeIndex, self.buildTimeIndex(timeIndex.shape[0])))
+            else:
+                timeIndex = self.buildTimeIndex()
+
+        if ds is not None:
+            del self.seriesparent.fileparent.pf.hdf[path]
+        self.seriesparent.fileparent.pf[path] = timeIndex[:, np.newaxis]
+
+        self._timeIndex = None
+
+    # The raw time & value columns of the series as a tuple of float64 arrays
+    # memory-mapped from the .npy files stored next to the processed file (see
+    # storeColumns), or None if they are not stored or do not match the raw
+    # data (e.g. if the original file has been modified since).
+    @property
+    def columns(self):
+        if self._columns is None:
+
+            self._columns = False
+
+            timesPathObj, valuesPathObj = self.getColumnPaths()
+            try:
+                if timesPathObj.stat().st_mtime_ns >= self.seriesparent.fileparent.origFilePathObj.stat().st_mtime_ns:
+                    times = np.asarray(np.load(timesPathObj, mmap_mode='r'))
+                    values = np.asarray(np.load(valuesPathObj, mmap_mode='r'))
+                    if times.shape == values.shape == (self.len,):
+                        self._columns = (times, values)
+            except (OSError, ValueError):
+                # We assume the raw columns are not stored
+                pass
+
+        return self._columns or None
+
+    # Returns the paths of the .npy files of the raw time & value columns (see
+    # storeColumns), in the raw column folder of the file.
+    def getColumnPaths(self):
+
+        name = hashlib.sha1(self.seriesparent.id.encode('utf-8')).hexdigest()
+        folder = self.seriesparent.fileparent.rawColumnsDirPathObj
+
+        return folder / f'{name}.times.npy', folder / f'{name}.values.npy'
+
+    # Stores the raw time & value columns of the series (all len rows, as
+    # float64, including nan values) as contiguous .npy files next to the
+    # processed file, from which getRangedOutput slices raw data by memory
+    # mapping them (see columns). The columns are copied from the original file
+    # in blocks of columnStoreBlockRows rows.
+    def storeColumns(self):
+
+        ds = self.getDatasetReference()
+
+        self.seriesparent.fileparent.rawColumnsDirPathObj.mkdir(exist_ok=True)
+
+        for pathObj, col in zip(self.getColumnPaths(), (self.seriesparent.timecol, self.seriesparent.valcol)):
+
+            # Write & move into place, so that readers never map a partially
+            # written column
+            tmpPathObj = pathObj.with_name(f'{pathObj.name}.{os.getpid()}.tmp')
+            mm = np.lib.format.open_memmap(tmpPathObj, mode='w+', dtype=np.float64, shape=(self.len,))
+            for start in range(0, self.len, columnStoreBlockRows):
+                stop = min(start + columnStoreBlockRows, self.len)
+                mm[start:stop] = ds.hdf.fields(col)[start:stop]
+            mm.flush()
+            del mm
+            os.replace(tmpPathObj, pathObj)
+
+        self._columns = None
+
     def getDatasetReference(self):
         
         return self.seriesparent.fileparent.f['/'.join(self.seriesparent.h5path)]
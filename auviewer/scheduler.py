@@ -0,0 +1,312 @@
+"""Priority-aware scheduling of file downsampling in a pool of worker processes."""
+
+import heapq
+import itertools
+import logging
+import multiprocessing as mp
+import threading
+import time
+from pathlib import Path
+
+# Priorities of scheduled files, lower being sooner. Files are queued with
+# normal priority in the order they are scheduled, and a file is bumped to
+# urgent priority when a user requests it (the most recently bumped first).
+PRIORITY_URGENT = 0
+PRIORITY_NORMAL = 1
+
+# Holds the queue on which a worker process reports progress (set by the pool
+# initializer in each worker process).
+progressQueue = None
+
+def initializeWorker(queue):
+    """Pool initializer which holds on to the progress queue in the worker process."""
+    global progressQueue
+    progressQueue = queue
+
+def runJob(target, key, filepath, destinationpath):
+    """Runs the downsample target for a scheduled file in a worker process, reporting progress by series."""
+    target(filepath, destinationpath, progress=lambda done, total: progressQueue.put((key, done, total)))
+
+class ScheduledFile:
+    """Holds the scheduling state of an original file to be downsampled."""
+
+    def __init__(self, key, filepath, destinationpath, priority, seq):
+
+        # The resolved original file path, by which the file is known
+        self.key = key
+
+        self.filepath = filepath
+        self.destinationpath = destinationpath
+
+        # Queue ordering, by priority and then sequence number
+        self.priority = priority
+        self.seq = seq
+
+        # One of 'queued', 'running', 'done' or 'failed'
+        self.state = 'queued'
+
+        # Size of the original file in bytes, as a measure of the work involved,
+        # and its modification time, by which a failed file is only retried
+        # once modified (see DownsampleScheduler.schedule)
+        try:
+            stat = Path(filepath).stat()
+            self.size, self.mtime = stat.st_size, stat.st_mtime_ns
+        except OSError:
+            self.size, self.mtime = 0, None
+
+        # Number of series downsampled and in total, as reported by the worker
+        self.seriesDone = 0
+        self.seriesTotal = None
+
+        # Times at which downsampling started & finished
+        self.startTime = None
+        self.endTime = None
+
+        # Holds the error message if downsampling failed
+        self.error = None
+
+    @property
+    def progress(self):
+        """Fraction of the file downsampled (by series), or None if not yet known."""
+        if self.state == 'done':
+            return 1.
+        if self.seriesTotal is None or self.seriesTotal < 1:
+            return 0. if self.state == 'queued' else None
+        return self.seriesDone / self.seriesTotal
+
+class DownsampleScheduler:
+    """
+    Schedules original files for downsampling in a pool of worker processes. At most one file per worker process is
+    handed to the pool at any time, and the rest wait in a priority queue, so that a file requested by a user may be
+    moved to the front of the queue with prioritize(). Workers report progress by series, from which the status
+    (queue depth, per-file progress & ETA) is available with getStatus().
+    """
+
+    def __init__(self, target, processes):
+
+        # The function which downsamples a file, called in the worker process as
+        # target(filepath, destinationpath, progress=callback).
+        self.target = target
+
+        self.processes = processes
+
+        # Guards all scheduling state below
+        self.lock = threading.Lock()
+
+        # Scheduled files indexed by resolved original file path, and the heap
+        # of (priority, seq, key) entries of queued files. A file's heap entry
+        # is stale once its priority or state changes, and is skipped when
+        # popped.
+        self.files = {}
+        self.queue = []
+
+        # Sequence numbers, increasing for normal priority (first come, first
+        # served) and decreasing for urgent priority (last requested first).
+        self.normalSeq = itertools.count()
+        self.urgentSeq = itertools.count(-1, -1)
+
+        # Number of files handed to the pool and not yet finished
+        self.numRunning = 0
+
+        # Set up the pool and a thread to collect progress from its workers
+        self.progressQueue = mp.Queue()
+        self.pool = mp.Pool(processes=processes, initializer=initializeWorker, initargs=(self.progressQueue,))
+        self.progressThread = threading.Thread(target=self.collectProgress, daemon=True)
+        self.progressThread.start()
+
+    def schedule(self, filepath, destinationpath):
+        """
+        Schedules an original file to be downsampled into the destination folder, unless it already is, or it failed
+        to downsample and has not been modified since.
+        """
+
+        key = str(Path(filepath).resolve())
+
+        with self.lock:
+
+            if key in self.files and self.files[key].state in ('queued', 'running'):
+                return
+
+            sf = ScheduledFile(key, filepath, destinationpath, PRIORITY_NORMAL, next(self.normalSeq))
+
+            previous = self.files.get(key)
+            if previous is not None and previous.state == 'failed' and previous.mtime is not None and previous.mtime == sf.mtime:
+                logging.debug(f"Not rescheduling {key}, which failed to downsample and has not been modified since.")
+                return
+
+            self.files[key] = sf
+            heapq.heappush(self.queue, (sf.priority, sf.seq, key))
+
+            self.dispatch()
+
+    def prioritize(self, filepath):
+        """Moves a queued file to the front of the queue. Returns whether the file was queued."""
+
+        key = str(Path(filepath).resolve())
+
+        with self.lock:
+
+            sf = self.files.get(key)
+            if sf is None or sf.state != 'queued':
+                return False
+
+            logging.info(f"Prioritizing downsampling of {key}.")
+
+            sf.priority = PRIORITY_URGENT
+            sf.seq = next(self.urgentSeq)
+            heapq.heappush(self.queue, (sf.priority, sf.seq, key))
+
+            return True
+
+    def dispatch(self):
+        """Hands queued files to the pool while there are idle workers. Must be called holding the lock."""
+
+        while self.numRunning < self.processes and len(self.queue) > 0:
+
+            priority, seq, key = heapq.heappop(self.queue)
+
+            # Skip stale entries
+            sf = self.files[key]
+            if sf.state != 'queued' or (sf.priority, sf.seq) != (priority, seq):
+                continue
+
+            logging.info(f"Dispatching downsampling of {key}.")
+
+            sf.state = 'running'
+            sf.startTime = time.time()
+            self.numRunning = self.numRunning + 1
+
+            self.pool.apply_async(
+                runJob,
+                (self.target, key, sf.filepath, sf.destinationpath),
+                callback=lambda _, key=key: self.finish(key, None),
+                error_callback=lambda e, key=key: self.finish(key, e),
+            )
+
+    def finish(self, key, error):
+        """Records the completion of a file (called from the pool's result handler thread) and dispatches the next."""
+
+        with self.lock:
+
+            sf = self.files[key]
+            sf.endTime = time.time()
+            self.numRunning = self.numRunning - 1
+
+            if error is None:
+                sf.state = 'done'
+                logging.info(f"Finished downsampling {key}. Took {round(sf.endTime - sf.startTime, 3)}s.")
+            else:
+                sf.state = 'failed'
+                sf.error = str(error)
+                logging.error(f"Downsampling {key} failed.\n{error}")
+
+            self.dispatch()
+
+    def collectProgress(self):
+        """Collects progress reports from the worker processes (run in a background thread)."""
+
+        while True:
+
+            msg = self.progressQueue.get()
+            if msg is None:
+                return
+
+            key, done, total = msg
+            with self.lock:
+                sf = self.files.get(key)
+                if sf is not None:
+                    sf.seriesDone = done
+                    sf.seriesTotal = total
+
+    def getFileStatus(self, filepath):
+        """Returns the status of a scheduled file (see getStatus), or None if it has not been scheduled."""
+
+        key = str(Path(filepath).resolve())
+
+        for f in self.getStatus()['files']:
+            if f['file'] == key:
+                return f
+
+        return None
+
+    def getStatus(self):
+        """
+        Returns the queue depth, number of running files, and the status of each scheduled file, including its
+        progress and estimated seconds until done. Files are listed running first and then in queue order.
+        """
+
+        with self.lock:
+
+            now = time.time()
+            running = sorted((sf for sf in self.files.values() if sf.state == 'running'), key=lambda sf: sf.startTime)
+            queued = sorted((sf for sf in self.files.values() if sf.state == 'queued'), key=lambda sf: (sf.priority, sf.seq))
+            finished = sorted((sf for sf in self.files.values() if sf.state in ('done', 'failed')), key=lambda sf: sf.endTime)
+
+            # Estimate seconds of work per byte of original file from the files
+            # finished so far or, failing that, from the progress of those
+            # running.
+            finishedDone = [sf for sf in finished if sf.state == 'done' and sf.size > 0]
+            if len(finishedDone) > 0:
+                secondsPerByte = sum(sf.endTime - sf.startTime for sf in finishedDone) / sum(sf.size for sf in finishedDone)
+            else:
+                estimates = [(now - sf.startTime) / (sf.progress * sf.size) for sf in running if sf.progress and sf.size > 0]
+                secondsPerByte = sum(estimates) / len(estimates) if len(estimates) > 0 else None
+
+            eta = {}
+
+            # Estimate the remaining time of running files
+            for sf in running:
+                elapsed = now - sf.startTime
+                if sf.progress:
+                    eta[sf] = elapsed * (1 - sf.progress) / sf.progress
+                elif secondsPerByte is not None:
+                    eta[sf] = max(sf.size * secondsPerByte - elapsed, 0.)
+                else:
+                    eta[sf] = None
+
+            # Estimate when queued files will be done by handing them out in
+            # queue order to whichever worker frees up first.
+            if secondsPerByte is not None and all(eta[sf] is not None for sf in running):
+                workers = [eta[sf] for sf in running] + [0.] * max(self.processes - len(running), 0)
+                heapq.heapify(workers)
+                for sf in queued:
+                    eta[sf] = heapq.heappop(workers) + sf.size * secondsPerByte
+                    heapq.heappush(workers, eta[sf])
+            else:
+                for sf in queued:
+                    eta[sf] = None
+
+            etas = list(eta.values())
+            positions = {sf: i for i, sf in enumerate(queued)}
+
+            return {
+                'processes': self.processes,
+                'queue_depth': len(queued),
+                'running': len(running),
+                'done': sum(1 for sf in finished if sf.state == 'done'),
+                'failed': sum(1 for sf in finished if sf.state == 'failed'),
+                'eta': None if any(e is None for e in etas) else max(etas, default=0.),
+                'files': [{
+                    'file': sf.key,
+                    'state': sf.state,
+                    'position': positions.get(sf),
+                    'prioritized': sf.priority == PRIORITY_URGENT,
+                    'progress': sf.progress,
+                    'series_done': sf.seriesDone,
+                    'series_total': sf.seriesTotal,
+                    'elapsed': None if sf.startTime is None else (sf.endTime or now) - sf.startTime,
+                    'eta': eta.get(sf, 0. if sf.state == 'done' else None),
+                    'error': sf.error,
+                } for sf in running + queued + finished],
+            }
+
+    def close(self):
+        """Stops scheduling, waits for files handed to the pool to finish, and shuts down the pool."""
+
+        with self.lock:
+            self.queue = []
+
+        self.pool.close()
+        self.pool.join()
+        self.progressQueue.put(None)
+        self.progressThread.join()
@@ -4,6 +4,7 @@ from math import ceil
 from threading import Lock
 import logging
 import numpy as np
+import os
 import pandas as pd
 import time
 import psutil
@@ -11,24 +12,34 @@ import psutil
 from .config import config
 from .rawdata import RawData
 from .downsampleset import DownsampleSet
+from .slicecache import getRawCache
 
-from .cylib import generateThresholdAlerts
+from .cylib import consolidateAlerts, generateThresholdAlerts, generateUnconsolidatedThresholdAlerts, getPastThresholdIndices
+
+# Maximum fraction of the raw data rows of a series which pattern detection
+# screened with the downsamples may read (see Series.generateThresholdAlerts),
+# beyond which all raw data is read instead.
+screenMaxFraction = 0.5
 
 # Represents a single time series of data.
 class Series:
 
     # Reads a series into memory and builds the downsampling. Fileparent is a reference
-    # to the File class instance which contains the Series.
-    def __init__(self, ds, timecol, valcol, fileparent):
+    # to the File class instance which contains the Series. If a catalog entry
+    # of the series is provided (see getCatalogEntry), the series is set up from
+    # it without accessing the original file, in which case ds may be None.
+    def __init__(self, ds, timecol, valcol, fileparent, catalogEntry=None):
+
+        dsname = ds.name if catalogEntry is None else catalogEntry['dataset']
 
         # The series ID is the dataset path in the HDF5 file
-        self.id = f'{ds.name}:{valcol}'
+        self.id = f'{dsname}:{valcol}'
 
         # Holds the ordered (hierarchical) list of groups and, ultimately,
         # dataset to which the series belongs. So, this is like a folder path,
         # where the first element is the outermost group name and the last
         # element is the dataset name of the series.
-        self.h5path = [e for e in ds.name.split('/') if len(e) > 0]
+        self.h5path = [e for e in dsname.split('/') if len(e) > 0]
 
         # Holds the ordered (hierarchical) list of groups where downsamples will
         # be stored in the processed file.
@@ -48,16 +59,19 @@ class Series:
         if self.fileparent.mode() == 'file':
 
             # Holds the raw data set
-            self.rd = RawData(self)
+            self.rd = RawData(self, catalogEntry)
 
             # Holds the downsample set
             self.dss = DownsampleSet(self)
 
             # Grab the unit, if available
-            try:
-                self.units = self.fileparent.f['/'.join(self.h5path)].meta['dwc_meta']['unitLabel']
-            except:
-                self.units = ""
+            if catalogEntry is not None:
+                self.units = catalogEntry['units']
+            else:
+                try:
+                    self.units = self.fileparent.f['/'.join(self.h5path)].meta['dwc_meta']['unitLabel']
+                except:
+                    self.units = ""
 
             logging.debug(f"Units: {self.units}")
 
@@ -92,6 +106,11 @@ class Series:
 
         return
 
+    # Generates threshold alerts for the series (see cylib
+    # generateThresholdAlerts). If screen is set, the raw data is only read
+    # where alerts may start, as screened with the downsamples (see
+    # getThresholdAlertCandidates), with the same alerts resulting as from
+    # reading all raw data.
     def generateThresholdAlerts(
             self, 
             thresholdlow, 
@@ -104,13 +123,96 @@ class Series:
             drop_values_below=None, 
             drop_values_above=None,
             drop_values_between=None,
+            screen=False,
         ):
 
-        # Pull raw data for the series into memory
-        self.pullRawDataIntoMemory()
+        min_sample_count = ceil(expected_frequency*duration*min_density)
+
+        candidates = self.getThresholdAlertCandidates(thresholdlow, thresholdhigh, mode, duration) if screen else None
+
+        if candidates is not None:
+
+            # Find the rows holding the raw data of each candidate range up to
+            # the duration past it, so that the sample of each alert starting
+            # in the range is complete, and merge those overlapping.
+            startRows, stopRows = self.rd.getRowRanges(candidates[:,0], candidates[:,1] + duration)
+            stopRows = np.maximum.accumulate(stopRows)
+            first = np.concatenate(([True], startRows[1:] > stopRows[:-1]))
+            last = np.append(first[1:], True)
+            startRows, stopRows = startRows[first], stopRows[last]
+
+            # Screening pays off only if it rules out most of the raw data
+            if np.sum(stopRows - startRows) > self.rd.len * screenMaxFraction:
+                candidates = None
+
+        if candidates is not None:
+
+            # Generate the alerts of the rows read, keeping those starting
+            # within a candidate range, and consolidate them once those of all
+            # rows are generated.
+            alerts = []
+            for startRow, stopRow in zip(startRows, stopRows):
+                rawTimes, rawValues = self.rd.getRows(startRow, stopRow)
+                data = self.dropValues(np.array([rawTimes, rawValues]).T, drop_values_below, drop_values_above, drop_values_between)
+                rowAlerts = generateUnconsolidatedThresholdAlerts(data[:,0], data[:,1], thresholdlow, thresholdhigh, mode, duration, persistence, min_sample_count)
+                ci = np.searchsorted(candidates[:,0], rowAlerts[:,0], side='right') - 1
+                alerts.append(rowAlerts[(ci >= 0) & (rowAlerts[:,0] <= candidates[np.maximum(ci, 0),1])])
+
+            return consolidateAlerts(np.concatenate(alerts), maxgap)
+
+        # Get the raw data for the series, as a data array with two columns:
+        # times & values
+        data = self.dropValues(self.getCachedRawData(), drop_values_below, drop_values_above, drop_values_between)
+
+        # Run through the data and generate alerts
+        return generateThresholdAlerts(data[:,0], data[:,1], thresholdlow, thresholdhigh, mode, duration, persistence, maxgap, min_sample_count)
+
+    # Generates threshold alerts for the series for each of many parameter sets,
+    # provided as a dict mapping each parameter set ID to a dict of the keyword
+    # arguments of generateThresholdAlerts (other than screen), and returns a
+    # dict mapping each parameter set ID to its alerts. The raw data is read
+    # once, and the work shared by parameter sets is done once for all of
+    # them: values are dropped once per set of drop thresholds, the data points
+    # past the threshold(s) are found once per threshold(s), and alerts are
+    # generated once per duration, persistence & minimum sample count, before
+    # being consolidated with the maxgap of each parameter set.
+    def sweepThresholdAlerts(self, paramsets):
+
+        data = self.getCachedRawData()
+
+        # Group the parameter set IDs by the work they share
+        groups = {}
+        for id, p in paramsets.items():
+            dropKey = (p['drop_values_below'], p['drop_values_above'], None if p['drop_values_between'] is None else tuple(p['drop_values_between']))
+            thresholdKey = (p['mode'], p['thresholdlow'], p['thresholdhigh'])
+            alertKey = (p['duration'], p['persistence'], ceil(p['expected_frequency']*p['duration']*p['min_density']))
+            groups.setdefault(dropKey, {}).setdefault(thresholdKey, {}).setdefault(alertKey, []).append(id)
+
+        alerts = {}
+        for dropKey, thresholdGroups in groups.items():
+
+            dropped = self.dropValues(data, *dropKey)
+            rawTimes = np.ascontiguousarray(dropped[:,0])
+            rawValues = np.ascontiguousarray(dropped[:,1])
+            del dropped
+
+            for (mode, thresholdlow, thresholdhigh), alertGroups in thresholdGroups.items():
+
+                pastThresholdIndices = getPastThresholdIndices(rawValues, thresholdlow, thresholdhigh, mode)
 
-        # assemble a data numpy array with two columns: self.rawTimes and self.rawValues
-        data = np.array([self.rawTimes, self.rawValues]).T
+                for (duration, persistence, min_sample_count), ids in alertGroups.items():
+
+                    unconsolidated = generateUnconsolidatedThresholdAlerts(rawTimes, rawValues, thresholdlow, thresholdhigh, mode, duration, persistence, min_sample_count, pastThresholdIndices)
+
+                    for id in ids:
+                        alerts[id] = consolidateAlerts(unconsolidated, paramsets[id]['maxgap'])
+
+        return {id: alerts[id] for id in paramsets}
+
+    # Returns the rows of a data array with two columns, times & values,
+    # without the values dropped for pattern detection (see
+    # generateThresholdAlerts).
+    def dropValues(self, data, drop_values_below=None, drop_values_above=None, drop_values_between=None):
 
         # Drop values below the drop_values_below threshold
         if drop_values_below is not None:
@@ -124,13 +226,69 @@ class Series:
         if drop_values_between is not None:
             data = data[(data[:,1] <= drop_values_between[0]) | (data[:,1] >= drop_values_between[1])]
 
-        # Run through the data and generate alerts
-        alerts = generateThresholdAlerts(data[:,0], data[:,1], thresholdlow, thresholdhigh, mode, duration, persistence, maxgap, ceil(expected_frequency*duration*min_density))
+        return data
+
+    # Returns the time ranges in which threshold alerts for the parameters
+    # provided (see generateThresholdAlerts) may start, as an Nx2 array of
+    # start & stop times in order, or None if there are no downsamples. An
+    # alert starts at a data point past the threshold(s), which may only lie in
+    # a downsample interval whose min or max is past the threshold(s), so the
+    # intervals of the downsample for the duration (see
+    # DownsampleSet.getScreeningDownsample) rule out the rest of the raw data.
+    # Ranges less than the duration apart are merged, as the raw data read for
+    # each extends the duration past it.
+    def getThresholdAlertCandidates(self, thresholdlow, thresholdhigh, mode, duration):
+
+        screening = self.dss.getScreeningDownsample(duration)
+        if screening is None:
+            return None
+        intervals, timePerInterval = screening
+
+        mins = intervals[:,1]
+        maxs = intervals[:,2]
+        if mode == 0:
+            candidate = mins < thresholdlow
+        elif mode == 1:
+            candidate = maxs > thresholdhigh
+        else:
+            candidate = (mins < thresholdlow) | (maxs > thresholdhigh)
 
-        # Remove raw data for the series fromm memory
-        self.initializeRawDataInMemory()
+        # Intervals with a nan min or max can not be ruled out
+        candidate = candidate | np.isnan(mins) | np.isnan(maxs)
+
+        # The time of an interval lies within the interval, and so do its data
+        # points, all of which are therefore within the time-per-interval of
+        # its time (with a margin for floating point rounding). Raw data after
+        # the last interval, e.g. appended since the downsamples were built,
+        # can not be ruled out.
+        reach = timePerInterval * 1.01
+        times = intervals[candidate,0]
+        starts = np.append(times - reach, intervals[-1,0] + reach)
+        stops = np.append(times + reach, np.inf)
+
+        # Merge the ranges
+        first = np.concatenate(([True], starts[1:] > stops[:-1] + duration))
+        last = np.append(first[1:], True)
+        candidates = np.stack((starts[first], stops[last]), axis=1)
+
+        logging.info(f"Screened {intervals.shape[0]} intervals of {self.id} for {candidates.shape[0]} candidate ranges spanning {round(np.sum(np.minimum(candidates[:,1], intervals[-1,0] + reach) - candidates[:,0]), 3)}s.")
 
-        return alerts
+        return candidates
+
+    # Returns the entry of the series in the series catalog stored in the
+    # processed file (see File.storeSeriesCatalog), from which the series can
+    # be set up without accessing the original file.
+    def getCatalogEntry(self):
+
+        return {
+            'dataset': '/' + '/'.join(self.h5path),
+            'timecol': self.timecol,
+            'valcol': self.valcol,
+            'units': self.units,
+            'rows': int(self.rd.len),
+            'timespan': float(self.rd.timespan),
+            'timeIndexStride': int(self.rd.timeIndexStride),
+        }
 
     def getDataAsDF(self):
         """
@@ -139,16 +297,21 @@ class Series:
         """
         return self.fileparent.f['/'.join(self.h5path)].get(datetimes=True)[[self.timecol, self.valcol]].rename(columns={self.timecol: 'time', self.valcol: 'value'})
 
-    # Produces JSON output for the series at the maximum time range.
-    def getFullOutput(self):
+    # Produces JSON output for the series at the maximum time range. If columnar
+    # is set, the data is provided as a list of columns (NumPy arrays, or None
+    # for columns which are null in every row) rather than a list of rows.
+    def getFullOutput(self, columnar=False):
 
         logging.info("Assembling full output for " + self.id + ".")
 
         if self.fileparent.mode() == 'realtime':
 
             with self.dequeLock:
-                nones = [None] * len(self.rawTimes)
-                data = [list(i) for i in zip(self.rawTimes, nones, nones, self.rawValues)]
+                if columnar:
+                    data = [np.array(self.rawTimes, dtype=np.float64), None, None, np.array(self.rawValues, dtype=np.float64)]
+                else:
+                    nones = [None] * len(self.rawTimes)
+                    data = [list(i) for i in zip(self.rawTimes, nones, nones, self.rawValues)]
             output_type = 'real'
 
         elif self.fileparent.mode() == 'file':
@@ -159,15 +322,18 @@ class Series:
             # Set data either to the retrieved downsample or to the raw data
             if downsampleFullOutput is not None:
 
-                data = downsampleFullOutput.to_records(index=False).tolist()
+                data = downsampleOutputData(downsampleFullOutput, columnar)
                 output_type = 'downsample'
 
             else:
 
                 # Get reference to the series datastream from the HDF5 file
                 rawTimes, rawValues = self.pullRawDataIntoMemory(returnValuesOnly=True)
-                nones = [None] * len(rawTimes)
-                data = [list(i) for i in zip(rawTimes, nones, nones, rawValues)]
+                if columnar:
+                    data = [rawTimes, None, None, rawValues]
+                else:
+                    nones = [None] * len(rawTimes)
+                    data = [list(i) for i in zip(rawTimes, nones, nones, rawValues)]
                 output_type = 'real'
 
         else:
@@ -187,8 +353,9 @@ class Series:
         }
 
     # Produces JSON output for the series over a specified time range, with
-    # starttime and stoptime being time offset floats in seconds.
-    def getRangedOutput(self, starttime, stoptime):
+    # starttime and stoptime being time offset floats in seconds. If columnar is
+    # set, the data is provided as a list of columns (see getFullOutput).
+    def getRangedOutput(self, starttime, stoptime, columnar=False):
 
         logging.info(f"Assembling ranged output for {self.id}.")
 
@@ -199,13 +366,13 @@ class Series:
         # Get the appropriate downsample for this time range
         ds = self.dss.getRangedOutput(starttime, stoptime)
         if isinstance(ds, pd.DataFrame):
-            data = ds.to_records(index=False).tolist()
+            data = downsampleOutputData(ds, columnar)
             output_type = 'downsample'
 
         
         # if (not isinstance(ds, pd.DataFrame) or pd.DataFrame.empty):
         else:
-            data = self.rd.getRangedOutput(starttime, stoptime)
+            data = self.rd.getRangedOutput(starttime, stoptime, columnar)
             output_type = 'real'
         # print(data)
         logging.info(f"Completed assembly of ranged ({'downsampled' if output_type=='downsample' else 'raw'}) output for {self.id}.")
@@ -227,6 +394,25 @@ class Series:
         logging.info(f"Processing & storing all downsamples for the series {self.id}")
         start = time.time()
 
+        # If a chunk size is configured, build the downsamples from the raw data
+        # read in blocks of rows, without ever pulling it into memory in full.
+        if config['downsampleChunkSize'] > 0:
+
+            logging.info(f"MEM PRE-DSPRC: {p.memory_full_info().uss / 1024 / 1024} MB")
+
+            # Build & store to file all downsamples for the series
+            try:
+                self.dss.processAndStoreChunked(config['downsampleChunkSize'])
+            except Exception as e:
+                logging.error(f"Error processing & storing downsamples for series {self.id}. Raising exception.")
+                raise e
+
+            logging.info(f"MEM AFT-DSPRC: {p.memory_full_info().uss / 1024 / 1024} MB")
+
+            end = time.time()
+            logging.info(f"Completed processing & storing all downsamples for the series {self.id}. Took {round((end - start) / 60, 3)} minutes.")
+            return
+
         logging.info(f"MEM PRE-PULLD: {p.memory_full_info().uss / 1024 / 1024} MB")
 
         # Pull raw data for the series into memory
@@ -259,6 +445,64 @@ class Series:
         end = time.time()
         logging.info(f"Completed processing & storing all downsamples for the series {self.id}. Took {round((end - start) / 60, 3)} minutes.")
 
+    # Builds all downsamples for the series without storing them, so that they
+    # may be built apart from the processed file (e.g. in a worker process) and
+    # stored with storeDownsamples. Returns a tuple with a list of interval
+    # arrays (finest first) and the state from which they may be extended, or
+    # None (see DownsampleSet.buildState).
+    def buildDownsamples(self):
+
+        logging.info(f"Building all downsamples for the series {self.id}")
+        start = time.time()
+
+        if config['downsampleChunkSize'] > 0:
+            downsamples, state = self.dss.buildDownsamplesChunked(config['downsampleChunkSize'])
+        else:
+            self.pullRawDataIntoMemory()
+            try:
+                downsamples, state = self.dss.buildDownsamples()
+            finally:
+                self.initializeRawDataInMemory()
+
+        end = time.time()
+        logging.info(f"Completed building all downsamples for the series {self.id}. Took {round((end - start) / 60, 3)} minutes.")
+
+        return downsamples, state
+
+    # Extends the downsamples stored for the series in the processed file with
+    # the data added to the series since, if possible. Returns whether the
+    # downsamples are up to date, or False if they must be built in full (see
+    # DownsampleSet.extendAndStore).
+    def extendAndStore(self):
+
+        logging.info(f"Extending downsamples for the series {self.id}")
+        start = time.time()
+
+        try:
+            extended = self.dss.extendAndStore(config['downsampleChunkSize'])
+        except Exception as e:
+            logging.error(f"Error extending downsamples for series {self.id}. Raising exception.")
+            raise e
+
+        end = time.time()
+        if extended:
+            logging.info(f"Completed extending downsamples for the series {self.id}. Took {round((end - start) / 60, 3)} minutes.")
+        else:
+            logging.info(f"Downsamples for the series {self.id} cannot be extended and must be built in full.")
+
+        return extended
+
+    # Stores downsamples built with buildDownsamples in the processed file,
+    # along with the state from which they may be extended and the time index of
+    # the raw data, if already built.
+    def storeDownsamples(self, downsamples, state=None, timeIndex=None):
+
+        try:
+            self.dss.storeDownsamples(downsamples, state, timeIndex)
+        except Exception as e:
+            logging.error(f"Error storing downsamples for series {self.id}. Raising exception.")
+            raise e
+
     def pullRawDataIntoMemory(self, returnValuesOnly=False):
         """
         Pulls the raw data for the series from the file into memory (self.rawTimeOffsets and self.rawValues).
@@ -291,10 +535,62 @@ class Series:
         else:
             self.rawTimes = rawTimes
             self.rawValues = rawValues
+            self.rawRows = dataset.shape[0]
 
         end = time.time()
         logging.info(f"Finished reading raw series data into memory for {self.id} ({self.rawTimes.shape[0]} points). Took {round(end - start, 5)}s.")
 
+    def getCachedRawData(self):
+        """
+        Returns the raw data for the series as a read-only array with two columns, times & values (float64, with nan
+        values dropped), from the raw data cache shared by all series (see slicecache.getRawCache), reading it with
+        pullRawDataIntoMemory and caching it if not held there. Cached data is keyed by the size & modification time of
+        the original file, and that of a modified file is replaced.
+        """
+
+        cache = getRawCache()
+        origFilePath = str(self.fileparent.origFilePathObj)
+        st = os.stat(origFilePath)
+        key = (origFilePath, self.id, st.st_size, st.st_mtime_ns)
+
+        # The times & values are held as the rows of the array cached, so that
+        # the columns of the array returned are each contiguous.
+        data = cache.get(key)
+        if data is None:
+            rawTimes, rawValues = self.pullRawDataIntoMemory(returnValuesOnly=True)
+            data = np.stack((rawTimes, rawValues))
+            data.setflags(write=False)
+            cache.invalidate(origFilePath, self.id)
+            cache.put(key, data)
+
+        return data.T
+
+    def iterRawDataBlocks(self, chunkSize, startRow=0):
+        """
+        Reads the raw data for the series from the file in consecutive blocks of at most chunkSize rows, starting
+        at row startRow, yielding a tuple with the times & values of each block. As with pullRawDataIntoMemory, nan
+        values are dropped, so blocks may be shorter than chunkSize (or even empty). Only one block is held in
+        memory at a time.
+        """
+
+        # Get reference to the series dataset in the HDF5 file
+        dataset = self.fileparent.f['/'.join(self.h5path)]
+        nrow = dataset.nrow
+        self.rawRows = nrow
+
+        for blockStart in range(startRow, nrow, chunkSize):
+
+            block = dataset[blockStart:min(blockStart + chunkSize, nrow)]
+
+            rawTimes = block[self.timecol].values.astype(np.float64)
+            rawValues = block[self.valcol].values.astype(np.float64)
+            del block
+
+            # Drop nan values
+            mask = ~np.isnan(rawValues)
+
+            yield rawTimes[mask], rawValues[mask]
+
     # Initializes the raw data stored for the series in memory and thereby
     # removes it from memory.
     def initializeRawDataInMemory(self):
@@ -305,6 +601,17 @@ class Series:
         self.rawTimes = deque(maxlen=config['M'])
         self.rawValues = deque(maxlen=config['M'])
 
+        # Number of rows of the raw data read through
+        self.rawRows = 0
+
+# Returns the output data of a downsample slice (a DataFrame with columns for
+# time, min & max) as a list of rows or, if columnar is set, as a list of the
+# columns as NumPy arrays.
+def downsampleOutputData(ds, columnar):
+    if columnar:
+        return [ds[c].values for c in ds.columns]
+    return ds.to_records(index=False).tolist()
+
 def simpleSeriesName(s):
     simpleNameComponents = s.split('/')[-1].split(':')
     if simpleNameComponents[1] == 'value':
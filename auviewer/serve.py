@@ -19,9 +19,12 @@ import json
 import simplejson
 
 from . import models
-from .api import downsampleFile, getProject, getProjectsPayload, loadProjects
+from .compression import compressResponse, precompressStaticAssets
+from .api import attachProjects, downsampleFile, getCacheStats, getDownsampleStatus, getRequestExecutor, getProject, getProjectsPayload, loadProjects, prioritizeDownsample, runCoordinator, setDataPath
 from .patternset import getAssignmentsPayload
+from .production import serveProduction
 from .config import set_data_path, config, FlaskConfigClass
+from .wireformat import encodePayload, isBinaryFormat
 
 from .flask_user import current_user, login_required, UserManager, SQLAlchemyAdapter
 from .flask_user.signals import user_sent_invitation, user_registered
@@ -68,7 +71,30 @@ import pytz
 featurizers = {}
 
 
-def createApp():
+def isValidBatchRequest(r):
+    """
+    Returns whether an entry of a batch series ranged data request is well-formed: a dict with a scalar file_id, a
+    list of series IDs under series and numeric start & stop times.
+    """
+    def isNumber(v):
+        return isinstance(v, (int, float)) and not isinstance(v, bool)
+    return (
+        isinstance(r, dict)
+        and isinstance(r.get('file_id'), (int, str)) and not isinstance(r.get('file_id'), bool)
+        and isinstance(r.get('series'), list) and all(isinstance(s, str) for s in r['series'])
+        and isNumber(r.get('start')) and isNumber(r.get('stop'))
+    )
+
+
+def createApp(interactive=True, role='standalone'):
+    # If interactive is set, the user is prompted to create an admin user if
+    # none exists. Production app factories are not interactive.
+    #
+    # The role is 'standalone' for a server which loads projects & downsamples
+    # files itself, or 'worker' for one of many server processes attaching to
+    # the projects of a coordinator (python -m auviewer.serve --coordinator),
+    # which does so for them.
+
     # Instantiate the Flask web application class
     app = Flask(__name__, template_folder=str(config['codeRootPathObj'] / 'static' / 'www' / 'templates'))
 
@@ -125,7 +151,9 @@ def createApp():
     # could modify the database.
     #
     with app.app_context():
-        if not models.User.query.first():
+        if not models.User.query.first() and not interactive:
+            logging.warning("No users exist. Run python -m auviewer.serve with the data path interactively to create an admin user.")
+        elif not models.User.query.first():
             from getpass import getpass
             print("You must create an admin user.")
             fn = input("First name: ")
@@ -143,9 +171,13 @@ def createApp():
             models.db.session.add(u)
             models.db.session.commit()
 
-    # Load projects
+    # Load projects, or attach to those of the coordinator. Files are verified
+    # on the file system in the background, so that serving starts at once.
     with app.app_context():
-        loadProjects()
+        if role == 'worker':
+            attachProjects()
+        else:
+            loadProjects(background=True)
 
     # Instantiate a file for realtime, in-memory usage (probably temporary)
     # TODO(gus): Refactor realtime
@@ -167,6 +199,15 @@ def createApp():
     app.register_blueprint(Blueprint('img', __name__, static_url_path=config['rootWebPath'] + '/img', static_folder=str(config['codeRootPathObj'] / 'static' / 'www' / 'img')))
     app.register_blueprint(Blueprint('js', __name__, static_url_path=config['rootWebPath'] + '/js', static_folder=str(config['codeRootPathObj'] / 'static' / 'www' / 'js')))
 
+    # Precompress the static assets, to be served compressed where accepted
+    precompressedStaticAssets = precompressStaticAssets({name: bp.static_folder for name, bp in app.blueprints.items() if name in ['css', 'fonts', 'img', 'js']})
+
+    # Compress data responses & serve precompressed static assets where
+    # accepted
+    @app.after_request
+    def response_compress(response):
+        return compressResponse(request, response, precompressedStaticAssets)
+
     @app.route('/favicon.ico')
     def favicon():
         return send_from_directory(str(config['codeRootPathObj'] / 'static' / 'www' / 'img' / 'favicons'), 'favicon.ico')
@@ -175,11 +216,71 @@ def createApp():
     ### All methods below should have ###
     ### the @login_required decorator ###
 
+    @app.route(config['rootWebPath']+'/batch_series_ranged_data', methods=['POST'])
+    @login_required
+    def batch_series_ranged_data():
+
+        # Parse parameters. The request body is a JSON object with the project
+        # ID and a list of requests, each with the file ID, series IDs and
+        # start & stop times, and optionally the wire format.
+        params = request.get_json(silent=True)
+        if not isinstance(params, dict) or not isinstance(params.get('requests'), list):
+            logging.error("Invalid batch series ranged data request.")
+            abort(400, description="Invalid request.")
+            return
+        project_id = params.get('project_id')
+        format = params.get('format', 'json')
+        if not all(isValidBatchRequest(r) for r in params['requests']):
+            logging.error("Invalid batch series ranged data request entry.")
+            abort(400, description="Invalid request.")
+            return
+
+        # Get the project
+        project = getProject(project_id)
+        if project is None:
+            logging.error(f"Project ID {project_id} not found.")
+            abort(404, description="Project not found.")
+            return
+
+        # If any of the files are still waiting to be downsampled, move them to
+        # the front of the queue.
+        for r in params['requests']:
+            file = project.getFile(r.get('file_id'))
+            if file is not None:
+                prioritizeDownsample(file)
+
+        # Assemble the series ranged data of the files concurrently and output
+        # the response, in the binary columnar wire format if requested
+        if isBinaryFormat(format):
+            return app.response_class(
+                response=encodePayload({'files': project.getBatchSeriesRangedOutput(params['requests'], getRequestExecutor(), columnar=True)}, format),
+                status=200,
+                mimetype='application/octet-stream'
+            )
+
+        # The JSON is streamed, with the files encoded one at a time.
+        return app.response_class(
+            response=project.iterBatchSeriesRangedOutputJSON(params['requests'], getRequestExecutor()),
+            status=200,
+            mimetype='application/json'
+        )
+
     @app.route(config['rootWebPath']+'/bokeh.html')
     @login_required
     def bokeh():
         return send_from_directory('../www', 'bokeh.html')
 
+    @app.route(config['rootWebPath']+'/cache_status', methods=['GET'])
+    @login_required
+    def cache_status():
+
+        # Output response
+        return app.response_class(
+            response=simplejson.dumps(getCacheStats(), ignore_nan=True),
+            status=200,
+            mimetype='application/json'
+        )
+
     @app.route(config['rootWebPath'] + '/close_all_files', methods=['GET'])
     @login_required
     def close_all_files():
@@ -187,7 +288,7 @@ def createApp():
 
         for p in projects:
             proj = getProject(p['id'])
-            for f in proj.files:
+            for f in proj.getLoadedFiles():
                 try:
                     f.close()
 
@@ -222,7 +323,7 @@ def createApp():
             )
 
         ### To be implemented here...
-        for f in project.files:
+        for f in project.getLoadedFiles():
             try:
                 f.close()
             except Exception as e:
@@ -428,6 +529,45 @@ def createApp():
             mimetype='application/json'
         )
 
+    @app.route(config['rootWebPath']+'/downsample_status', methods=['GET'])
+    @login_required
+    def downsample_status():
+
+        # Parse parameters. If a file is specified, only its status is returned.
+        project_id = request.args.get('project_id', type=int)
+        file_id = request.args.get('file_id', type=int)
+
+        if project_id is None and file_id is None:
+
+            # Get the status of all scheduled files
+            status = getDownsampleStatus()
+
+        else:
+
+            # Get the project
+            project = getProject(project_id)
+            if project is None:
+                logging.error(f"Project ID {project_id} not found.")
+                abort(404, description="Project not found.")
+                return
+
+            # Get the file
+            file = project.getFile(file_id)
+            if file is None:
+                logging.error(f"File ID {file_id} not found.")
+                abort(404, description="File not found.")
+                return
+
+            # Get the status of the file (None if it is not being downsampled)
+            status = getDownsampleStatus(file)
+
+        # Output response
+        return app.response_class(
+            response=simplejson.dumps(status, ignore_nan=True),
+            status=200,
+            mimetype='application/json'
+        )
+
     @app.route(config['rootWebPath'] + '/featurize')
     @login_required
     def featurize():
@@ -577,6 +717,7 @@ def createApp():
         # Parse parameters
         project_id = request.args.get('project_id', type=int)
         file_id = request.args.get('file_id', type=int)
+        format = request.args.get('format', default='json')
 
         # Get the project
         project = getProject(project_id)
@@ -592,13 +733,24 @@ def createApp():
             abort(404, description="File not found.")
             return
 
+        # If the file is still waiting to be downsampled, move it to the front
+        # of the queue.
+        prioritizeDownsample(file)
+
         # Assemble the initial file payload (full zoomed-out & downsampled, if
-        # necessary, datasets for all data series.
-        initialFilePayload = file.getInitialPayload(current_user.id)
+        # necessary, datasets for all data series, and output the response, in
+        # the binary columnar wire format if requested.
+        if isBinaryFormat(format):
+            return app.response_class(
+                response=encodePayload(file.getInitialPayload(current_user.id, columnar=True), format),
+                status=200,
+                mimetype='application/octet-stream'
+            )
 
-        # Output response
+        # The JSON payload is streamed, with the part which is the same for all
+        # users served from the file's payload cache.
         return app.response_class(
-            response=simplejson.dumps(initialFilePayload, ignore_nan=True),
+            response=file.iterInitialPayloadJSON(current_user.id),
             status=200,
             mimetype='application/json'
         )
@@ -669,6 +821,7 @@ def createApp():
         series = request.args.getlist('s[]')
         start = request.args.get('start', type=float)
         stop = request.args.get('stop', type=float)
+        format = request.args.get('format', default='json')
 
         # Get the project
         project = getProject(project_id)
@@ -684,12 +837,23 @@ def createApp():
             abort(404, description="File not found.")
             return
 
-        # Assemble the series ranged data
-        seriesRangedData = file.getSeriesRangedOutput(series, start, stop)
+        # If the file is still waiting to be downsampled, move it to the front
+        # of the queue.
+        prioritizeDownsample(file)
 
-        # Output response
+        # Assemble the series ranged data and output the response, in the binary
+        # columnar wire format if requested
+        if isBinaryFormat(format):
+            return app.response_class(
+                response=encodePayload(file.getSeriesRangedOutput(series, start, stop, columnar=True), format),
+                status=200,
+                mimetype='application/octet-stream'
+            )
+
+        # The JSON is streamed, with the series assembled & encoded one at a
+        # time.
         return app.response_class(
-            response=simplejson.dumps(seriesRangedData, ignore_nan=True),
+            response=file.iterSeriesRangedOutputJSON(series, start, stop),
             status=200,
             mimetype='application/json'
         )
@@ -774,12 +938,15 @@ def main():
     parser = argparse.ArgumentParser(prog='python -m auviewer.serve', description='Auton Lab Universal Viewer')
     parser.add_argument('datapath', type=str, nargs='?', help='Path to data directory (may be empty if starting new)')
     parser.add_argument('-ds', '--downsample', metavar=('original_file', 'destination_path'), type=str, nargs=2, help='Downsample a single original file to a destination.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes with which to downsample the series of a file concurrently (with --downsample).')
+    parser.add_argument('--production', action='store_true', help='Serve with a production server (uvicorn if installed) rather than the development server.')
+    parser.add_argument('--coordinator', action='store_true', help='Run as the coordinator of production server workers (see auviewer.production), loading projects & downsampling files for them, rather than serving.')
     args = parser.parse_args()
 
     # Handle a downsample request
     if args.downsample is not None:
         print(f"Downsampling file {Path(args.downsample[0]).resolve()} to destination {Path(args.downsample[1]).resolve()}.")
-        downsampleFile(args.downsample[0], args.downsample[1])
+        downsampleFile(args.downsample[0], args.downsample[1], jobs=args.jobs)
         return
 
     # Handle no data path or file argument
@@ -832,6 +999,12 @@ def main():
         # Set the data path provided
         set_data_path(args.datapath)
 
+    # Handle a coordinator request
+    if args.coordinator:
+        setDataPath(str(config['dataPathObj']))
+        runCoordinator()
+        return
+
     app = createApp()
 
     # Open auviewer in the browser, just before we spin up the server
@@ -844,7 +1017,10 @@ def main():
     else:
         print(f"\n{bannerMsgPrefix}You may access AUViewer at: {browser_url}\n{fmtEndSuffix}")
 
-    app.run(host=config['host'], port=config['port'], debug=True, use_reloader=False)
+    if args.production:
+        serveProduction(app)
+    else:
+        app.run(host=config['host'], port=config['port'], debug=True, use_reloader=False)
     return app
 
 # Start development web server
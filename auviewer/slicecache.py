@@ -0,0 +1,105 @@
+"""Memory-budgeted LRU caches of downsample slices & raw series data shared across requests."""
+
+import threading
+from collections import OrderedDict
+
+from .config import config
+
+class SliceCache:
+    """
+    Holds decoded blocks of downsample rows (one storage chunk of a downsample level each), keyed by
+    (processed file path, series ID, downsample index, number of rows of the level, block index), and evicts the least
+    recently used blocks once their total size exceeds the memory budget. Keying by the number of rows of the level
+    keeps blocks read before a downsample was extended from being served after.
+    """
+
+    def __init__(self, maxBytes):
+
+        # Memory budget in bytes. If 0, nothing is cached.
+        self.maxBytes = maxBytes
+
+        # Cached blocks, ordered from least to most recently used
+        self.blocks = OrderedDict()
+
+        # Total size in bytes of the cached blocks
+        self.size = 0
+
+        # Number of block lookups served from & missing from the cache
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached block for the key, marking it most recently used, or None if not cached."""
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is None:
+                self.misses += 1
+                return None
+            self.blocks.move_to_end(key)
+            self.hits += 1
+            return block
+
+    def put(self, key, block):
+        """Caches a block (NumPy array) for the key, evicting least recently used blocks to stay within budget."""
+        if block.nbytes > self.maxBytes:
+            return
+        with self.lock:
+            old = self.blocks.pop(key, None)
+            if old is not None:
+                self.size -= old.nbytes
+            self.blocks[key] = block
+            self.size += block.nbytes
+            while self.size > self.maxBytes:
+                _, evicted = self.blocks.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def invalidate(self, *prefix):
+        """Removes all cached blocks whose key starts with the given values, e.g. a processed file path & series ID."""
+        with self.lock:
+            for key in [k for k in self.blocks if k[:len(prefix)] == prefix]:
+                self.size -= self.blocks.pop(key).nbytes
+
+    def clear(self):
+        """Removes all cached blocks and resets the counters."""
+        with self.lock:
+            self.blocks.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def getStats(self):
+        """Returns the cache's hit & miss counters, number of blocks and size & budget in bytes."""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'blocks': len(self.blocks),
+                'size': self.size,
+                'max_size': self.maxBytes,
+            }
+
+# Holds the global slice cache, once instantiated (see getSliceCache)
+sliceCache = None
+
+def getSliceCache():
+    """Returns the global slice cache, instantiating it with the budget set by sliceCacheSizeMB in config if needed."""
+    global sliceCache
+    if sliceCache is None:
+        sliceCache = SliceCache(int(config['sliceCacheSizeMB'] * 1024 * 1024))
+    return sliceCache
+
+# Holds the global raw data cache, once instantiated (see getRawCache)
+rawCache = None
+
+def getRawCache():
+    """
+    Returns the global cache of the raw data of series read for pattern detection (see Series.getCachedRawData),
+    instantiating it with the budget set by rawCacheSizeMB in config if needed. It is a SliceCache holding one array per
+    series, keyed by (original file path, series ID, original file size, original file modification time).
+    """
+    global rawCache
+    if rawCache is None:
+        rawCache = SliceCache(int(config['rawCacheSizeMB'] * 1024 * 1024))
+    return rawCache
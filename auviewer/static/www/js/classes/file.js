@@ -1369,7 +1369,7 @@ File.prototype.updateCurrentViewData = function(left=false, right=false) {
 	const rightForBE = right / 1000 - this.fileData.baseTime;
 
 	// Request the updated view data from the backend.
-	requestHandler.requestSeriesRangedData(this.parentProject.id, this.id, series, leftForBE, rightForBE, this.getPostloadDataUpdateHandler());
+	this.parentProject.requestSeriesRangedData(this.id, series, leftForBE, rightForBE, this.getPostloadDataUpdateHandler());
 
 };
 
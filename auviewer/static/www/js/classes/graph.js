@@ -407,6 +407,6 @@ Graph.prototype.updateCurrentViewData = function() {
 	let series = this.isGroup ? this.members : [this.fullName];
 
 	// Request the updated view data from the backend.
-	requestHandler.requestSeriesRangedData(this.file.parentProject.id, this.file.id, series, xRange[0]/1000-this.file.fileData.baseTime, xRange[1]/1000-this.file.fileData.baseTime, this.file.getPostloadDataUpdateHandler());
+	this.file.parentProject.requestSeriesRangedData(this.file.id, series, xRange[0]/1000-this.file.fileData.baseTime, xRange[1]/1000-this.file.fileData.baseTime, this.file.getPostloadDataUpdateHandler());
 
 };
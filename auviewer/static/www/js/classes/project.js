@@ -38,6 +38,10 @@ function Project(payload) {
 		(payload.hasOwnProperty('interface_templates') && payload['interface_templates'] ? JSON.parse(payload['interface_templates']) : {}) || {}
 	);
 
+	// Series ranged data requests waiting to be sent to the backend as one
+	// batch (see requestSeriesRangedData)
+	this.pendingRangedDataRequests = [];
+
 	// Holds the user's annotations across all files in the project
 	this.annotations = this.getAnnotations();
 
@@ -69,3 +73,51 @@ Project.prototype.getAnnotations = function(callback=null) {
 	}).bind(this));
 
 };
+
+// Requests ranged data for series of a file of the project. Requests made
+// within the same turn of the event loop, e.g. the view refreshes of several
+// files or graphs, are sent to the backend together as one batch request, and
+// the callback is called with the file's part of the response.
+Project.prototype.requestSeriesRangedData = function(file_id, series, startTime, stopTime, callback) {
+
+	this.pendingRangedDataRequests.push({
+		request: {
+			file_id: file_id,
+			series: series,
+			start: startTime,
+			stop: stopTime
+		},
+		callback: callback
+	});
+
+	// Only the first pending request schedules sending the batch
+	if (this.pendingRangedDataRequests.length > 1) {
+		return;
+	}
+
+	setTimeout((function() {
+
+		const pending = this.pendingRangedDataRequests;
+		this.pendingRangedDataRequests = [];
+
+		requestHandler.requestBatchSeriesRangedData(this.id, pending.map(p => p.request), function(data) {
+
+			if (!data || !Array.isArray(data.files)) {
+				console.log('Invalid response received.');
+				return;
+			}
+
+			// The files of the response are in request order
+			for (let i = 0; i < pending.length && i < data.files.length; i++) {
+				if (data.files[i].hasOwnProperty('error')) {
+					console.log('Unable to retrieve data for file ' + data.files[i].file_id + ': ' + data.files[i].error);
+				} else {
+					pending[i].callback(data.files[i]);
+				}
+			}
+
+		});
+
+	}).bind(this), 0);
+
+};
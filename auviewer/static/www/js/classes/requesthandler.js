@@ -42,6 +42,18 @@ RequestHandler.prototype.featurize = function(project_id, file_id, series, featu
 		params: JSON.stringify(params)
 	});
 };
+
+// Requests ranged data for series of many files of a project at once. Takes
+// a list of requests, each an object with file_id, series (array of series
+// IDs), start & stop. The response holds a list of files in request order,
+// each with file_id and either series or error.
+RequestHandler.prototype.requestBatchSeriesRangedData = function(project_id, requests, callback) {
+	this._newJSONPostRequest(callback, globalAppConfig.batchSeriesRangedDataURL, this._withDataWireFormat({
+		project_id: project_id,
+		requests: requests
+	}), this._useBinaryDataWireFormat());
+};
+
 RequestHandler.prototype.requestPatternDetection = function(project_id, file_id, type, seriesID, tlow, thigh, duration, persistence, maxgap, callback) {
 
 	this._newRequest(callback, globalAppConfig.detectPatternsURL, {
@@ -59,10 +71,10 @@ RequestHandler.prototype.requestPatternDetection = function(project_id, file_id,
 };
 
 RequestHandler.prototype.requestInitialFilePayload = function(project_id, file_id, callback) {
-	this._newRequest(callback, globalAppConfig.initialFilePayloadURL, {
+	this._newRequest(callback, globalAppConfig.initialFilePayloadURL, this._withDataWireFormat({
 		project_id: project_id,
 		file_id: file_id
-	});
+	}), this._useBinaryDataWireFormat());
 };
 
 RequestHandler.prototype.requestProjectAnnotations = function(project_id, callback) {
@@ -72,13 +84,13 @@ RequestHandler.prototype.requestProjectAnnotations = function(project_id, callba
 };
 
 RequestHandler.prototype.requestSeriesRangedData = function(project_id, file_id, series, startTime, stopTime, callback) {
-	this._newRequest(callback, globalAppConfig.seriesRangedDataURL, {
+	this._newRequest(callback, globalAppConfig.seriesRangedDataURL, this._withDataWireFormat({
 		project_id: project_id,
 		file_id: file_id,
 		s: series,
 		start: startTime,
 		stop: stopTime
-	});
+	}), this._useBinaryDataWireFormat());
 };
 
 RequestHandler.prototype.updateAnnotation = function(id, project_id, file_id, left, right, seriesID, label, callback) {
@@ -97,14 +109,87 @@ RequestHandler.prototype.updateAnnotation = function(id, project_id, file_id, le
 
 };
 
-const callbackCaller = function(callback, path) {
+// Returns whether series data payloads are to be requested in the binary
+// columnar wire format.
+RequestHandler.prototype._useBinaryDataWireFormat = function() {
+	return globalAppConfig.dataWireFormat === 'binary' || globalAppConfig.dataWireFormat === 'binary32';
+};
+
+// Adds the format parameter to the params of a series data request if the
+// binary columnar wire format is to be used.
+RequestHandler.prototype._withDataWireFormat = function(params) {
+	if (this._useBinaryDataWireFormat()) {
+		params.format = globalAppConfig.dataWireFormat;
+	}
+	return params;
+};
+
+// Decodes a payload in the binary columnar wire format (see wireformat.py) from
+// an ArrayBuffer. The columns of each series are provided as typed array views
+// on the buffer in series[id].columns (null for columns which are null in every
+// row), and the data is materialized in series[id].data as the same array of
+// rows the JSON format provides. The series of each file of a batch payload
+// (under files) are decoded the same way.
+const decodeBinaryPayload = function(buffer) {
+
+	const view = new DataView(buffer);
+	const headerLength = view.getUint32(0, true);
+	const data = JSON.parse(new TextDecoder('utf-8').decode(new Uint8Array(buffer, 4, headerLength)));
+	const start = Math.ceil((4 + headerLength) / 8) * 8;
+
+	const decodeSeries = function(series) {
+
+		for (let id of Object.keys(series)) {
+
+			const length = series[id].data.length;
+			const columns = series[id].data.columns.map(c => c === null ? null :
+				c.dtype === '<f4' ? new Float32Array(buffer, start + c.offset, length) : new Float64Array(buffer, start + c.offset, length));
+
+			// Materialize the rows, with NaN's standing in for nulls
+			const rows = new Array(length);
+			for (let i = 0; i < length; i++) {
+				const row = new Array(columns.length);
+				for (let j = 0; j < columns.length; j++) {
+					row[j] = columns[j] === null || isNaN(columns[j][i]) ? null : columns[j][i];
+				}
+				rows[i] = row;
+			}
+
+			series[id].columns = columns;
+			series[id].data = rows;
+
+		}
+
+	};
+
+	if (data.hasOwnProperty('series')) {
+		decodeSeries(data.series);
+	}
+
+	if (Array.isArray(data.files)) {
+		for (let f of data.files) {
+			if (f && f.hasOwnProperty('series')) {
+				decodeSeries(f.series);
+			}
+		}
+	}
+
+	return data;
+
+};
+
+const callbackCaller = function(callback, path, binary) {
 	return function() {
 
 		if (this.readyState === 4 && this.status === 200) {
 
-			// JSON-decode the response
+			// Decode the response
 			let data = {};
-			if (this.responseText.length > 0) {
+			if (binary) {
+				if (this.response && this.response.byteLength > 0) {
+					data = decodeBinaryPayload(this.response);
+				}
+			} else if (this.responseText.length > 0) {
 				data = JSON.parse(this.responseText);
 			}
 
@@ -151,22 +236,46 @@ const buildPathWithParams = function(path, params) {
 	return path;
 }
 
+// Executes a backend POST request with the object body sent as JSON. If binary
+// is set, the response is expected in the binary columnar wire format.
+RequestHandler.prototype._newJSONPostRequest = function(callback, path, body, binary) {
+
+	globalAppConfig.verbose && console.log("Sending request to " + path, body);
+
+	// Instantiate a new HTTP request object
+	let req = new XMLHttpRequest();
+
+	req.onreadystatechange = callbackCaller(callback, path, binary);
+
+	req.open("POST", path, true);
+	req.setRequestHeader('Content-Type', 'application/json');
+	if (binary) {
+		req.responseType = 'arraybuffer';
+	}
+	req.send(JSON.stringify(body));
+
+};
+
 // Executes a backend request. Takes an object params with name/value pairs.
 // The value may be either a string/string-convertible value or an array of
 // such values. In the latter case, the array will be passed in as a GET
-// parameter array of values.
-RequestHandler.prototype._newRequest = function(callback, path, params) {
+// parameter array of values. If binary is set, the response is expected in the
+// binary columnar wire format.
+RequestHandler.prototype._newRequest = function(callback, path, params, binary) {
 
 	globalAppConfig.verbose && console.log("Sending request to " + path, params);
 
 	// Instantiate a new HTTP request object
 	let req = new XMLHttpRequest();
 
-	req.onreadystatechange = callbackCaller(callback, path);
+	req.onreadystatechange = callbackCaller(callback, path, binary);
 
 	path = buildPathWithParams(path, params);
 	console.log(path);
 	req.open("GET", path, true);
+	if (binary) {
+		req.responseType = 'arraybuffer';
+	}
 	req.send();
 
 };
\ No newline at end of file
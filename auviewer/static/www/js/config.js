@@ -9,11 +9,17 @@ let globalAppConfig = {
 	// Maximum data points to hold per data series for realtime mode
 	M: 3000,
 
+	// Wire format of series data payloads: 'json', or 'binary' (columnar
+	// float64 buffers) or 'binary32' (columnar float32 value buffers) to
+	// receive series data in the binary columnar wire format.
+	dataWireFormat: 'json',
+
 	// Performance reporting thresholds, in milliseconds.
 	performanceReportingThresholdGeneral: 100,
 	performanceReportingThresholdTemplateSystem: 5,
 
 	// Backend request URLs
+	batchSeriesRangedDataURL: 'batch_series_ranged_data',
 	createAnnotationURL: 'create_annotation',
 	deleteAnnotationURL: 'delete_annotation',
 	detectPatternsURL: 'detect_patterns',
@@ -0,0 +1,105 @@
+"""Binary columnar wire format for series data payloads."""
+
+import numpy as np
+import simplejson
+import struct
+
+# Supported wire formats, mapped to the little-endian dtype of the value (i.e.
+# non-time) columns. Time columns are always encoded as float64, as float32
+# cannot represent epoch-scale times with sub-second precision.
+valueDtypes = {
+    'binary': '<f8',
+    'binary32': '<f4',
+}
+
+# Alignment, in bytes, of the header & each column buffer, so that the client
+# may create typed array views directly over the response buffer.
+alignment = 8
+
+def isBinaryFormat(fmt):
+    """Returns whether the requested format (e.g. the format request parameter) is a binary wire format."""
+    return fmt in valueDtypes
+
+def encodePayload(payload, fmt='binary'):
+    """
+    Encodes a payload with columnar series data (as produced by File.getInitialPayload,
+    File.getSeriesRangedOutput or Project.getBatchSeriesRangedOutput with columnar set) in the binary wire format. The
+    encoding is:
+
+        uint32 (little-endian) length in bytes of the header
+        header, as UTF-8 JSON
+        zero padding to an 8-byte boundary
+        column buffers, each starting at an 8-byte boundary
+
+    The header is the payload itself, with the data of each series replaced by
+    {"length": <number of rows>, "columns": [...]}, where each column is either null (a column which is null in every
+    row) or {"offset": <byte offset of the buffer from the start of the column buffers>, "dtype": "<f8" or "<f4"}.
+    Null values in the buffers are encoded as NaN. Series under the 'series' dict of each item of a 'files' list (as in
+    the batch output) are encoded the same way.
+    :param payload: payload dict containing a 'series' dict of series outputs with columnar data, or a 'files' list of
+        dicts containing such
+    :param fmt: wire format, one of the keys of valueDtypes
+    :return: the encoded payload as bytes
+    """
+    valueDtype = valueDtypes[fmt]
+
+    buffers = []
+    offset = 0
+
+    def encodeSeries(seriesOutputs):
+        nonlocal offset
+        encoded = {}
+        for seriesID, seriesOutput in seriesOutputs.items():
+
+            columns = []
+            length = 0
+            for i, col in enumerate(seriesOutput['data']):
+                if col is None:
+                    columns.append(None)
+                    continue
+                buf = np.ascontiguousarray(col, dtype='<f8' if i == 0 else valueDtype).tobytes()
+                length = len(col)
+                columns.append({'offset': offset, 'dtype': '<f8' if i == 0 else valueDtype})
+                buffers.append(buf)
+                offset += len(buf)
+                pad = -offset % alignment
+                if pad:
+                    buffers.append(b'\0' * pad)
+                    offset += pad
+
+            encoded[seriesID] = {**seriesOutput, 'data': {'length': length, 'columns': columns}}
+
+        return encoded
+
+    header = dict(payload)
+    if 'series' in payload or not isinstance(payload.get('files'), list):
+        header['series'] = encodeSeries(payload.get('series', {}))
+    if isinstance(payload.get('files'), list):
+        header['files'] = [{**f, 'series': encodeSeries(f['series'])} if isinstance(f, dict) and 'series' in f else f for f in payload['files']]
+
+    headerBytes = simplejson.dumps(header, ignore_nan=True).encode('utf-8')
+    prefix = struct.pack('<I', len(headerBytes)) + headerBytes
+    prefix += b'\0' * (-len(prefix) % alignment)
+
+    return b''.join([prefix] + buffers)
+
+def decodePayload(buf):
+    """
+    Decodes a payload encoded with encodePayload, returning the header with the data of each series as a list of
+    columns (NumPy arrays, or None). Mostly useful for testing & Python clients.
+    """
+    headerLength = struct.unpack_from('<I', buf)[0]
+    payload = simplejson.loads(bytes(buf[4:4 + headerLength]).decode('utf-8'))
+    start = 4 + headerLength
+    start += -start % alignment
+    seriesOutputs = list(payload.get('series', {}).values())
+    for f in payload.get('files', []) if isinstance(payload.get('files'), list) else []:
+        if isinstance(f, dict):
+            seriesOutputs.extend(f.get('series', {}).values())
+    for seriesOutput in seriesOutputs:
+        length = seriesOutput['data']['length']
+        seriesOutput['data'] = [
+            None if c is None else np.frombuffer(buf, dtype=c['dtype'], count=length, offset=start + c['offset'])
+            for c in seriesOutput['data']['columns']
+        ]
+    return payload
@@ -72,6 +72,10 @@ setup(
         'simplejson',
         'sqlalchemy>=2.0'
     ],
+    extras_require={
+        'compression': ['brotli', 'zstandard'],
+        'production': ['gunicorn', 'uvicorn'],
+    },
     packages=find_packages(),
     setup_requires=['numpy'],
     python_requires='>=3.7',
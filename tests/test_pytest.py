@@ -1,5 +1,26 @@
+import audata
+import flask
+import gzip
+import h5py
+import json
+import numpy as np
+import os
+import pandas as pd
 import pytest
+import shutil
+import simplejson
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from auviewer import cylib, nplib
+from auviewer.api import downsampleFile
+from auviewer.scheduler import DownsampleScheduler
 from auviewer import file as auvfile
+from auviewer import catalog, compression, jsonstream, models, slicecache, wireformat
+from auviewer.config import config
+from auviewer.project import Project
 
 @pytest.fixture
 def f():
@@ -7,6 +28,27 @@ def f():
     yield f
     del f
 
+@pytest.fixture
+def project(tmp_path):
+    # Yields a function which instantiates a project of the file records given
+    # (see Project.setFileRecords) through its catalog path, against a fresh
+    # database. The project's files are closed after the test.
+    app = flask.Flask(__name__)
+    app.config.update({
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'db.sqlite'}",
+    })
+    models.init_flask_app(app)
+    projects = []
+    def makeProject(records):
+        projects.append(Project(SimpleNamespace(id=1, name='project', path=str(tmp_path / 'project')), catalogFiles=records))
+        return projects[-1]
+    with app.app_context():
+        yield makeProject
+        for p in projects:
+            for f in p.getLoadedFiles():
+                f.close()
+
 def test_pattern_detection_high_threshold(f):
 
     expected = []
@@ -257,4 +299,584 @@ def test_pattern_detection_high_and_low_thresholds_drop_between(f):
         drop_values_above=None,
         drop_values_between=[-2.5, 2.5],
     )
-    assert patterns == expected
\ No newline at end of file
+    assert patterns == expected
+
+def test_downsample_engines_identical():
+
+    rng = np.random.default_rng(0)
+    rawTimes = np.sort(1.6e9 + np.arange(200000) / 500.0 + rng.normal(0, 1e-5, 200000))
+    rawValues = rng.normal(0, 1, 200000)
+
+    for numIntervals in [3000, 24000, 96000, 200000]:
+        expected = cylib.buildDownsampleFromRaw(rawTimes, rawValues, numIntervals)
+        intervals = nplib.buildDownsampleFromRaw(rawTimes, rawValues, numIntervals)
+        assert intervals.shape == expected.shape
+        assert intervals.tobytes() == expected.tobytes()
+
+def test_threshold_alerts_long_excursion():
+
+    # Hours of HR > 120 at 1 Hz among 5M points, with an hour-long duration.
+    # Each alert sample spans 3600 points, so scanning every sample anew would
+    # take 10^10 steps.
+    n = 5_000_000
+    rawTimes = np.arange(n, dtype=np.float64)
+    rawValues = np.full(n, 80.)
+    rawValues[1_000_000:4_000_000] = 130.
+
+    start = time.perf_counter()
+    alerts = cylib.generateThresholdAlerts(rawTimes, rawValues, 0, 120, 1, 3600., .8, 60., 0)
+    elapsed = time.perf_counter() - start
+
+    # Samples qualify until fewer than 80% of their 3600 points exceed 120
+    assert alerts.tolist() == [[1_000_000., 4_000_000. - 2880. + 3600.]]
+    assert elapsed < 5
+
+def test_downsamples_single_pass_identical():
+
+    rng = np.random.default_rng(0)
+    rawTimes = np.sort(1.6e9 + np.arange(200000) / 500.0 + rng.normal(0, 1e-5, 200000))
+    rawValues = rng.normal(0, 1, 200000)
+    timespan = rawTimes[-1] - rawTimes[0]
+    timePerIntervalsUp = [timespan / (3000 * 2 ** i) for i in range(5, 0, -1)]
+
+    # Build the downsamples one level at a time, as a reference
+    expected = [cylib.buildDownsampleFromRaw(rawTimes, rawValues, 3000 * 2 ** 5)]
+    for timePerInterval in timePerIntervalsUp:
+        expected.append(cylib.buildNextDownsampleUp(expected[-1], timePerInterval, 2))
+
+    for buildDownsamples in [cylib.buildDownsamplesFromRaw, nplib.buildDownsamplesFromRaw]:
+        downsamples = buildDownsamples(rawTimes, rawValues, 3000 * 2 ** 5, timePerIntervalsUp, 2)
+        assert len(downsamples) == len(expected)
+        for intervals, expectedIntervals in zip(downsamples, expected):
+            assert intervals.tobytes() == expectedIntervals.tobytes()
+
+def test_downsamples_chunked_identical():
+
+    rng = np.random.default_rng(0)
+    rawTimes = np.sort(1.6e9 + np.arange(200000) / 500.0 + rng.normal(0, 1e-5, 200000))
+    rawValues = rng.normal(0, 1, 200000)
+    timespan = rawTimes[-1] - rawTimes[0]
+    timePerIntervalsUp = [timespan / (3000 * 2 ** i) for i in range(5, 0, -1)]
+
+    expected = cylib.buildDownsamplesFromRaw(rawTimes, rawValues, 3000 * 2 ** 5, timePerIntervalsUp, 2)
+
+    # Add the raw data in blocks, taking the intervals completed after each
+    builder = cylib.DownsampleBuilder(rawTimes[0], timespan / (3000 * 2 ** 5), 3000 * 2 ** 5, timePerIntervalsUp, 2, 7001)
+    downsamples = [[] for _ in expected]
+    for blockStart in range(0, rawTimes.shape[0], 7001):
+        builder.addRaw(rawTimes[blockStart:blockStart+7001], rawValues[blockStart:blockStart+7001])
+        for k, intervals in enumerate(builder.takeDownsamples()):
+            downsamples[k].append(intervals)
+    for k, intervals in enumerate(builder.finish()):
+        downsamples[k].append(intervals)
+
+    for intervals, expectedIntervals in zip(downsamples, expected):
+        assert np.concatenate(intervals).tobytes() == expectedIntervals.tobytes()
+
+def test_slice_param_indexed():
+
+    f = audata.File.open('data/sample_file.h5', return_datetimes=False)
+    ds = f['series_1']
+    times = ds.hdf.fields('time')[:].astype(np.float64)
+
+    rng = np.random.default_rng(0)
+    targets = np.concatenate((rng.uniform(times[0] - 10, times[-1] + 10, 50), times[[0, 1, 999, 1000, -1]]))
+    for stride in [7, 1000, 20000]:
+        for target in targets:
+            assert cylib.getSliceParamIndexed(ds, 'time', 0, target, times[::stride].copy(), stride) == np.searchsorted(times, target, side='left')
+            assert cylib.getSliceParamIndexed(ds, 'time', 1, target, times[::stride].copy(), stride) == np.searchsorted(times, target, side='right')
+    f.close()
+
+def test_downsample_file_parallel_identical(tmp_path):
+
+    (tmp_path / 'serial').mkdir()
+    (tmp_path / 'parallel').mkdir()
+    downsampleFile('data/sample_file.h5', str(tmp_path / 'serial'))
+    downsampleFile('data/sample_file.h5', str(tmp_path / 'parallel'), jobs=2)
+
+    def readDatasets(path):
+        datasets = {}
+        with h5py.File(path, 'r') as f:
+            f.visititems(lambda name, obj: datasets.__setitem__(name, obj[()].tobytes()) if isinstance(obj, h5py.Dataset) else None)
+        return datasets
+
+    serial = readDatasets(tmp_path / 'serial' / 'sample_file_processed.h5')
+    assert len(serial) > 0
+    assert readDatasets(tmp_path / 'parallel' / 'sample_file_processed.h5') == serial
+
+def test_downsample_file_extended_identical(tmp_path):
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'time': 1.6e9 + np.arange(200000) / 500.0, 'value': rng.normal(0, 1, 200000)})
+
+    f = audata.File.new(str(tmp_path / 'growing.h5'), return_datetimes=False)
+    f['data'] = df.iloc[:120000].copy()
+    f.close()
+    downsampleFile(str(tmp_path / 'growing.h5'), str(tmp_path))
+    with h5py.File(tmp_path / 'growing_processed.h5', 'r') as pf:
+        state = json.loads(pf['data/value'].attrs['.meta'])
+
+    # Append to the original in two steps, updating the downsamples after each
+    for blockStart, blockStop in [(120000, 150000), (150000, 200000)]:
+        f = audata.File.open(str(tmp_path / 'growing.h5'), readonly=False, return_datetimes=False)
+        f['data'].append(df.iloc[blockStart:blockStop].copy())
+        f.close()
+        downsampleFile(str(tmp_path / 'growing.h5'), str(tmp_path))
+
+    # The extended downsamples are those built from all data at once with the
+    # interval sizes laid out by the first downsampling
+    b = state['builder']
+    builder = cylib.DownsampleBuilder(b['baseOffset'], b['timePerInterval'], 200000, [l['timePerIntervalOrig'] for l in b['levels']], 2)
+    builder.addRaw(df['time'].values, df['value'].values)
+    expected = builder.finish()
+
+    with h5py.File(tmp_path / 'growing_processed.h5', 'r') as pf:
+        assert json.loads(pf['data/value'].attrs['.meta'])['rawRows'] == 200000
+        for k, expectedIntervals in enumerate(expected):
+            intervals = pf['data/value'][str((-1 - k) % len(expected))][()]
+            assert np.stack([intervals['0'], intervals['1'], intervals['2']], axis=1).tobytes() == expectedIntervals.tobytes()
+
+def test_downsample_file_updated_while_open(tmp_path):
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'time': 1.6e9 + np.arange(200000) / 500.0, 'value': rng.normal(0, 1, 200000)})
+
+    f = audata.File.new(str(tmp_path / 'growing.h5'), return_datetimes=False)
+    f['data'] = df.iloc[:120000].copy()
+    f.close()
+    downsampleFile(str(tmp_path / 'growing.h5'), str(tmp_path))
+
+    # A viewer holds the processed file open while the original grows and the
+    # processed file is updated
+    viewer = auvfile.File(None, -1, tmp_path / 'growing.h5', tmp_path / 'growing_processed.h5')
+    try:
+        s = viewer.series[0]
+        start, stop = df['time'].iloc[0], df['time'].iloc[-1]
+        before = viewer.getSeriesRangedOutput([s.id], start, stop)['series'][s.id]['data']
+
+        f = audata.File.open(str(tmp_path / 'growing.h5'), readonly=False, return_datetimes=False)
+        f['data'].append(df.iloc[120000:].copy())
+        f.close()
+        downsampleFile(str(tmp_path / 'growing.h5'), str(tmp_path))
+        assert (tmp_path / 'growing_processed.h5').exists() and not (tmp_path / 'growing_processed.h5.update').exists()
+
+        # The viewer reopens the updated processed file
+        after = viewer.getSeriesRangedOutput([s.id], start, stop)['series'][s.id]['data']
+        assert after[-1][0] > before[-1][0]
+        expected = auvfile.File(None, -2, tmp_path / 'growing.h5', tmp_path / 'growing_processed.h5')
+        try:
+            assert after == expected.getSeriesRangedOutput([s.id], start, stop)['series'][s.id]['data']
+        finally:
+            expected.close()
+    finally:
+        viewer.close()
+
+def test_threshold_alerts_screened_identical(tmp_path):
+
+    rng = np.random.default_rng(0)
+    t = np.arange(300000) + rng.uniform(0, .5, 300000)
+    v = 75 + rng.normal(0, 4, 300000)
+    for start in rng.integers(0, 290000, 20):
+        v[start:start + rng.integers(60, 3000)] += 40
+    v[rng.integers(0, 300000, 1000)] = np.nan
+    df = pd.DataFrame({'time': t, 'value': v})
+
+    f = audata.File.new(str(tmp_path / 'hr.h5'), return_datetimes=False)
+    f['hr'] = df.iloc[:250000].copy()
+    f.close()
+    downsampleFile(str(tmp_path / 'hr.h5'), str(tmp_path))
+
+    # Data appended since downsampling can not be ruled out
+    f = audata.File.open(str(tmp_path / 'hr.h5'), readonly=False, return_datetimes=False)
+    f['hr'].append(df.iloc[250000:].copy())
+    f.close()
+
+    f = auvfile.File(None, -1, tmp_path / 'hr.h5', tmp_path / 'hr_processed.h5')
+    try:
+        _ = f.f
+        s = f.series[0]
+        for args, kwargs in [
+            ((0, 100, 1, 600., .8, 60.), {}),
+            ((0, 100, 1, 30., .5, 0.), {'drop_values_above': 130}),
+            ((50, 110, 2, 1800., .7, 600.), {'expected_frequency': 1, 'min_density': .5}),
+            ((60, 0, 0, 60., 1., 10.), {}),
+        ]:
+            assert np.array_equal(s.generateThresholdAlerts(*args, screen=True, **kwargs), s.generateThresholdAlerts(*args, **kwargs))
+        candidates = s.getThresholdAlertCandidates(0, 100, 1, 600.)
+        assert np.sum(np.minimum(candidates[:,1], t[-1]) - candidates[:,0]) < (t[-1] - t[0]) / 2
+    finally:
+        f.close()
+
+def test_downsample_ranged_output(tmp_path):
+
+    downsampleFile('data/sample_file.h5', str(tmp_path))
+    f = auvfile.File(None, -1, Path('data/sample_file.h5'), tmp_path / 'sample_file_processed.h5')
+    try:
+        _ = f.f
+        dss = f.series[0].dss
+        for dsi in range(dss.numDownsamples):
+            times = f.pf['/'.join(f.series[0].h5pathDownsample) + '/' + str(dsi)].hdf.fields('0')[:]
+            dss.whichDownsampleIndexForTimespan = lambda timespan: dsi
+            for start, stop in [(times[0], times[-1]), (times[10], times[10]), (times[3] + 0.1, times[-7] - 0.1), (times[-1] + 1, times[-1] + 2)]:
+                expected = times[np.searchsorted(times, start, side='left'):np.searchsorted(times, stop, side='right')]
+                assert np.array_equal(dss.getRangedOutput(start, stop)['0'].values, expected)
+    finally:
+        f.close()
+
+def test_slice_cache(tmp_path):
+
+    downsampleFile('data/sample_file.h5', str(tmp_path))
+    f = auvfile.File(None, -1, Path('data/sample_file.h5'), tmp_path / 'sample_file_processed.h5')
+    cache = slicecache.getSliceCache()
+    try:
+        _ = f.f
+        dss = f.series[0].dss
+        times = f.pf['/'.join(f.series[0].h5pathDownsample) + '/0'].hdf.fields('0')[:]
+        cache.clear()
+        expected = dss.getRangedOutput(times[0], times[-1])
+        misses = cache.getStats()['misses']
+        assert misses > 0 and cache.getStats()['hits'] == 0
+        assert dss.getRangedOutput(times[0], times[-1]).equals(expected)
+        assert cache.getStats()['hits'] == misses and cache.getStats()['misses'] == misses
+    finally:
+        f.close()
+    assert cache.getStats()['blocks'] == 0
+
+    # Least recently used blocks are evicted beyond the budget
+    small = slicecache.SliceCache(3 * 800)
+    for k in range(4):
+        small.put(k, np.zeros(100))
+    small.get(1)
+    small.put(4, np.zeros(100))
+    assert [small.get(k) is not None for k in range(5)] == [False, True, False, True, True]
+
+def test_raw_cache(tmp_path):
+
+    shutil.copy('data/sample_file.h5', tmp_path / 'sample_file.h5')
+    f = auvfile.File(None, -1, tmp_path / 'sample_file.h5', None)
+    cache = slicecache.getRawCache()
+    args = ('patterndetection', '/series_4:value', None, 2.5, 30, .7, 50)
+    try:
+        cache.clear()
+        expected = f.detectPatterns(*args)
+        assert cache.getStats()['misses'] == 1 and cache.getStats()['blocks'] == 1
+        assert f.detectPatterns(*args) == expected and cache.getStats()['hits'] == 1
+
+        # The data of a modified file is read again, replacing that cached
+        os.utime(tmp_path / 'sample_file.h5', ns=(0, 0))
+        assert f.detectPatterns(*args) == expected
+        assert cache.getStats()['misses'] == 2 and cache.getStats()['blocks'] == 1
+    finally:
+        f.close()
+        cache.clear()
+
+def test_file_payload_cache(tmp_path):
+
+    downsampleFile('data/sample_file.h5', str(tmp_path))
+    f = auvfile.File(None, -1, Path('data/sample_file.h5'), tmp_path / 'sample_file_processed.h5')
+    try:
+        _ = f.f
+        expected = json.loads(f.getCachedFilePayloadJSON())
+        assert f.payloadCacheFilePathObj.exists()
+        assert expected['series'].keys() == {s.id for s in f.series}
+
+        # Served from the cache file while the processed file is unchanged
+        mtime = f.payloadCacheFilePathObj.stat().st_mtime_ns
+        assert json.loads(f.getCachedFilePayloadJSON()) == expected
+        assert f.payloadCacheFilePathObj.stat().st_mtime_ns == mtime
+
+        # Rebuilt once the processed file is modified
+        os.utime(f.procFilePathObj, ns=(mtime + 10**9, mtime + 10**9))
+        assert json.loads(f.getCachedFilePayloadJSON()) == expected
+        with gzip.open(f.payloadCacheFilePathObj, 'rt') as fp:
+            assert fp.readline().strip() == str(mtime + 10**9)
+    finally:
+        f.close()
+
+def test_response_compression(tmp_path, monkeypatch):
+
+    monkeypatch.setitem(config, 'dataPathObj', tmp_path)
+    (tmp_path / 'static').mkdir()
+    (tmp_path / 'static' / 'app.js').write_text('var x = 1;\n' * 1000)
+
+    app = flask.Flask(__name__)
+    app.register_blueprint(flask.Blueprint('js', __name__, static_url_path='/js', static_folder=str(tmp_path / 'static')))
+    precompressed = compression.precompressStaticAssets({'js': str(tmp_path / 'static')})
+    assert precompressed[('js', 'app.js')]['gzip'].exists()
+
+    @app.route('/data')
+    def data():
+        return app.response_class(response=json.dumps({'n': flask.request.args.get('n', type=int) * [1.5]}), status=200, mimetype='application/json')
+
+    @app.route('/stream')
+    def stream():
+        n = flask.request.args.get('n', type=int)
+        return app.response_class(response=iter(['['] + [', '.join(['1.5'] * 10) + (', ' if i < n - 1 else '') for i in range(n)] + [']']), status=200, mimetype='application/json')
+
+    @app.after_request
+    def response_compress(response):
+        return compression.compressResponse(flask.request, response, precompressed)
+
+    client = app.test_client()
+    for path, expected in [('/data?n=1000', json.dumps({'n': 1000 * [1.5]}).encode()), ('/js/app.js', ('var x = 1;\n' * 1000).encode())]:
+        r = client.get(path, headers={'Accept-Encoding': 'gzip'})
+        assert r.headers['Content-Encoding'] == 'gzip' and gzip.decompress(r.data) == expected
+        r = client.get(path)
+        assert 'Content-Encoding' not in r.headers and r.data == expected
+
+    # Responses under the size threshold are not compressed
+    r = client.get('/data?n=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in r.headers
+
+    # Streamed responses are compressed as they are streamed, unless under the
+    # size threshold
+    r = client.get('/stream?n=100', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip' and gzip.decompress(r.data) == b'[' + b', '.join([b'1.5'] * 1000) + b']'
+    r = client.get('/stream?n=2', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in r.headers and r.data == b'[' + b', '.join([b'1.5'] * 20) + b']'
+
+def test_streamed_json_identical(tmp_path, monkeypatch):
+
+    monkeypatch.setattr(jsonstream, 'chunkRows', 7)
+    downsampleFile('data/sample_file.h5', str(tmp_path))
+    f = auvfile.File(None, -1, Path('data/sample_file.h5'), tmp_path / 'sample_file_processed.h5')
+    try:
+        _ = f.f
+        seriesids = [s.id for s in f.series]
+        times = f.series[0].rd.getDatasetReference().hdf.fields(f.series[0].timecol)[:]
+        # Downsampled and raw ranges
+        for start, stop in [(times[0], times[-1]), (times[100], times[140])]:
+            assert ''.join(f.iterSeriesRangedOutputJSON(seriesids, start, stop)) == simplejson.dumps(f.getSeriesRangedOutput(seriesids, start, stop), ignore_nan=True)
+        assert ''.join(f.iterFilePayloadJSON()) == simplejson.dumps(f.getFilePayload(), ignore_nan=True)
+    finally:
+        f.close()
+
+def test_batch_series_ranged_output(tmp_path, project):
+
+    downsampleFile('data/sample_file.h5', str(tmp_path))
+    project = project([(i, Path('data/sample_file.h5'), tmp_path / 'sample_file_processed.h5') for i in [1, 2]])
+    files = {i: project.getFile(i) for i in [1, 2]}
+    for f in files.values():
+        _ = f.f
+    seriesids = [s.id for s in files[1].series]
+    times = files[1].series[0].rd.getDatasetReference().hdf.fields(files[1].series[0].timecol)[:]
+    requests = [
+        {'file_id': 1, 'series': seriesids, 'start': times[0], 'stop': times[-1]},
+        {'file_id': 2, 'series': seriesids[:1], 'start': times[100], 'stop': times[140]},
+        {'file_id': 3, 'series': seriesids, 'start': times[0], 'stop': times[-1]},
+    ]
+    expected = [{'file_id': r['file_id'], **files[r['file_id']].getSeriesRangedOutput(r['series'], r['start'], r['stop'])} for r in requests[:2]]
+    expected.append({'file_id': 3, 'error': 'File not found.'})
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert project.getBatchSeriesRangedOutput(requests, executor) == expected
+        assert ''.join(project.iterBatchSeriesRangedOutputJSON(requests, executor)) == simplejson.dumps({'files': expected}, ignore_nan=True)
+    payload = wireformat.decodePayload(wireformat.encodePayload({'files': project.getBatchSeriesRangedOutput(requests, columnar=True)}))
+    assert [f['file_id'] for f in payload['files']] == [1, 2, 3] and payload['files'][2] == expected[2]
+    for output, e in zip(payload['files'][:2], expected[:2]):
+        assert list(output['series']) == list(e['series'])
+        for id, seriesOutput in output['series'].items():
+            rows = e['series'][id]['data']
+            assert np.array_equal(seriesOutput['data'][0], [r[0] for r in rows])
+
+def test_catalog_round_trip(tmp_path, monkeypatch):
+
+    monkeypatch.setitem(config, 'dataPathObj', tmp_path)
+    assert catalog.readCatalog() is None and catalog.catalogVersion() is None
+
+    def project(id, names):
+        fileRecords = [(10 * id + i, tmp_path / 'originals' / n, tmp_path / 'processed' / n) for i, n in enumerate(names)]
+        return SimpleNamespace(id=id, name=f"p{id}", projDirPathObj=tmp_path / f"p{id}", fileRecords=fileRecords)
+
+    catalog.writeCatalog([project(2, ['b.h5', 'a.h5']), project(1, [])])
+    version = catalog.catalogVersion()
+    assert catalog.readCatalog() == [
+        (1, 'p1', str(tmp_path / 'p1'), []),
+        (2, 'p2', str(tmp_path / 'p2'), [(21, tmp_path / 'originals' / 'a.h5', tmp_path / 'processed' / 'a.h5'), (20, tmp_path / 'originals' / 'b.h5', tmp_path / 'processed' / 'b.h5')]),
+    ]
+
+    time.sleep(0.01)
+    catalog.writeCatalog([project(1, ['c.h5'])])
+    assert catalog.catalogVersion() != version
+    assert [p[0] for p in catalog.readCatalog()] == [1]
+
+    catalog.requestPrioritization(tmp_path / 'a.h5')
+    catalog.requestPrioritization(tmp_path / 'a.h5')
+    assert catalog.takePrioritizationRequests() == [str((tmp_path / 'a.h5').resolve())]
+    assert catalog.takePrioritizationRequests() == []
+
+def test_series_catalog(tmp_path):
+
+    downsampleFile('data/sample_file.h5', str(tmp_path))
+    procFilePathObj = tmp_path / 'sample_file_processed.h5'
+    catalogued = auvfile.File(None, 1, Path('data/sample_file.h5'), procFilePathObj)
+    loaded = auvfile.File(None, 2, Path('data/sample_file.h5'), procFilePathObj)
+    try:
+        loaded.load()
+
+        # The series are set up without opening the original file, until raw
+        # data is requested
+        assert catalogued.getFilePayload() == loaded.getFilePayload()
+        assert catalogued.seriesCatalog is not None and catalogued._file is None
+        assert [s.getCatalogEntry() for s in catalogued.series] == [s.getCatalogEntry() for s in loaded.series]
+
+        s = loaded.series[0]
+        times = s.rd.getDatasetReference().hdf.fields(s.timecol)[:]
+        seriesids = [s.id for s in loaded.series]
+        assert catalogued.getSeriesRangedOutput(seriesids, times[100], times[120]) == loaded.getSeriesRangedOutput(seriesids, times[100], times[120])
+    finally:
+        catalogued.close()
+        loaded.close()
+
+def test_raw_column_store_identical(tmp_path, monkeypatch):
+
+    monkeypatch.setitem(config, 'rawColumnStore', True)
+    downsampleFile('data/sample_file.h5', str(tmp_path))
+    stored = auvfile.File(None, 1, Path('data/sample_file.h5'), tmp_path / 'sample_file_processed.h5')
+    hdf = auvfile.File(None, 2, Path('data/sample_file.h5'), tmp_path / 'sample_file_processed.h5')
+    try:
+        hdf.load()
+        for s in hdf.series:
+            s.rd._columns = False
+        times = hdf.series[0].rd.getDatasetReference().hdf.fields(hdf.series[0].timecol)[:]
+        for s in stored.series:
+            assert s.rd.columns is not None
+            for start, stop in [(times[0], times[-1]), (times[100], times[140]), (times[5] - 0.5, times[7] + 0.5), (times[-1] + 1, times[-1] + 2)]:
+                assert s.rd.getRangedOutput(start, stop) == hdf.getSeries(s.id).rd.getRangedOutput(start, stop)
+        assert stored._file is None
+    finally:
+        stored.close()
+        hdf.close()
+
+def test_project_files_lazy(tmp_path, project):
+
+    (tmp_path / 'b.h5').touch()
+    (tmp_path / 'c.h5').touch()
+    project = project([(i, tmp_path / n, tmp_path / f"{n}.processed") for i, n in enumerate(['c.h5', 'a.h5', 'b.h5'])])
+
+    assert [r[0] for r in project.listFiles()] == [1, 2, 0] and len(project.loadedFiles) == 0
+    f = project.getFile(2)
+    assert f.name == 'b.h5' and project.getFile(2) is f and project.getFileByName('b.h5') is f
+    assert project.getLoadedFiles() == [f] and project.getFile(3) is None
+
+    # Files whose original is missing are removed on verification, while those
+    # already accessed are kept
+    assert project.verifyFiles() == 1
+    assert [r[0] for r in project.listFiles()] == [2, 0] and project.getFile(2) is f and project.getFile(1) is None
+
+def test_project_detect_patterns_parallel(tmp_path, project):
+
+    records = []
+    for i, name in enumerate(['a.h5', 'b.h5', 'c.h5']):
+        shutil.copy('data/sample_file.h5', tmp_path / name)
+        downsampleFile(str(tmp_path / name), str(tmp_path))
+        records.append((i, tmp_path / name, tmp_path / f"{name[0]}_processed.h5"))
+    project = project(records)
+
+    args = ('patterndetection', ['/series_3:value', '/series_4:value'], None, 0, 30, .5, 50)
+    expected = project.detectPatterns(*args, processes=1)
+    assert len(expected) == 27 and list(expected['file_id'].unique()) == [0, 1, 2]
+
+    done = []
+    pdf = project.detectPatterns(*args, processes=2, progress=lambda d, t: done.append((d, t)))
+    pd.testing.assert_frame_equal(pdf, expected)
+    assert done == [(1, 3), (2, 3), (3, 3)]
+
+    cancel = threading.Event()
+    cancel.set()
+    assert len(project.detectPatterns(*args, processes=2, cancel=cancel)) == 0
+
+def test_project_sweep_patterns(tmp_path, project):
+
+    records = []
+    for i, name in enumerate(['a.h5', 'b.h5']):
+        shutil.copy('data/sample_file.h5', tmp_path / name)
+        records.append((i, tmp_path / name, tmp_path / f"{name[0]}_processed.h5"))
+    project = project(records)
+
+    series = ['/series_3:value', '/series_4:value']
+    paramsets = {
+        'high': {'thresholdlow': None, 'thresholdhigh': 0, 'duration': 30, 'persistence': .5, 'maxgap': 50},
+        'high-gapless': {'thresholdlow': None, 'thresholdhigh': 0, 'duration': 30, 'persistence': .5, 'maxgap': 0},
+        'both': {'thresholdlow': -2, 'thresholdhigh': 2, 'duration': 10, 'persistence': .3, 'maxgap': 5, 'drop_values_above': 3},
+    }
+    expected = pd.concat([project.detectPatterns('patterndetection', series, processes=1, **p).assign(param_set=k) for k, p in paramsets.items()], ignore_index=True)
+    expected = expected[['param_set'] + [c for c in expected.columns if c != 'param_set']]
+    assert len(expected) > 0 and expected['param_set'].nunique() == 3
+    for processes in [1, 2]:
+        pd.testing.assert_frame_equal(project.sweepPatterns('patterndetection', series, paramsets, processes=processes), expected)
+
+def test_wire_format_round_trip(tmp_path):
+
+    downsampleFile('data/sample_file.h5', str(tmp_path))
+    f = auvfile.File(None, -1, Path('data/sample_file.h5'), tmp_path / 'sample_file_processed.h5')
+    try:
+        _ = f.f
+        s = f.series[0]
+        times = s.rd.getDatasetReference().hdf.fields(s.timecol)[:]
+        seriesids = [s.id]
+        # Downsampled and raw ranges
+        for start, stop in [(times[0], times[-1]), (times[100], times[140])]:
+            expected = f.getSeriesRangedOutput(seriesids, start, stop)
+            for fmt in ['binary', 'binary32']:
+                payload = wireformat.decodePayload(wireformat.encodePayload(f.getSeriesRangedOutput(seriesids, start, stop, columnar=True), fmt))
+                output = payload['series'][s.id]
+                assert {k: v for k, v in output.items() if k != 'data'} == {k: v for k, v in expected['series'][s.id].items() if k != 'data'}
+                rows = expected['series'][s.id]['data']
+                assert len(output['data']) == len(rows[0])
+                for j, col in enumerate(output['data']):
+                    column = np.array([r[j] for r in rows], dtype=np.float64)
+                    if col is None:
+                        assert np.all(np.isnan(column))
+                    else:
+                        assert np.array_equal(col, column if j == 0 else column.astype(col.dtype), equal_nan=True)
+    finally:
+        f.close()
+
+def test_downsample_scheduler_prioritizes(tmp_path):
+
+    (tmp_path / 'out').mkdir()
+    for name in ['first.h5', 'second.h5', 'third.h5']:
+        shutil.copy('data/sample_file.h5', tmp_path / name)
+
+    scheduler = DownsampleScheduler(downsampleFile, 1)
+    try:
+        for name in ['first.h5', 'second.h5', 'third.h5']:
+            scheduler.schedule(str(tmp_path / name), str(tmp_path / 'out'))
+        assert scheduler.prioritize(str(tmp_path / 'third.h5'))
+        assert scheduler.getFileStatus(str(tmp_path / 'third.h5'))['position'] == 0
+        while scheduler.getStatus()['done'] + scheduler.getStatus()['failed'] < 3:
+            time.sleep(0.1)
+    finally:
+        scheduler.close()
+
+    status = scheduler.getStatus()
+    assert status['queue_depth'] == 0 and status['done'] == 3
+    assert [Path(f['file']).name for f in status['files']] == ['first.h5', 'third.h5', 'second.h5']
+    assert all((tmp_path / 'out' / name).exists() for name in ['first_processed.h5', 'second_processed.h5', 'third_processed.h5'])
+
+def test_downsample_scheduler_skips_failed_until_modified(tmp_path):
+
+    (tmp_path / 'out').mkdir()
+    (tmp_path / 'bad.h5').write_bytes(b'not an hdf5 file')
+
+    def waitFailed(n):
+        while scheduler.getStatus()['failed'] < n:
+            time.sleep(0.1)
+
+    scheduler = DownsampleScheduler(downsampleFile, 1)
+    try:
+        scheduler.schedule(str(tmp_path / 'bad.h5'), str(tmp_path / 'out'))
+        waitFailed(1)
+        endTime = scheduler.files[str((tmp_path / 'bad.h5').resolve())].endTime
+
+        # Not retried until the original is modified
+        scheduler.schedule(str(tmp_path / 'bad.h5'), str(tmp_path / 'out'))
+        assert scheduler.getFileStatus(str(tmp_path / 'bad.h5'))['state'] == 'failed'
+        assert scheduler.files[str((tmp_path / 'bad.h5').resolve())].endTime == endTime
+
+        os.utime(tmp_path / 'bad.h5', ns=(time.time_ns() + 10**9, time.time_ns() + 10**9))
+        scheduler.schedule(str(tmp_path / 'bad.h5'), str(tmp_path / 'out'))
+        waitFailed(1)
+        assert scheduler.files[str((tmp_path / 'bad.h5').resolve())].endTime != endTime
+    finally:
+        scheduler.close()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark the downsample engines against each other.
+
+For every series in the given AUViewer original files (by default, the sample
+files in the data folder), this builds all downsamples from raw data with each
+engine available in auviewer.downsampleset.downsampleEngines, as well as with
+the former level-by-level chain ('per-level': the finest downsample from raw,
+then each next one up from the previous), reports the timings, and verifies
+that every engine yields bit-identical intervals.
+
+Because the sample files are small, a synthetic 500 Hz waveform may be added to
+the run with --synthetic-points.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import audata
+import numpy as np
+
+from auviewer.config import config
+from auviewer.cylib import buildDownsampleFromRaw, buildNextDownsampleUp, numDownsamplesToBuild
+from auviewer.downsampleset import downsampleEngines
+
+
+def load_series(paths):
+    """Yield (name, raw times, raw values) for every series in the files."""
+    for path in paths:
+        f = audata.File.open(str(path), return_datetimes=False)
+        try:
+            for ds, _ in f.recurse():
+                data = ds[:]
+                if 'time' not in data.columns:
+                    continue
+                for valcol in (c for c in data.columns if c != 'time'):
+                    rawTimes = data['time'].values.astype(np.float64)
+                    rawValues = data[valcol].values.astype(np.float64)
+                    mask = ~np.isnan(rawValues)
+                    yield f"{path.name}:{ds.name}:{valcol}", rawTimes[mask], rawValues[mask]
+        finally:
+            f.close()
+
+
+def synthetic_series(num_points):
+    """Return a synthetic 500 Hz waveform with jittered epoch timestamps."""
+    rng = np.random.default_rng(0)
+    rawTimes = np.sort(1.6e9 + np.arange(num_points) / 500.0 + rng.normal(0, 1e-5, num_points))
+    rawValues = np.sin(np.arange(num_points) / 50.0) + rng.normal(0, 0.1, num_points)
+    return f"synthetic:{num_points}", rawTimes, rawValues
+
+
+def build_per_level(rawTimes, rawValues, numIntervals, timePerIntervalsUp, stepMultiplier):
+    """Build the downsamples one level at a time, finest first."""
+    downsamples = [buildDownsampleFromRaw(rawTimes, rawValues, numIntervals)]
+    for timePerInterval in timePerIntervalsUp:
+        downsamples.append(buildNextDownsampleUp(downsamples[-1], timePerInterval, stepMultiplier))
+    return downsamples
+
+
+def time_engine(engine, rawTimes, rawValues, numIntervals, timePerIntervalsUp, repeat):
+    """Return the best wall time over repeat runs and the downsamples built."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        downsamples = engine(rawTimes, rawValues, numIntervals, timePerIntervalsUp, config['stepMultiplier'])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, downsamples
+
+
+def identical(a, b):
+    """Return whether two lists of downsamples are bit-identical."""
+    return len(a) == len(b) and all(x.shape == y.shape and x.tobytes() == y.tobytes() for x, y in zip(a, b))
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Compare the downsample engines on AUViewer original files."
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        type=Path,
+        help="Original .h5 files to benchmark (default: the data folder samples)",
+    )
+    parser.add_argument(
+        "--synthetic-points",
+        type=int,
+        default=0,
+        help="Also benchmark a synthetic waveform with this many points",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of runs per engine; the best time is reported",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    files = args.files or sorted((Path(__file__).resolve().parent.parent / 'data').glob('*.h5'))
+    series = list(load_series(files))
+    if args.synthetic_points > 0:
+        series.append(synthetic_series(args.synthetic_points))
+
+    engines = {'per-level': build_per_level, **downsampleEngines}
+    print(f"{'series':<48} {'points':>10} {'intervals':>10} " + ' '.join(f"{e + ' (s)':>12}" for e in engines) + "  identical")
+
+    totals = {e: 0.0 for e in engines}
+    mismatches = 0
+    for name, rawTimes, rawValues in series:
+
+        # Benchmark all downsamples, as built during processing.
+        ndtb = numDownsamplesToBuild(rawTimes, config['M'], config['stepMultiplier'])
+        if ndtb < 1:
+            continue
+        numIntervals = config['M'] * config['stepMultiplier'] ** (ndtb - 1)
+        timespan = rawTimes[-1] - rawTimes[0]
+        timePerIntervalsUp = [timespan / (config['M'] * config['stepMultiplier'] ** i) for i in range(ndtb - 1, 0, -1)]
+
+        timings = {}
+        outputs = {}
+        for e in engines:
+            timings[e], outputs[e] = time_engine(engines[e], rawTimes, rawValues, numIntervals, timePerIntervalsUp, args.repeat)
+            totals[e] += timings[e]
+
+        reference = outputs['per-level']
+        same = all(identical(outputs[e], reference) for e in engines)
+        mismatches += 0 if same else 1
+
+        print(f"{name[-48:]:<48} {rawTimes.shape[0]:>10} {reference[0].shape[0]:>10} " + ' '.join(f"{timings[e]:>12.5f}" for e in engines) + f"  {'yes' if same else 'NO'}")
+
+    print(f"{'total':<48} {'':>10} {'':>10} " + ' '.join(f"{totals[e]:>12.5f}" for e in engines))
+
+    if mismatches > 0:
+        print(f"\nERROR: {mismatches} series yielded different intervals across engines.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
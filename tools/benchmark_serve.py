@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Load-test the data endpoints of the web application.
+
+This sets up a temporary data directory with a project holding the given
+original files (by default, the sample files in the data folder), downsamples
+them, and serves the app on a local port with the chosen server: 'werkzeug'
+(the threaded development server, as run by python -m auviewer.serve) or
+'asgi' (the ASGI app of auviewer.production under uvicorn, if installed). It
+then issues /series_ranged_data requests for random windows of random series
+from a number of concurrent clients, and reports the requests/sec and latency
+percentiles at each concurrency level.
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+
+def setup_data(datapath, paths):
+    """Create the data directory with a project of the original files, downsampled."""
+    from auviewer.api import downsampleFile
+    from auviewer.shared import getProcFNFromOrigFN
+
+    originals = datapath / 'projects' / 'benchmark' / 'originals'
+    processed = datapath / 'projects' / 'benchmark' / 'processed'
+    originals.mkdir(parents=True)
+    processed.mkdir()
+    for path in paths:
+        (originals / path.name).symlink_to(path.resolve())
+        downsampleFile(str(originals / path.name), str(processed))
+        assert (processed / getProcFNFromOrigFN(path)).exists()
+
+
+def create_app(datapath):
+    """Create the app with a benchmark user, returning it with the session cookie of the user."""
+    from auviewer import models
+    from auviewer.config import set_data_path
+    from auviewer.serve import createApp
+
+    set_data_path(str(datapath))
+    app = createApp(interactive=False)
+
+    with app.app_context():
+        user = models.User(email='benchmark@localhost', active=True, password='-')
+        models.db.session.add(user)
+        models.db.session.commit()
+        cookie = app.session_interface.get_signing_serializer(app).dumps({'_user_id': str(user.id), '_fresh': True})
+
+    return app, f"{app.config.get('SESSION_COOKIE_NAME', 'session')}={cookie}"
+
+
+def start_server(app, server, port, threads):
+    """Serve the app on a background thread, returning a function which stops it."""
+    if server == 'werkzeug':
+        from werkzeug.serving import make_server
+        httpd = make_server('127.0.0.1', port, app, threaded=True)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        return httpd.shutdown
+
+    import uvicorn
+    from auviewer.config import config
+    from auviewer.production import createASGIApp
+    config['requestThreads'] = threads
+    uvserver = uvicorn.Server(uvicorn.Config(createASGIApp(app=app), host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=uvserver.run, daemon=True)
+    thread.start()
+    while not uvserver.started:
+        time.sleep(0.05)
+
+    def stop():
+        uvserver.should_exit = True
+        thread.join()
+    return stop
+
+
+def series_windows(project):
+    """Return (file ID, series ID, first time, last time) for every series of the project's files."""
+    windows = []
+    for f in project.files:
+        _ = f.f
+        for s in f.series:
+            times = s.rd.getDatasetReference().hdf.fields(s.timecol)[:]
+            windows.append((f.id, s.id, float(times[0]), float(times[-1])))
+    return windows
+
+
+def run_load(url, cookie, project_id, windows, concurrency, duration, rng):
+    """Issue random ranged data requests from concurrent clients for the duration, returning the latencies."""
+    deadline = time.perf_counter() + duration
+    seeds = [rng.randrange(2 ** 32) for _ in range(concurrency)]
+
+    def client(seed):
+        crng = random.Random(seed)
+        latencies = []
+        while time.perf_counter() < deadline:
+            file_id, series, first, last = crng.choice(windows)
+            span = (last - first) * crng.choice([1, 0.5, 0.1, 0.01])
+            start = first + crng.random() * (last - first - span)
+            query = f"project_id={project_id}&file_id={file_id}&s[]={urllib.request.quote(series)}&start={start}&stop={start + span}"
+            req = urllib.request.Request(f"{url}/series_ranged_data?{query}", headers={'Cookie': cookie, 'Accept-Encoding': 'gzip'})
+            t0 = time.perf_counter()
+            with urllib.request.urlopen(req) as response:
+                response.read()
+            latencies.append(time.perf_counter() - t0)
+        return latencies
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return [l for latencies in executor.map(client, seeds) for l in latencies]
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Load-test the AUViewer data endpoints.",
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        type=Path,
+        help="AUViewer original .h5 files (default: the sample files in data/)",
+    )
+    parser.add_argument(
+        "--server",
+        choices=["werkzeug", "asgi"],
+        default="werkzeug",
+        help="server with which to serve the app (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16],
+        help="numbers of concurrent clients to test with (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=5,
+        help="seconds to run each concurrency level for (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=16,
+        help="request threads of the ASGI app (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="local port to serve on (default: %(default)s)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    paths = args.files
+    if not paths:
+        data_dir = Path(__file__).resolve().parent.parent / "data"
+        paths = sorted(data_dir.glob("*.h5"))
+    if not paths:
+        print("No files to benchmark.", file=sys.stderr)
+        return 1
+
+    from auviewer import api
+
+    with tempfile.TemporaryDirectory() as tmp:
+        datapath = Path(tmp) / 'auvdata'
+        setup_data(datapath, paths)
+        app, cookie = create_app(datapath)
+        project = next(iter(api.getProjects().values()))
+        windows = series_windows(project)
+
+        stop = start_server(app, args.server, args.port, args.threads)
+        try:
+            url = f"http://127.0.0.1:{args.port}"
+            rng = random.Random(0)
+            print(f"{len(windows)} series in {len(project.files)} files, served with {args.server}")
+            print(f"{'clients':>8} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+            for concurrency in args.concurrency:
+                latencies = np.array(run_load(url, cookie, project.id, windows, concurrency, args.duration, rng)) * 1000
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                print(f"{concurrency:>8} {len(latencies):>9} {len(latencies) / args.duration:>9.1f} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}")
+        finally:
+            stop()
+            if api.downsampleScheduler is not None:
+                api.downsampleScheduler.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())